@@ -121,6 +121,74 @@ def fix_kcat(x: str) -> str:
         x = re.sub(r'\b' + f'{unit}' + r'-1\b', unit + '^-1', x)
     return x
 
+_superscript_chars = '⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻'
+_superscript_repl = '0123456789+-'
+_km_acceptable_units = ['M', 'mM', 'µM', 'nM', 'pM']
+_kcat_acceptable_units = ['ms', 'millisecond', 's', 'sec', 'second', 'm', 'min', 'minute', 'h', 'hr', 'hour', 'day']
+
+def pl_fix_scientific_notation(x: pl.Expr) -> pl.Expr:
+    """
+    Vectorized fix_scientific_notation: each run of superscripts gets a single ^ prefix.
+    """
+    x = x.str.replace_all(f'([{_superscript_chars}]+)', r'^${1}')
+    return x.str.replace_many(list(_superscript_chars), list(_superscript_repl))
+
+def _pl_units(x: pl.Expr, allow: str) -> pl.Expr:
+    # same as ''.join(letter for letter in x if letter.isalpha() and letter not in allow)
+    return x.str.replace_all(rf'[^\p{{L}}]|[{allow}]', '')
+
+def pl_fix_km(df: pl.DataFrame, col: str = 'km') -> pl.DataFrame:
+    """
+    Vectorized fix_km. Rejected values become null, and strange units are recorded in _strange_km_units.
+    """
+    x = pl.col(col)
+    df = df.with_columns(
+        pl_fix_scientific_notation(x.cast(pl.Utf8).str.replace_all('\u03BC', '\u00B5', literal=True))
+        .str.replace_all(',', '', literal=True)
+        .str.replace_all(r'\bmm\b', 'mM')
+        .str.replace_all(r'\bnm\b', 'nM')
+        .str.replace_all(r'(?i)\b[puμµ]M\b', 'µM')
+        .str.replace_all(r'(?i)mol/L\b', 'M')
+    ).with_columns(
+        _pl_units(x, 'xX').alias('_units')
+    )
+    strange = (pl.col('_units') != '') & ~pl.col('_units').is_in(_km_acceptable_units)
+    rejected = strange & (x.str.contains('g/', literal=True) | x.str.contains('mg', literal=True))
+    _strange_km_units.update(df.filter(strange & ~rejected)['_units'].unique().to_list())
+    return df.with_columns(
+        pl.when(rejected).then(None).otherwise(x).alias(col)
+    ).drop('_units')
+
+def pl_fix_kcat(df: pl.DataFrame, col: str = 'kcat') -> pl.DataFrame:
+    """
+    Vectorized fix_kcat. Rejected values become null, and strange units are recorded in _strange_kcat_units.
+    """
+    x = pl.col(col)
+    df = df.with_columns(
+        pl_fix_scientific_notation(x.cast(pl.Utf8))
+        .str.replace_all(',', '', literal=True)
+        .str.replace_all('μ', 'µ', literal=True)
+    ).with_columns(
+        _pl_units(x, 'x').alias('_units')
+    )
+    strange = ((pl.col('_units') != '') & x.str.contains(r'\d')
+               & ~pl.col('_units').is_in(_kcat_acceptable_units))
+    bad = pl.any_horizontal(
+        [x.str.contains(unit, literal=True) for unit in ['mol', 'mg', 'U', '/g', 'l/', 'L']]
+        + [x.str.contains(r'\bM\b'), x.str.contains(r'(?i)\bmM\b|\bpM\b|\bµM\b|\bnM\b')]
+    )
+    _strange_kcat_units.update(df.filter(strange & ~bad)['_units'].unique().to_list())
+
+    # standardize hyphens
+    fixed = (x.str.replace_all('−', '-', literal=True).str.replace_all('–', '-', literal=True)
+             .str.replace_all("-'", '-1', literal=True)
+             .str.replace_all(r'\bsec\b', 's'))
+    for unit in _kcat_acceptable_units:
+        fixed = fixed.str.replace_all(r'\b' + unit + r'-1\b', unit + "^-1")
+    return df.with_columns(
+        pl.when(strange & bad).then(None).otherwise(fixed).alias(col)
+    ).drop('_units')
+
 standardize_mutants1_re = re.compile(rf"({amino3})-?(\d{{1,4}})(\s?→\s?| to |\s?>\s?|!)[ -]?({amino3})") # if arrow or "to", then it is unambiguously a point mutation.
     
 
@@ -304,6 +372,30 @@ def clean_columns_for_valid(df: pd.DataFrame, printme=True) -> pd.DataFrame:
 
     return df
 
+def pl_clean_columns_for_valid(df: pl.DataFrame, printme=True) -> pl.DataFrame:
+    """
+    Polars version of clean_columns_for_valid, with km and kcat fixed by vectorized expressions.
+    """
+    if 'turnover_number' in df.columns:
+        # brenda variant
+        return pl_prep_brenda_for_hungarian(df).with_columns(pl.col('pmid').cast(pl.Utf8))
+
+    # regular variant
+    if 'doi' in df.columns:
+        df = df.rename({'doi': 'pmid'})
+    if 'comments' in df.columns and 'variant' not in df.columns:
+        # could be a reformed brenda variant
+        df = df.rename({'comments': 'variant'})
+    df = pl_fix_kcat(pl_fix_km(df))
+    if printme:
+        print("Strange kcat units", _strange_kcat_units)
+        print("Strange km units", _strange_km_units)
+
+        if 'μM' in _strange_km_units:
+            raise AssertionError("HOW did mu (μ) not get replaced?")
+    assert 'pmid' in df.columns
+    return df.with_columns(pl.col('pmid').cast(pl.Utf8))
+
 # def clean_columns_for_valid(df: pd.DataFrame) -> pd.DataFrame:
 #     df.dropna(subset=["kcat", "km"], how='all', inplace=True)
 #     # df.reset_index(drop=True, inplace=True)
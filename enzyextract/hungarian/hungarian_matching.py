@@ -1,7 +1,9 @@
 import pandas as pd
 import numpy as np
+import polars as pl
 from scipy.optimize import linear_sum_assignment
 from difflib import SequenceMatcher
+from functools import lru_cache
 import re
 
 from enzyextract.hungarian.postmatched_utils import left_shift_pmid
@@ -107,24 +109,48 @@ def parse_value_and_unit(value_str):
     return value * exponent_factor, None, None
     
 
-def convert_to_true_value(value, unit, sigfigs=None):
-    kcat_conversions = {
-        "ms^-1": 1000.0,
-        "s^-1": 1.0,
-        "sec^-1": 1.0,
-        "min^-1": 1/60,
-        "m^-1": 1/60,
-        "hr^-1": 1/3600,
-        "h^-1": 1/3600
-    }
-    km_conversions = {
-        "M": 1.0,
-        "mM": 1e-3,
-        "µM": 1e-6, # micro sign, u+00b5
-        "μM": 1e-6, # mu sign, u+03bc
-        "nM": 1e-9
+# the same kcat/km strings recur across papers and across every cell pair of the similarity matrices
+PARSE_CACHE_SIZE = 2**16
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def cached_parse_value_and_unit(value_str):
+    """
+    parse_value_and_unit, memoized in a bounded LRU cache. See parse_cache_stats.
+    """
+    return parse_value_and_unit(value_str)
+
+def parse_cache_stats() -> dict:
+    """
+    Hits, misses and hit rate of cached_parse_value_and_unit.
+    """
+    info = cached_parse_value_and_unit.cache_info()
+    total = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': info.hits / total if total else 0.0,
+        'size': info.currsize,
+        'maxsize': info.maxsize,
     }
-    
+
+kcat_conversions = {
+    "ms^-1": 1000.0,
+    "s^-1": 1.0,
+    "sec^-1": 1.0,
+    "min^-1": 1/60,
+    "m^-1": 1/60,
+    "hr^-1": 1/3600,
+    "h^-1": 1/3600
+}
+km_conversions = {
+    "M": 1.0,
+    "mM": 1e-3,
+    "µM": 1e-6, # micro sign, u+00b5
+    "μM": 1e-6, # mu sign, u+03bc
+    "nM": 1e-9
+}
+
+def convert_to_true_value(value, unit, sigfigs=None):
     if unit in kcat_conversions:
         return value * kcat_conversions[unit]
     elif unit in km_conversions:
@@ -133,8 +159,93 @@ def convert_to_true_value(value, unit, sigfigs=None):
         return float(value)
     return value
 
-    
-    
+
+parsed_value_dtype = pl.Struct({
+    'mantissa': pl.Float64,
+    'unit': pl.Utf8,
+    'exponent': pl.Int64,
+    'sigfigs': pl.UInt32,
+    'value': pl.Float64,
+    'true_value': pl.Float64,
+})
+
+def pl_parse_values_and_units(values: pl.Series) -> pl.Series:
+    """
+    Vectorized parse_value_and_unit + convert_to_true_value, for a series of kinetic strings.
+
+    Returns a struct series (see parsed_value_dtype) with fields:
+    - mantissa: the leading number (1.0 for strings like 10^-4)
+    - unit
+    - exponent: the power of 10 (0 if there is none)
+    - sigfigs: calc_sigfigs of the mantissa
+    - value: mantissa * 10^exponent, ie. the value from parse_value_and_unit
+    - true_value: the value from convert_to_true_value
+
+    All fields are null where parse_value_and_unit would return (None, None, None).
+    """
+    # each step is its own with_columns: polars re-evaluates subexpressions shared by a single large expression
+    s = pl.col('s')
+    df = pl.DataFrame({'s': values.cast(pl.Utf8).str.replace_all("μ", "µ", literal=True)}) # mu -> micro
+    df = df.with_columns(
+        # (?s)^(.*?) captures everything before the first match, ie. the mantissa part
+        caret=s.str.extract_groups(r"(?s)^(?P<mantissa>.*?)10\^(?P<exponent>-?\d+)"),
+        cross=s.str.extract_groups(r"(?s)^(?P<mantissa>.*?)[x×]\s*10(?P<exponent>-?\d+)"),
+        sci=s.str.extract_groups(r"(?si)^(?P<mantissa>.*?\d)e(?P<exponent>-?\d+)"), # keep the digit before e
+        has_exponent=s.str.contains("10^", literal=True) | s.str.contains("x", literal=True)
+                     | s.str.contains("×", literal=True),
+        has_e=s.str.contains("e", literal=True),
+        # only used to detect the unit
+        unit_str=s.str.replace(r"(m)ol L\^-1$", "${1}M"),
+    ).with_columns(
+        mantissa_part=pl.when('has_exponent').then(pl.coalesce(
+            pl.col('caret').struct['mantissa'], pl.col('cross').struct['mantissa'], s
+        )).when('has_e').then(pl.coalesce(pl.col('sci').struct['mantissa'], s)).otherwise(s),
+        exponent=pl.when('has_exponent').then(pl.coalesce(
+            pl.col('caret').struct['exponent'], pl.col('cross').struct['exponent']
+        )).when('has_e').then(pl.col('sci').struct['exponent']),
+    ).with_columns(
+        # (the ± and " -- " range splitting never changes the leading number)
+        number=pl.col('mantissa_part').str.extract(r"^(\d+(?:\.\d+)?)", 1),
+    ).with_columns(
+        mantissa=pl.when(pl.col('number').is_not_null()).then(pl.col('number').cast(pl.Float64))
+        .when(pl.col('mantissa_part') == '').then(1.0),
+    )
+
+    # last step: detect unit
+    candidates = [(pl.col('unit_str').str.contains(valid_unit, literal=True), valid_unit) for valid_unit in valid_units]
+    time_canon = {'sec': 's', 'h': 'hr'}
+    for time_unit in ['s', 'sec', 'min', 'h', 'hr']:
+        canonic = time_canon.get(time_unit, time_unit)
+        candidates.append((
+            pl.col('unit_str').str.ends_with(f"/{time_unit}") | pl.col('unit_str').str.ends_with(f" per {time_unit}"),
+            canonic + '^-1'
+        ))
+    unit = pl.when(pl.col('mantissa').is_null()).then(None)
+    for condition, candidate in candidates:
+        unit = unit.when(condition).then(pl.lit(candidate))
+
+    df = df.with_columns(
+        unit.alias('unit'),
+        pl.when(pl.col('mantissa').is_not_null()).then(pl.col('exponent').cast(pl.Int64).fill_null(0)),
+        pl.col('number').str.replace_all(r"\D", "").str.strip_chars_start("0").str.len_chars().alias('sigfigs'),
+        # parse 1e{exponent} rather than taking a power, so that it is exactly the same float as 10 ** exponent
+        (pl.col('mantissa') * pl.concat_str(pl.lit("1e"), 'exponent').cast(pl.Float64).fill_null(1.0)).alias('value'),
+    ).with_columns(
+        (pl.col('value') * pl.col('unit').replace_strict(
+            kcat_conversions | km_conversions, default=1.0, return_dtype=pl.Float64
+        )).alias('true_value'),
+    )
+    return df.select(
+        pl.when(s.is_not_null()).then(pl.struct(*parsed_value_dtype.to_schema())).alias(values.name)
+    ).to_series()
+
+def pl_parse_value_and_unit(x: pl.Expr) -> pl.Expr:
+    """
+    Expression version of pl_parse_values_and_units.
+    """
+    return x.map_batches(pl_parse_values_and_units, return_dtype=parsed_value_dtype, is_elementwise=True)
+
+
 def float_similarity(a, b):
     """
     Range: [0, 1]
@@ -209,8 +320,8 @@ def value_similarity(a, b, value_name='kcat'):
         
     
     
-    a_mantissa, a_unit, a_sigfigs = parse_value_and_unit(a)
-    b_mantissa, b_unit, b_sigfigs = parse_value_and_unit(b)
+    a_mantissa, a_unit, a_sigfigs = cached_parse_value_and_unit(a)
+    b_mantissa, b_unit, b_sigfigs = cached_parse_value_and_unit(b)
     
     a_unit, b_unit = assign_default_units(a_unit, b_unit, value_name)
     
@@ -417,8 +528,8 @@ def feedback_for_match(a, b, col_name):
     """
     if pd.isna(a) or pd.isna(b):
         return ''
-    a_mantissa, a_unit, a_sigfigs = parse_value_and_unit(a)
-    b_mantissa, b_unit, b_sigfigs = parse_value_and_unit(b)
+    a_mantissa, a_unit, a_sigfigs = cached_parse_value_and_unit(a)
+    b_mantissa, b_unit, b_sigfigs = cached_parse_value_and_unit(b)
     
     feedback = []
 
@@ -9,7 +9,7 @@ This is because BRNEDA does not always provide tuples (kcat, km) due to variatio
 import math
 import polars as pl
 
-from enzyextract.hungarian.hungarian_matching import convert_to_true_value, parse_value_and_unit
+from enzyextract.hungarian.hungarian_matching import convert_to_true_value, cached_parse_value_and_unit
 
 def mantissa_exponent_similarity(a, b, alpha=0.9, beta=0.2, base=10):
     
@@ -154,14 +154,14 @@ def match_by_unique_numeric(df1: pl.DataFrame, df2: pl.DataFrame, col_names: lis
             for s in set1:
                 if s is None:
                     continue
-                value, unit, _ = parse_value_and_unit(s)
+                value, unit, _ = cached_parse_value_and_unit(s)
                 if value is None:
                     continue
                 result1.append(convert_to_true_value(value, unit))
             for s in set2:
                 if s is None:
                     continue
-                value, unit, _ = parse_value_and_unit(s)
+                value, unit, _ = cached_parse_value_and_unit(s)
                 if value is None:
                     continue
                 result2.append(convert_to_true_value(value, unit))
@@ -227,7 +227,7 @@ def match_by_unique_kcat_km(df1: pl.DataFrame, df2: pl.DataFrame, pmid_col='pmid
                 for s in set_:
                     if s is None:
                         continue
-                    value, unit, _ = parse_value_and_unit(s)
+                    value, unit, _ = cached_parse_value_and_unit(s)
                     if value is None:
                         continue
                     dict_[convert_to_true_value(value, unit)] = s
@@ -1,7 +1,6 @@
 import polars as pl
 
-from enzyextract.hungarian.hungarian_matching import parse_value_and_unit
-from enzyextract.hungarian.hungarian_matching import convert_to_true_value
+from enzyextract.hungarian.hungarian_matching import pl_parse_value_and_unit
 from enzyextract.metrics.get_perfects import broad_na, is_numlike
 
 def precision_recall(df):
@@ -63,10 +62,7 @@ def mean_log_relative_ratio(df: pl.DataFrame, col_name: str) -> float:
     """
     # Create expression to parse both columns
     def parse_col(col: str) -> pl.Expr:
-        def to_true(x):
-            value, unit, _ = parse_value_and_unit(x)
-            return convert_to_true_value(value, unit)
-        return pl.col(col).map_elements(to_true, return_dtype=pl.Float64)
+        return pl_parse_value_and_unit(pl.col(col)).struct.field('true_value').alias(col)
     
     # Calculate MAPE using Polars expressions
 
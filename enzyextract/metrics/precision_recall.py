@@ -3,7 +3,7 @@ from typing import Callable, Optional
 import polars as pl
 import polars.selectors as cs
 
-from enzyextract.hungarian.hungarian_matching import convert_to_true_value, parse_value_and_unit
+from enzyextract.hungarian.hungarian_matching import pl_parse_values_and_units
 from enzyextract.hungarian.pl_hungarian_match import join_optimally
 from enzyextract.metrics.mantissa_distances import within_tolerance
 
@@ -14,30 +14,8 @@ def extract_value_and_unit_df(df: pl.DataFrame, col_name: str) -> pl.DataFrame:
     
     If col_name == 'kcat', then the returned dataframe will have columns 'kcat.value', 'kcat.unit', and 'kcat.true_value'.
     """
-    def _wrap_parse_value_and_unit(x):
-        value, unit, _ = parse_value_and_unit(x)
-        true_value = convert_to_true_value(value, unit)
-        return {
-            'value': float(value) if isinstance(value, int) else value,
-            'unit': unit,
-            'true_value': true_value,
-            # 'log_true_value': math.log10(true_value) if true_value is not None and true_value > 0 else None,
-        }
-    df = df.with_columns(
-        pl.col(col_name)
-        .map_elements(
-            _wrap_parse_value_and_unit,
-            return_dtype=pl.Struct(
-                {
-                    'value': pl.Float64,
-                    'unit': pl.Utf8,
-                    'true_value': pl.Float64,
-                    # 'log_true_value': pl.Float64,
-                }
-            )
-        ).name.prefix_fields(col_name + '.').alias(col_name + '.')
-    )
-    df = df.unnest(col_name + '.')
+    parsed = pl_parse_values_and_units(df[col_name]).struct.unnest()
+    df = df.hstack(parsed.select(pl.col('value', 'unit', 'true_value').name.prefix(col_name + '.')))
     return df
 
 def _join_closest_asof(gpt_df: pl.DataFrame, truth_df: pl.DataFrame, context_cols, val_col, tolerance=None) -> pl.DataFrame:
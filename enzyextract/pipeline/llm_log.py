@@ -1,6 +1,9 @@
 import base64
 import hashlib
 import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Optional
 import polars as pl
 
 
@@ -16,6 +19,7 @@ llm_log_schema = {
     'structured': pl.Boolean,
     # 'prompt': pl.Utf8,
     'prompt_hash': pl.Utf8,
+    'batch_hash': pl.Utf8, # hash of the batch file's contents. see submit_coordinator.shard_hash
 
     'file_uuid': pl.Utf8, # filename given by openai
     'batch_uuid': pl.Utf8, # batch id given by openai
@@ -26,10 +30,95 @@ llm_log_schema = {
     'completion_fpath': pl.Utf8, # where the completion is stored
 }
 
+# a (namespace, version, shard) or batch_uuid lookup on a .tsv or .parquet log means reading the whole file,
+# and every update rewrites it. A log at *.sqlite (or *.db) is a sqlite database instead:
+# indexed lookups, single-row updates, and transactions so that concurrent writers do not clobber each other.
+# Paths are stored whole (no _enzy_prefix). See migrate_log.
+sqlite_log_suffixes = ('.sqlite', '.db')
+_sqlite_columns = [x for x in llm_log_schema if x != '_enzy_prefix']
+_sqlite_types = {pl.Utf8: 'TEXT', pl.UInt32: 'INTEGER', pl.Boolean: 'INTEGER'}
+
+def is_sqlite_log(log_location: str) -> bool:
+    return log_location.endswith(sqlite_log_suffixes)
+
+def _connect_sqlite_log(log_location: str) -> sqlite3.Connection:
+    # autocommit: transactions are explicit (see _sqlite_transaction)
+    con = sqlite3.connect(log_location, timeout=60, isolation_level=None)
+    con.execute('PRAGMA journal_mode=WAL') # readers do not block the writer
+    columns = ', '.join(f'{x} {_sqlite_types[llm_log_schema[x]]}' for x in _sqlite_columns)
+    con.execute(f'CREATE TABLE IF NOT EXISTS llm_log (_rowid INTEGER PRIMARY KEY AUTOINCREMENT, {columns})')
+    con.execute('CREATE INDEX IF NOT EXISTS llm_log_key ON llm_log (namespace, version, shard)')
+    con.execute('CREATE INDEX IF NOT EXISTS llm_log_batch_uuid ON llm_log (batch_uuid)')
+    return con
+
+@contextmanager
+def _sqlite_transaction(log_location: str):
+    """
+    A write transaction. BEGIN IMMEDIATE takes the write lock up front,
+    so concurrent writers wait for each other (up to the timeout) instead of failing midway.
+    """
+    con = _connect_sqlite_log(log_location)
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            yield con
+        except BaseException:
+            con.execute('ROLLBACK')
+            raise
+        con.execute('COMMIT')
+    finally:
+        con.close()
+
+def _read_sqlite_log(log_location: str, where: str = '', params: tuple = ()) -> pl.DataFrame:
+    con = _connect_sqlite_log(log_location)
+    try:
+        rows = con.execute(f'SELECT {", ".join(_sqlite_columns)} FROM llm_log {where} ORDER BY _rowid', params).fetchall()
+    finally:
+        con.close()
+    log = pl.DataFrame(rows, schema={x: pl.Int64 if llm_log_schema[x] == pl.Boolean else llm_log_schema[x]
+                                     for x in _sqlite_columns}, orient='row')
+    return log.with_columns(pl.col('structured').cast(pl.Boolean))
+
+def _sqlite_values(record: dict) -> list:
+    return [record.get(x) for x in _sqlite_columns]
+
+def _write_sqlite_log(log: pl.DataFrame, log_location: str):
+    """Replace the contents of the log, in one transaction."""
+    log = pl.concat([pl.DataFrame(schema=llm_log_schema).drop('_enzy_prefix'), log], how='diagonal_relaxed')
+    with _sqlite_transaction(log_location) as con:
+        con.execute('DELETE FROM llm_log')
+        con.executemany(
+            f'INSERT INTO llm_log ({", ".join(_sqlite_columns)}) VALUES ({", ".join("?" * len(_sqlite_columns))})',
+            log.select(_sqlite_columns).iter_rows()
+        )
+
+def _upsert_sqlite_records(con: sqlite3.Connection, records: list[dict], insert_missing: bool = True):
+    """
+    Update the rows matching each record's (namespace, version, shard) like DataFrame.update does:
+    null values in the record leave the column as it was. Records that match nothing are inserted.
+    """
+    for record in records:
+        columns = [x for x in record if x in _sqlite_columns and x not in ('namespace', 'version', 'shard')]
+        assignments = ', '.join(f'{x} = COALESCE(?, {x})' for x in columns)
+        cursor = con.execute(
+            f'UPDATE llm_log SET {assignments} WHERE namespace = ? AND version = ? AND shard IS ?',
+            [record[x] for x in columns] + [record['namespace'], record['version'], record['shard']]
+        )
+        if cursor.rowcount == 0 and insert_missing:
+            con.execute(
+                f'INSERT INTO llm_log ({", ".join(_sqlite_columns)}) VALUES ({", ".join("?" * len(_sqlite_columns))})',
+                _sqlite_values(record)
+            )
+
 
 def read_log(log_location: str) -> pl.DataFrame:
     blank_log = pl.DataFrame(schema=llm_log_schema)
 
+    if is_sqlite_log(log_location):
+        if not os.path.exists(log_location):
+            return blank_log.drop('_enzy_prefix')
+        return _read_sqlite_log(log_location)
+
     if os.path.exists(log_location):
         # reorder
         if log_location.endswith('.parquet'):
@@ -40,6 +129,9 @@ def read_log(log_location: str) -> pl.DataFrame:
             log = pl.concat([blank_log, log], how='diagonal_relaxed')
     else:
         log = blank_log
+    if log['_enzy_prefix'].null_count() == log.height:
+        # no prefixes to apply (the usual case)
+        return log.drop('_enzy_prefix')
     log = log.with_columns(
         pl.col('_enzy_prefix').fill_null(''), # fill nulls with empty string
     )
@@ -52,31 +144,54 @@ def read_log(log_location: str) -> pl.DataFrame:
     return log
 
 
+_fpath_columns = ['batch_fpath', 'corresp_fpath', 'completion_fpath']
+
+def _enzy_prefix_rowwise(batch_fpath, corresp_fpath, completion_fpath) -> str:
+    """The _enzy_prefix of one row: the common prefix of its paths, if it ends with .enzy/"""
+    prefix = os.path.commonprefix([x for x in [batch_fpath, corresp_fpath, completion_fpath] if x is not None])
+    return prefix if prefix.endswith('.enzy/') else ''
+
+def _with_enzy_prefix(log: pl.DataFrame) -> pl.DataFrame:
+    """
+    Adds _enzy_prefix, the same as _enzy_prefix_rowwise but with polars expressions.
+
+    The common prefix ends with .enzy/ exactly when every path starts with the first path's prefix up to
+    and including its last .enzy/, and the paths diverge right after it (or one of them ends there).
+    That only holds if the first path has one .enzy/: nested .enzy/ folders (rare) go through os.path.commonprefix.
+    """
+    paths = [pl.col(x) for x in _fpath_columns]
+    # staged, so that the candidate is computed once rather than once per use
+    log = log.with_columns(
+        pl.coalesce(paths).str.extract(r'^(.*\.enzy/)', 1).alias('_candidate'),
+        (pl.coalesce(paths).str.count_matches('.enzy/', literal=True) > 1).fill_null(False).alias('_nested'),
+    )
+    candidate = pl.col('_candidate')
+    # the character after the candidate, per path ('' if the path ends there)
+    after = [x.str.slice(candidate.str.len_chars(), 1) for x in paths]
+    log = log.with_columns(
+        pl.all_horizontal([x.is_null() | x.str.starts_with(candidate) for x in paths]).alias('_shared'),
+        *[x.alias(f'_after{i}') for i, x in enumerate(after)],
+    )
+    after = [pl.col(f'_after{i}') for i in range(len(after))]
+    diverge = pl.any_horizontal(
+        [(x == '').fill_null(False) for x in after]
+        + [(after[i] != after[j]).fill_null(False) for i in range(3) for j in range(i + 1, 3)]
+    )
+    log = log.with_columns(
+        pl.when(candidate.is_not_null() & pl.col('_shared') & diverge).then(candidate).otherwise(pl.lit('')).alias('_enzy_prefix')
+    )
+    if log['_nested'].any():
+        nested_prefix = log.filter('_nested').select(
+            pl.struct(_fpath_columns).map_elements(lambda x: _enzy_prefix_rowwise(**x), return_dtype=pl.Utf8)
+        ).to_series()
+        log = log.with_columns(log['_enzy_prefix'].scatter(log['_nested'].arg_true(), nested_prefix))
+    return log.drop('_candidate', '_nested', '_shared', *[f'_after{i}' for i in range(len(after))])
+
+
 def separate_prefix(log: pl.DataFrame) -> pl.DataFrame:
     """Attempts to extract the prefix from the log"""
     # recreate the _enzy_prefix column
-    def get_enzy_prefix(struct: dict):
-        return os.path.commonprefix([x for x in [
-            struct['batch_fpath'],
-            struct['corresp_fpath'],
-            struct['completion_fpath'],
-        ] if x is not None])
-    log = log.with_columns([
-        pl.struct([
-            'batch_fpath',
-            'corresp_fpath',
-            'completion_fpath',
-        ]).map_elements(get_enzy_prefix, return_dtype=pl.Utf8).alias('_enzy_prefix'),
-    ]).with_columns([
-        pl.when(
-            pl.col('_enzy_prefix').is_not_null()
-            & pl.col('_enzy_prefix').str.ends_with('.enzy/')
-        ).then(
-            pl.col('_enzy_prefix')
-        ).otherwise(
-            pl.lit('')
-        ).alias('_enzy_prefix'),
-    ]).with_columns([
+    log = _with_enzy_prefix(log).with_columns([
         pl.col('batch_fpath').str.strip_prefix(pl.col('_enzy_prefix')),
         pl.col('corresp_fpath').str.strip_prefix(pl.col('_enzy_prefix')),
         pl.col('completion_fpath').str.strip_prefix(pl.col('_enzy_prefix')),
@@ -84,22 +199,74 @@ def separate_prefix(log: pl.DataFrame) -> pl.DataFrame:
     return log
 
 
+def benchmark_separate_prefix(n_rows=100_000):
+    """Compare the per-row os.path.commonprefix against separate_prefix on n_rows synthetic shard rows."""
+    import random
+    import time
+    rng = random.Random(0)
+    roots = ['/data/run1/.enzy/', 'C:/conjunct/tmp/.enzy/', '/scratch/', '']
+    rows = []
+    for i in range(n_rows):
+        root = rng.choice(roots)
+        rows.append({
+            'namespace': f'ns{i % 97}', 'version': f'v{i % 13}', 'shard': i,
+            'batch_fpath': f'{root}batches/ns{i % 97}_v{i % 13}.{i}.jsonl',
+            'corresp_fpath': f'{root}corresp/ns{i % 97}_v{i % 13}.parquet',
+            'completion_fpath': f'{root}completions/ns{i % 97}_v{i % 13}.{i}.jsonl' if rng.random() < 0.5 else None,
+        })
+    log = pl.DataFrame(rows, schema_overrides=llm_log_schema)
+
+    start = time.perf_counter()
+    rowwise = log.select(
+        pl.struct(_fpath_columns).map_elements(lambda x: _enzy_prefix_rowwise(**x), return_dtype=pl.Utf8)
+    ).to_series()
+    t_rowwise = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = separate_prefix(log)
+    t_vectorized = time.perf_counter() - start
+    assert vectorized['_enzy_prefix'].equals(rowwise.alias('_enzy_prefix'))
+
+    start = time.perf_counter()
+    pl.concat([pl.DataFrame(schema=llm_log_schema), vectorized], how='diagonal_relaxed').with_columns(
+        [(pl.col('_enzy_prefix') + pl.col(x)).alias(x) for x in _fpath_columns]
+    )
+    t_apply = time.perf_counter() - start
+
+    print(f"{n_rows} rows")
+    print(f"per-row commonprefix:     {t_rowwise:.3f}s")
+    print(f"separate_prefix:          {t_vectorized:.3f}s ({t_rowwise / t_vectorized:.0f}x)")
+    print(f"re-applying the prefixes: {t_apply:.3f}s")
+    return t_rowwise, t_vectorized
+
+
 def write_log(log: pl.DataFrame, log_location: str):
+    """
+    Write the log. The log is written to a temporary file first and then swapped in,
+    so that a crash (or a concurrent reader) never sees a half-written log.
+    """
 
     # log = separate_prefix(log)
 
+    if is_sqlite_log(log_location):
+        _write_sqlite_log(log, log_location)
+        return
+
+    if not log_location.endswith(('.parquet', '.tsv')):
+        log_location = log_location + '.parquet'
+    tmp_location = f"{log_location}.{os.getpid()}.tmp"
+
     if log_location.endswith('.parquet'):
-        log.write_parquet(log_location)
+        log.write_parquet(tmp_location)
         # migrate to tsv
         # write_dest = log_location.removesuffix('.parquet') + '.tsv'
         # if os.path.exists(write_dest):
         #     print("File already exists, skipping.")
         #     return
         # log.write_csv(log_location.removesuffix('.parquet') + '.tsv', separator='\t')
-    elif log_location.endswith('.tsv'):
-        log.write_csv(log_location, separator='\t')
     else:
-        log.write_parquet(log_location + '.parquet')
+        log.write_csv(tmp_location, separator='\t')
+    os.replace(tmp_location, log_location)
 
 
 def update_log(
@@ -120,6 +287,7 @@ def update_log(
     batch_fpath: str,
     corresp_fpath: str,
     replace_existing_record: bool = False,
+    batch_hash: str = None,
 ):
     # try to extract the enzy_prefix
     # enzy_prefix = os.path.commonprefix([
@@ -142,6 +310,7 @@ def update_log(
         'model_name': [model_name],
         'llm_provider': [llm_provider],
         'prompt_hash': [base64.b64encode(hashlib.sha256(prompt.encode()).digest()).decode()],
+        'batch_hash': [batch_hash],
         'structured': [structured],
 
         'file_uuid': [file_uuid],
@@ -151,6 +320,17 @@ def update_log(
         'corresp_fpath': [corresp_fpath],
         'completion_fpath': [None],
     }, schema_overrides=llm_log_schema, strict=False)
+    if is_sqlite_log(log_location):
+        # only touches this record
+        with _sqlite_transaction(log_location) as con:
+            if replace_existing_record:
+                _upsert_sqlite_records(con, df.rows(named=True))
+            else:
+                con.execute(
+                    f'INSERT INTO llm_log ({", ".join(_sqlite_columns)}) VALUES ({", ".join("?" * len(_sqlite_columns))})',
+                    _sqlite_values(df.row(0, named=True))
+                )
+        return
     log = read_log(log_location)
     if replace_existing_record:
         log = log.update(df, on=['namespace', 'version', 'shard'])
@@ -159,6 +339,72 @@ def update_log(
     write_log(log, log_location)
 
 
+def update_log_records(log_location: str, records: list[dict]):
+    """
+    Update existing records by (namespace, version, shard) (a null shard matches unsharded records).
+    Null values leave the column unchanged. ie. to mark batches as downloaded.
+    """
+    if not records:
+        return
+    if is_sqlite_log(log_location):
+        with _sqlite_transaction(log_location) as con:
+            _upsert_sqlite_records(con, records, insert_missing=False)
+        return
+    log = read_log(log_location)
+    updates_df = pl.DataFrame(records, schema_overrides=llm_log_schema)
+    # cannot update on null, so join on a shard key where unsharded is -1
+    shard_key = pl.col('shard').cast(pl.Int64).fill_null(-1).alias('_shard_key')
+    log = log.with_columns(shard_key).update(
+        updates_df.with_columns(shard_key).drop('shard'), on=['namespace', 'version', '_shard_key'], how='left'
+    ).drop('_shard_key')
+    write_log(log, log_location)
+
+
+_any = object()
+
+def lookup_log(
+    log_location: str,
+    *,
+    namespace: str = None,
+    version: str = None,
+    shard: Optional[int] = _any,
+    batch_uuid: str = None,
+) -> pl.DataFrame:
+    """
+    The records matching every given field. shard=None matches unsharded records (omit shard to match any).
+    With a sqlite log this is an index lookup; otherwise the whole log is read and filtered.
+    """
+    conditions = {'namespace': namespace, 'version': version, 'batch_uuid': batch_uuid}
+    conditions = {k: v for k, v in conditions.items() if v is not None}
+    if shard is not _any:
+        conditions['shard'] = shard
+
+    if is_sqlite_log(log_location):
+        if not os.path.exists(log_location):
+            return read_log(log_location)
+        where = ' AND '.join(f'{k} IS ?' for k in conditions)
+        return _read_sqlite_log(log_location, f'WHERE {where}' if where else '', tuple(conditions.values()))
+
+    log = read_log(log_location)
+    for k, v in conditions.items():
+        log = log.filter(pl.col(k).is_null() if v is None else pl.col(k) == v)
+    return log
+
+
+def migrate_log(src_location: str, dest_location: str) -> pl.DataFrame:
+    """
+    Copy a log (ie. .enzy/llm_log.tsv) into a new sqlite log (ie. .enzy/llm_log.sqlite).
+    _enzy_prefix is resolved, so paths are stored whole. The source is left as is.
+    """
+    assert is_sqlite_log(dest_location), f"Destination should end with one of {sqlite_log_suffixes}"
+    if os.path.exists(dest_location) and read_log(dest_location).height > 0:
+        raise FileExistsError(f"{dest_location} already has records, refusing to overwrite")
+    log = read_log(src_location)
+    write_log(log, dest_location)
+    print(f"Migrated {log.height} records from {src_location} to {dest_location}")
+    return log
+
+
 def convert_log(
     df
 ):
@@ -1,6 +1,6 @@
 # working_enzy_table_md, but tableless
 
-import asyncio
+import multiprocessing
 import re
 from typing import Optional
 import polars as pl
@@ -12,9 +12,11 @@ from tqdm import tqdm
 from enzyextract.pipeline.llm_log import read_log, update_log
 from enzyextract.pre.table.reocr_for_gmft import load_correction_df
 from enzyextract.submit.base import ReusePreference, SubmitPreference, VersioningPreference, check_file_destinations_and_ask, do_presubmit, get_user_versioning_preference
-from enzyextract.submit.batch_utils import to_openai_batch_request, write_to_jsonl
-from enzyextract.pre.reocr.micro_fix import duplex_mM_corrected_text
-from enzyextract.submit.litellm_management import process_env, submit_litellm_batch_file
+from enzyextract.submit.batch_utils import JsonlShardWriter, get_batch_limits, print_shard_plan, to_openai_batch_request
+from enzyextract.pre.reocr.micro_fix import build_correction_index, duplex_mM_corrected_text
+from enzyextract.pre.reocr.text_cache import PageTextCache, correction_fingerprint, file_hash
+from enzyextract.submit.litellm_management import process_env
+from enzyextract.submit.submit_coordinator import ShardSubmission, already_submitted, shard_hash, submit_shards
 from enzyextract.utils.namespace_management import validate_namespace
 from enzyextract.utils.pmid_management import pmids_from_directory
 from enzyextract.utils.working import pmid_to_tables_from
@@ -57,6 +59,88 @@ def find_previous_remnants(namespace, dest_folder, corresp_folder, *, version=No
 
     return suspicious_fpaths
 
+# best micro re
+# widest_mM_re = re.compile(r'\bmm(?=$|[\Wo2])', re.IGNORECASE)
+# \u0000\u0001\u0002\u0003\u0004\u0005\u0006\u0007\u0008\u0011\u0012\u0014\u0015\u0016\u0017\u0018\u0019\u001a\u001b\u001c\u001d\u001e\u001f
+ascii_control_re = re.compile(r'(?<!\w)[\x00-\x08\x11\x12\x14-\x1F]M\b') # \x7F-\x9F
+
+_open_text_caches: dict[str, PageTextCache] = {} # one connection per process
+
+def _corrected_pages(fpath, pmid, micro_subset, text_cache: Optional[str]):
+    """
+    Returns (pages, cache_hit). pages is None if the pdf could not be opened, or has over 100 pages.
+    cache_hit is None when no text_cache is used.
+    """
+    cache = None
+    if text_cache is not None:
+        cache = _open_text_caches.get(text_cache)
+        if cache is None:
+            cache = _open_text_caches[text_cache] = PageTextCache(text_cache)
+        try:
+            pdf_hash = file_hash(fpath)
+        except OSError as e:
+            print("Error opening", os.path.dirname(fpath))
+            print(e)
+            return None, False
+        fingerprint = correction_fingerprint(micro_subset, true_widest_mM_re)
+        pages = cache.get(pdf_hash, fingerprint)
+        if pages is not None:
+            return pages, True
+
+    try:
+        doc = pymupdf.open(fpath)
+    except Exception as e:
+        print("Error opening", os.path.dirname(fpath))
+        print(e)
+        return None, (False if cache is not None else None)
+
+    if len(doc) > 100:
+        # 100 pages is excessive: skip before correcting (and caching) anything
+        doc.close()
+        return None, (False if cache is not None else None)
+
+    pages = duplex_mM_corrected_text(doc, pmid, micro_subset, _re=true_widest_mM_re)
+    doc.close()
+    if cache is not None:
+        cache.put(pdf_hash, fingerprint, pages, pdfname=pmid)
+        return pages, False
+    return pages, None
+
+def _create_request(job: tuple):
+    """
+    Open a single pdf, apply the micro corrections and build its batch request.
+
+    Module-level (rather than a closure) so that it can be pickled to worker processes.
+    job: (fpath, pmid, table_docs, micro_subset, custom_id, prompt, model_name, structured, text_cache)
+
+    Returns (req, correspondence, cache_hit), or None if the pdf should be skipped.
+    """
+    fpath, pmid, table_docs, micro_subset, custom_id, prompt, model_name, structured, text_cache = job
+    pages, cache_hit = _corrected_pages(fpath, pmid, micro_subset, text_cache)
+    if pages is None:
+        return None
+
+    # now obtain texts
+    docs = list(table_docs)
+
+    # post-processing
+    for i, page in enumerate(pages):
+        # if 'µMo' in page:
+            # print("Warning: funny looking capitalization issue in", pmid)
+            # pass
+        txt = page.replace('µMo', 'µmo') # fix funny looking capitalization issue in post
+        txt = ascii_control_re.sub('µM', txt)
+        pages[i] = txt
+    docs.extend(pages)
+
+    if structured:
+        req = to_openai_batch_request_with_schema(custom_id, prompt, docs,
+                                                    model_name=model_name)
+    else:
+        req = to_openai_batch_request(custom_id, prompt, docs, 
+                                model_name=model_name)
+    return req, {"custom_id": custom_id, "pmid": pmid}, cache_hit
+
 def step1_create_batch(
     *, 
     pdf_root: str, # read pdfs from
@@ -72,7 +156,22 @@ def step1_create_batch(
     
     _check_nonzero_tables=True, # validate that tables exist
     _check_nonzero_reocr=True, # validate that micro corrections exist
+
+    workers: int = 1, # number of processes for pdf text extraction. 1 means serial
+    ordered: bool = True, # if False, requests are returned as workers finish (faster, but order differs from serial)
+    chunksize: int = 8, # pdfs sent to a worker at a time
+    text_cache: Optional[str] = None, # sqlite file to cache corrected page text, ie. {enzy_root}/cache/page_text.sqlite
+    sink: Optional[JsonlShardWriter] = None, # stream requests here instead of returning them
 ):
+    """
+    Build the batch requests for every pdf in pdf_root.
+
+    With workers > 1, pdfs are opened and corrected in a process pool. When ordered=True,
+    the output is identical to the serial path.
+
+    If sink is given, each request is written to it as soon as it is made (and the returned batch is empty), 
+    so memory does not grow with the number of papers.
+    """
     batch = []
     correspondences = []
 
@@ -146,61 +245,71 @@ def step1_create_batch(
     elif _num_in_micro == 0:
         print("Warning: No micro corrections found, but this is ok.")
 
-    _pmid_with_tables = 0
-    for fileroot, filename, pmid in tqdm(manifest_view.iter_rows(), total=manifest_view.height):
-        assert pmid in target_pmids
-        
-        fpath = fileroot + '/' + filename
-        try:
-            doc = pymupdf.open(fpath)
-        except Exception as e:
-            print("Error opening", fileroot)
-            print(e)
-            continue
-        
-        if len(doc) > 100:
-            # 100 pages is excessive
-            continue
-
-        # now obtain texts
-        docs = []
-        
-        
-        if pmid_to_tables and pmid in pmid_to_tables:
-            for filename in pmid_to_tables.get(pmid, []):
-                with open(f'{tables_from}/{filename}', 'r', encoding='utf-8') as f:
-                    docs.append(f.read())
-            _pmid_with_tables += 1
-        
-        # best micro re
-        # widest_mM_re = re.compile(r'\bmm(?=$|[\Wo2])', re.IGNORECASE)
-        # \u0000\u0001\u0002\u0003\u0004\u0005\u0006\u0007\u0008\u0011\u0012\u0014\u0015\u0016\u0017\u0018\u0019\u001a\u001b\u001c\u001d\u001e\u001f
-        ascii_control_re = re.compile(r'(?<!\w)[\x00-\x08\x11\x12\x14-\x1F]M\b') # \x7F-\x9F
-        pages = duplex_mM_corrected_text(doc, pmid, micro_df, _re=true_widest_mM_re)
-        # post-processing
-        for i, page in enumerate(pages):
-            # if 'µMo' in page:
-                # print("Warning: funny looking capitalization issue in", pmid)
-                # pass
-            txt = page.replace('µMo', 'µmo') # fix funny looking capitalization issue in post
-            txt = ascii_control_re.sub('µM', txt)
-            pages[i] = txt
-        docs.extend(pages)
-        
-
-        # obtain original annotation from part A
-        # use the table_md_root
+    # micro corrections are shipped to workers per pdf, so index them once up front
+    micro_by_pdf = {}
+    for (pdfname, pageno), bboxes in build_correction_index(micro_df).items():
+        micro_by_pdf.setdefault(pdfname, {})[(pdfname, pageno)] = bboxes
+
+    def _jobs():
+        for fileroot, filename, pmid in manifest_view.iter_rows():
+            assert pmid in target_pmids
+
+            # obtain original annotation from part A
+            # use the table_md_root
+            table_docs = []
+            if pmid_to_tables and pmid in pmid_to_tables:
+                for table_fname in pmid_to_tables.get(pmid, []):
+                    with open(f'{tables_from}/{table_fname}', 'r', encoding='utf-8') as f:
+                        table_docs.append(f.read())
+
+            yield (
+                fileroot + '/' + filename,
+                pmid,
+                table_docs,
+                micro_by_pdf.get(pmid, {}),
+                f'{namespace}_{version}_{pmid}',
+                prompt,
+                model_name,
+                structured,
+                text_cache,
+            )
 
-        custom_id = f'{namespace}_{version}_{pmid}'
-        if structured:
-            req = to_openai_batch_request_with_schema(custom_id, prompt, docs,
-                                                        model_name=model_name)
+    _pmid_with_tables = 0
+    _cache_hits = _cache_misses = 0
+    if workers is None or workers <= 1:
+        results = map(_create_request, _jobs())
+    else:
+        # spawn, not fork: forking after polars has started its thread pool can deadlock
+        pool = multiprocessing.get_context('spawn').Pool(workers)
+        if ordered:
+            results = pool.imap(_create_request, _jobs(), chunksize=chunksize)
         else:
-            req = to_openai_batch_request(custom_id, prompt, docs, 
-                                    model_name=model_name)
-        batch.append(req)
-        correspondences.append({"custom_id": custom_id, "pmid": pmid})
-
+            results = pool.imap_unordered(_create_request, _jobs(), chunksize=chunksize)
+
+    try:
+        for result in tqdm(results, total=manifest_view.height):
+            if result is None:
+                continue
+            req, corr, cache_hit = result
+            # counted only once the pdf is kept (not for unreadable or overlong pdfs)
+            if pmid_to_tables and corr['pmid'] in pmid_to_tables:
+                _pmid_with_tables += 1
+            if cache_hit is True:
+                _cache_hits += 1
+            elif cache_hit is False:
+                _cache_misses += 1
+            if sink is not None:
+                sink.write(req)
+            else:
+                batch.append(req)
+            correspondences.append(corr)
+    finally:
+        if workers is not None and workers > 1:
+            pool.close()
+            pool.join()
+
+    if text_cache is not None:
+        print(f"Text cache: {_cache_hits} hits, {_cache_misses} misses")
     if _pmid_with_tables:
         print(f"Found {_pmid_with_tables} pmids with tables")
     else:
@@ -275,6 +384,9 @@ def step1_main(
     version=None,
     _check_nonzero_reocr=True,
     _check_nonzero_tables=True,
+    workers: int = 1,
+    ordered: bool = True,
+    text_cache: Optional[str] = None,
 ):
     
     process_env('.env')
@@ -344,37 +456,33 @@ def step1_main(
 
     if reuse_pref in [ReusePreference.OVERWRITE, ReusePreference.REUSE_AS_NEEDED]:
         # Overwrite (recalculate the files)
-        batch, correspondences = step1_create_batch(
-            pdf_root=pdf_root,
-            tables_from=tables_from,
-            micro_path=micro_path,
-            manifest_view=None, # None means use all PDFs in pdf_root
+        # requests are streamed to disk in chunks, since OpenAI has data size limit
+        limits = get_batch_limits(llm_provider)
+        sink = JsonlShardWriter(will_write_to, max_requests=1000, limits=limits,
+                                skip_existing=reuse_pref != ReusePreference.OVERWRITE)
+        with sink:
+            _, correspondences = step1_create_batch(
+                pdf_root=pdf_root,
+                tables_from=tables_from,
+                micro_path=micro_path,
+                manifest_view=None, # None means use all PDFs in pdf_root
             
-            namespace=namespace,
-            version=version,
-            model_name=model_name,
-            prompt=prompt,
-            structured=structured,
-
-            _check_nonzero_tables=_check_nonzero_tables,
-            _check_nonzero_reocr=_check_nonzero_reocr,
-        )
-      
-        # write in chunks
-
-        chunk_size = 1000
-        have_multiple = len(batch) > chunk_size # need to enforce chunk size, since OpenAI has data size limit
-        need_to_submit = []
-        for i in range(0, len(batch), chunk_size):
-            chunk = batch[i:i+chunk_size]
-
-
-            if have_multiple:
-                will_write_to = f'{dest_folder}/{namespace}_{version}.{i}.jsonl'
-            if reuse_pref == ReusePreference.OVERWRITE or not os.path.exists(will_write_to):
-                write_to_jsonl(chunk, will_write_to)
-
-            need_to_submit.append(will_write_to)
+                namespace=namespace,
+                version=version,
+                model_name=model_name,
+                prompt=prompt,
+                structured=structured,
+
+                _check_nonzero_tables=_check_nonzero_tables,
+                _check_nonzero_reocr=_check_nonzero_reocr,
+                workers=workers,
+                ordered=ordered,
+                text_cache=text_cache,
+                sink=sink,
+            )
+        need_to_submit = [x['path'] for x in sink.manifest]
+        print(f"Wrote {sink.n_written} requests to {len(need_to_submit)} files")
+        print_shard_plan(sink.manifest, limits)
         
         corresp_fpath = f'{corresp_folder}/{namespace}_{version}.parquet'
         corr_df = pl.DataFrame(correspondences)
@@ -393,13 +501,43 @@ def step1_main(
     
     
 
+    def record(sub: ShardSubmission):
+        # update log
+        update_log(
+            log_location=log_location,
+            namespace=namespace,
+            version=version,
+            shard=sub.shard,
+            status=sub.status,
+
+            model_name=model_name,
+            llm_provider=llm_provider,
+            prompt=prompt,
+            structured=structured,
+
+            file_uuid=sub.file_uuid,
+            batch_uuid=sub.batch_uuid,
+            batch_fpath=sub.batch_fpath,
+            corresp_fpath=corresp_fpath,
+            # try to update (and replace) existing record if it had already existed
+            replace_existing_record=_should_exist,
+            batch_hash=sub.batch_hash,
+        )
+
     print("Time to submit!")
     _wrote_corr = False
+    to_submit = []
     for i, will_write_to in enumerate(need_to_submit):
 
         # special case with 1 shard
         if len(need_to_submit) == 1:
             i = None
+
+        # only submit what is missing from the log
+        batch_hash = shard_hash(will_write_to)
+        if already_submitted(previous_log, batch_hash, namespace=namespace, version=version, shard=i):
+            print("Already submitted, skipping", will_write_to)
+            continue
         
         # read to make sure
         inp = do_presubmit(
@@ -419,44 +557,15 @@ def step1_main(
             
         elif inp == SubmitPreference.YES:
             _wrote_corr |= try_write_corr_df(corr_df, corresp_fpath, reuse_pref, _wrote_corr)
-            try:
-            
-                # batchname = submit_batch_file(will_write_to, pending_file='batches/pending.jsonl') # will ask for confirmation
-                file_uuid, batchname = asyncio.run(submit_litellm_batch_file(will_write_to, custom_llm_provider=llm_provider))
-                status = 'submitted'
-            except Exception as e:
-                print("Error submitting batch", will_write_to)
-                print(e)
-                file_uuid = None
-                batchname = None
-                status = 'local'
+            to_submit.append(ShardSubmission(will_write_to, shard=i, batch_hash=batch_hash))
         elif inp == SubmitPreference.LOCAL:
             print("Tracked local copy at", will_write_to)
             _wrote_corr |= try_write_corr_df(corr_df, corresp_fpath, reuse_pref, _wrote_corr)
-            file_uuid = None
-            batchname = None
-            status = 'local'
+            record(ShardSubmission(will_write_to, shard=i, batch_hash=batch_hash))
         else:
             print("Unknown consent", inp, "exiting.")
             return
 
-        # update log
-        update_log(
-            log_location=log_location,
-            namespace=namespace,
-            version=version,
-            shard=i,
-            status=status,
-
-            model_name=model_name,
-            llm_provider=llm_provider,
-            prompt=prompt,
-            structured=structured,
-
-            file_uuid=file_uuid,
-            batch_uuid=batchname,
-            batch_fpath=will_write_to,
-            corresp_fpath=corresp_fpath,
-            # try to update (and replace) existing record if it had already existed
-            replace_existing_record=_should_exist
-        )
+    # shards that fail to submit are tracked as 'local', and are retried on the next run
+    if to_submit:
+        submit_shards(to_submit, llm_provider=llm_provider, on_result=record)
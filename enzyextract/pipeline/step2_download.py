@@ -1,6 +1,7 @@
+import asyncio
 import os
+from functools import partial
 from typing import Optional, Union
-from enzyextract.pipeline.llm_log import write_log
 import litellm
 import polars as pl
 from google.cloud import storage
@@ -8,8 +9,9 @@ from google.cloud import storage
 from enzyextract.submit.anthropic_management import retrieve_anthropic_batch, retrieve_anthropic_results
 from enzyextract.submit.base import LLMCommonBatch
 from enzyextract.submit.litellm_management import process_env
-from enzyextract.pipeline.llm_log import llm_log_schema, read_log
-import requests
+from enzyextract.submit.batch_download import (
+    BatchDownloadClient, CallbackDownloadClient, default_download_client, download_async
+)
 
 
 def download_gcs_file(gcs_url, destination_file_name):
@@ -52,7 +54,7 @@ def retrieve_my_file(
     llm_provider: str = 'openai',
 ):
     if llm_provider == 'anthropic':
-        return retrieve_anthropic_results(batch_id, file_id, to_json_response=True)
+        return retrieve_anthropic_results(batch_id, file_id, stream=True)
 
     else:
         return litellm.file_content(
@@ -62,106 +64,32 @@ def retrieve_my_file(
 
 
 
+def make_download_client(llm_provider: str) -> BatchDownloadClient:
+    """openai and anthropic are streamed over their REST apis; everything else goes through litellm."""
+    client = default_download_client(llm_provider)
+    if client is not None:
+        return client
+    return CallbackDownloadClient(
+        retrieve_batch=partial(retrieve_my_batch, llm_provider=llm_provider),
+        retrieve_file=partial(retrieve_my_file, llm_provider=llm_provider),
+        download_gcs=download_gcs_file,
+    )
+
+
 def download(
     log_location: str,
     dest_folder: str,
     err_folder: str,
+    max_concurrency: int = 8,
 ):
-    
-    os.makedirs(dest_folder, exist_ok=True)
-    os.makedirs(err_folder, exist_ok=True)
-
-    # Check to see which files are missing
-    # df = pl.read_parquet(log_location) # .with_row_index('index')
-    df = read_log(log_location)
-
-    to_download = df.filter(
-        pl.col('status') == 'submitted'
-    )
-
-    updates = []
-    for namespace, version, shard, batch_id, llm_provider in to_download.select([
-        # 'index',
-        'namespace',
-        'version',
-        'shard', 
-        'batch_uuid',
-        'llm_provider'
-    ]).iter_rows():
-        if shard is not None:
-            write_dest = f"{dest_folder}/{namespace}_{version}.{shard}.jsonl"
-        else:
-            write_dest = f"{dest_folder}/{namespace}_{version}.jsonl"
-        # check if the file already exists
-        if os.path.exists(write_dest):
-            print(f"File {write_dest} already exists, skipping download.")
-            updates.append({
-                'namespace': namespace,
-                'version': version,
-                'shard': shard,
-                'completion_fpath': write_dest,
-                'status': 'downloaded',
-            })
-            continue
-        retrieved_batch = retrieve_my_batch(
-            batch_id=batch_id,
-            llm_provider=llm_provider,
-        )
-        if retrieved_batch.status == 'completed':
-            # download the file
-            output_file_id = retrieved_batch.output_file_id
-            if output_file_id is None:
-                print(f"Batch {batch_id} has no output file (possibly it all errored).")
-                output_file_id = None
-                write_dest = None
-            elif output_file_id.startswith("gs://"):
-                # rip, litellm does not support GCS
-                output_file_id = output_file_id + '/predictions.jsonl'
-                download_gcs_file(output_file_id, write_dest)
-            else:
-                
-                # openai
-                file = retrieve_my_file(
-                    batch_id=batch_id,
-                    file_id=output_file_id,
-                    llm_provider=llm_provider,
-                )
-                
-                with open(write_dest, 'wb') as f:
-                    f.write(file.content)
-                    print(f"Downloaded {namespace}_{version}.jsonl")
-            
-            err_file_id = retrieved_batch.error_file_id
-            if err_file_id:
-                err_file = retrieve_my_file(
-                    batch_id=batch_id,
-                    file_id=err_file_id,
-                    llm_provider=llm_provider,
-                )
-                err_dest = f"{err_folder}/{namespace}_{version}.jsonl"
-                with open(err_dest, 'wb') as f:
-                    f.write(err_file.content)
-                print(f"Downloaded error file {namespace}_{version}_error.jsonl")
-            updates.append({
-                'namespace': namespace,
-                'version': version,
-                'shard': shard,
-                'completion_fpath': write_dest,
-                'status': 'downloaded',
-            })
-            
-    
-    # update the log file
-    updates_df = pl.DataFrame(updates, schema_overrides=llm_log_schema)
-    if updates_df.height == 0:
-        print("No new files to download.")
-        return
-    
-    _updates_sharded = updates_df.filter(pl.col('shard').is_not_null())
-    _updates_unsharded = updates_df.filter(pl.col('shard').is_null())
-    df = df.update(_updates_sharded, on=['namespace', 'version', 'shard'], how='left')
-    df = df.update(_updates_unsharded, on=['namespace', 'version'], how='left') # cannot update on null
-    # df = df.update(updates_df, on=['namespace', 'version', 'shard'], how='left')
-    write_log(df, log_location)
-
-
+    """
+    Download every completed batch in the log.
+    All submitted batches are polled concurrently (max_concurrency at a time), and the log is written once at the end.
+    """
+    asyncio.run(download_async(
+        log_location,
+        dest_folder,
+        err_folder,
+        max_concurrency=max_concurrency,
+        make_client=make_download_client,
+    ))
@@ -3,51 +3,48 @@ Formerly generate_valid.py
 """
 
 import json
+import multiprocessing
 import os
+from typing import Literal, Optional
 import pandas as pd
 import polars as pl
 from enzyextract.submit.batch_decode import jsonl_to_decoded_df
 from enzyextract.submit.batch_utils import get_batch_output, locate_correct_batch, pmid_from_usual_cid
-from enzyextract.utils.yaml_process import extract_yaml_code_blocks, fix_multiple_yamls, yaml_to_df, equivalent_from_json_schema
-from enzyextract.hungarian.csv_fix import clean_columns_for_valid
+from enzyextract.utils.yaml_process import extract_yaml_code_blocks, fix_multiple_yamls, yaml_to_df, yaml_to_rows, equivalent_from_json_schema
+from enzyextract.hungarian.csv_fix import clean_columns_for_valid, pl_clean_columns_for_valid
+from enzyextract.post.yaml.pl_parse_yaml import _data_schema
 
 
-def generate_valid_parquet(fpath,
-    *,
-    corresp_df = None, 
-    llm_provider = 'openai',
-    write_fpath = None, # write destination
-    silence = True,
-    use_yaml=True,
-) -> pl.DataFrame:
+# columns of do_auto_context, plus pmid
+_valid_schema = {
+    col: _data_schema.get(col, pl.Utf8) for col in [
+        'enzyme', 'enzyme_full', 'substrate', 'substrate_full', 'mutant', 'organism', 'kcat', 'km', 'kcat_km',
+        'temperature', 'pH', 'solution',
+    ]
+} | {
+    'cofactors': pl.Utf8, # '; '-joined by do_auto_context
+    'other': pl.Utf8,
+    'descriptor': _data_schema['descriptor'],
+    'pmid': pl.Utf8,
+}
+
+def _to_valid_row(row: dict) -> dict:
+    """Values of a do_auto_context row as strings (yaml may give numbers, ie. pH: 7.5), as they would be written to csv."""
+    return {k: v if v is None or isinstance(v, str) else str(v) for k, v in row.items()}
+
+
+def _parse_completions(rows: list[tuple], use_yaml: bool = True, silence: bool = True,
+                       engine: Literal['pandas', 'polars'] = 'pandas') -> tuple[Optional[pd.DataFrame] | list[dict], int, set]:
     """
-    Warning: if a blacklist/whitelist is provided, the cached matched csv will only contain those which pass.
+    Parse a chunk of (content, finish_reason, pmid) completions.
+    Returns (the chunk's rows as one frame, or None if none were valid; number ingested; valid pmids)
+
+    With engine='polars', the chunk's rows are returned as plain dicts instead.
     """
-    
-    
-    assert write_fpath
-    write_dir = os.path.dirname(write_fpath)
-    os.makedirs(write_dir, exist_ok=True)
-    
     valids = []
     valid_pmids = set()
     total_ingested = 0
-    
-    stats = {}
-
-    
-    # streamed_content = get_batch_output(fpath)
-    decoded_df = jsonl_to_decoded_df(fpath, llm_provider=llm_provider, corresp_df=corresp_df)
-    streamed_content = (
-        decoded_df
-        .select('custom_id', 'content', 'finish_reason', 'pmid')
-        # .select('custom_id', 'content', 'finish_reason', 'pmid', 'all_txt')
-        .iter_rows()
-    )
-
-    # streamed_content = streamed_content
-    
-    for custom_id, content, finish_reason, pmid in streamed_content:
+    for content, finish_reason, pmid in rows:
         # pmid = str(pmid_from_usual_cid(custom_id))
         # pmid = custom_id.rsplit('_', 1)[-1]
         
@@ -63,6 +60,15 @@ def generate_valid_parquet(fpath,
             # assume json content
             _generator = [(0, equivalent_from_json_schema(content))]
         for _, yaml in _generator: # 
+            if engine == 'polars':
+                data, _ = yaml_to_rows(yaml, auto_context=True, debugpmid=None if silence else pmid)
+                if not data:
+                    continue
+                for row in data:
+                    row['pmid'] = pmid
+                    valids.append(_to_valid_row(row))
+                valid_pmids.add(str(pmid))
+                continue
             
             df, context = yaml_to_df(yaml, auto_context=True, debugpmid=None if silence else pmid) # pmid, silence debug
             df['pmid'] = pmid
@@ -70,9 +76,86 @@ def generate_valid_parquet(fpath,
                 continue
             valids.append(df)
             valid_pmids.add(str(pmid)) # needs to be a set
+    if engine == 'polars':
+        return valids, total_ingested, valid_pmids
+    return (pd.concat(valids) if valids else None), total_ingested, valid_pmids
+
+def _parse_completions_job(args):
+    return _parse_completions(*args)
+
+
+def generate_valid_parquet(fpath,
+    *,
+    corresp_df = None, 
+    llm_provider = 'openai',
+    write_fpath = None, # write destination
+    silence = True,
+    use_yaml=True,
+    workers: int = 1, # processes for yaml parsing. 1 means serial
+    chunksize: int = 500, # completions per job
+    engine: Literal['pandas', 'polars'] = 'pandas',
+) -> tuple[pd.DataFrame | pl.DataFrame, dict]:
+    """
+    Warning: if a blacklist/whitelist is provided, the cached matched csv will only contain those which pass.
+
+    With workers > 1, completions are parsed in chunks in a process pool. Chunks are collected in order,
+    so the output and stats are identical to the serial path.
+
+    With engine='polars', rows are collected as plain dicts across all papers and built into one polars frame
+    (see _valid_schema), which is cleaned with vectorized expressions and returned as a pl.DataFrame.
+    """
+    
+    
+    assert write_fpath
+    write_dir = os.path.dirname(write_fpath)
+    os.makedirs(write_dir, exist_ok=True)
+    
+    valids = []
+    valid_pmids = set()
+    total_ingested = 0
+    
+    stats = {}
+
+    
+    # streamed_content = get_batch_output(fpath)
+    decoded_df = jsonl_to_decoded_df(fpath, llm_provider=llm_provider, corresp_df=corresp_df)
+    rows = decoded_df.select('content', 'finish_reason', 'pmid').rows()
+    # .select('custom_id', 'content', 'finish_reason', 'pmid', 'all_txt')
+    jobs = [(rows[i:i + chunksize], use_yaml, silence, engine) for i in range(0, len(rows), chunksize)]
+
+    if workers is None or workers <= 1:
+        results = map(_parse_completions_job, jobs)
+        pool = None
+    else:
+        # spawn, not fork: forking after polars has started its thread pool can deadlock
+        pool = multiprocessing.get_context('spawn').Pool(workers)
+        results = pool.imap(_parse_completions_job, jobs)
+
+    try:
+        for df, n_ingested, pmids in results:
+            total_ingested += n_ingested
+            valid_pmids |= pmids
+            if engine == 'polars':
+                valids.extend(df)
+            elif df is not None:
+                valids.append(df)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     stats['total_ingested'] = total_ingested
     stats['valid_pmids'] = len(valid_pmids)
+
+    if engine == 'polars':
+        valid_df = pl.DataFrame(valids, schema=_valid_schema)
+        valid_df = pl_clean_columns_for_valid(valid_df) # bad units for km and kcat are rejected here
+        print("Writing to", write_fpath)
+        if write_fpath.endswith('.parquet'):
+            valid_df.write_parquet(write_fpath)
+        else:
+            valid_df.write_csv(write_fpath)
+        return valid_df, stats
     
     valid_df = clean_columns_for_valid(pd.concat(valids)) # bad units for km and kcat are rejected here
     valid_df = valid_df.astype({'pmid': 'str'})
@@ -80,7 +163,6 @@ def generate_valid_parquet(fpath,
     if write_fpath: #  and not os.path.exists(write_fpath):
         print("Writing to", write_fpath)
         if write_fpath.endswith('.parquet'):
-            import polars as pl
             pl.from_pandas(valid_df).write_parquet(write_fpath)
         else:
             valid_df.to_csv(write_fpath, index=False)
@@ -5,7 +5,7 @@ import polars.selectors as cs
 import re
 
 from enzyextract.hungarian.hungarian_matching import is_wildtype
-from enzyextract.hungarian.hungarian_matching import convert_to_true_value, parse_value_and_unit
+from enzyextract.hungarian.hungarian_matching import pl_parse_value_and_unit
 from enzyextract.hungarian import pl_hungarian_match
 from enzyextract.thesaurus.mutant_patterns import mutant_pattern, mutant_v3_pattern, amino3, amino3to1, standardize_mutants1_re, with_clean_mutants
 from enzyextract.thesaurus.ascii_patterns import pl_to_ascii
@@ -144,12 +144,10 @@ def parse_col(col: str, suffix='', accept_unknown_unit=True) -> pl.Expr:
     """
     convert kcat (string) to float
     """
-    def to_true(x):
-        value, unit, _ = parse_value_and_unit(x + suffix)
-        if unit is None and not accept_unknown_unit:
-            return None
-        return convert_to_true_value(value, unit)
-    return pl.col(col).map_elements(to_true, return_dtype=pl.Float64)
+    parsed = pl_parse_value_and_unit(pl.col(col) + suffix)
+    if accept_unknown_unit:
+        return parsed.struct.field('true_value').alias(col)
+    return pl.when(parsed.struct.field('unit').is_not_null()).then(parsed.struct.field('true_value')).alias(col)
 
 def _remove_bad_es(df: pl.DataFrame):
     """
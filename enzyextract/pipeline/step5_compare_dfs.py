@@ -11,7 +11,7 @@ import polars.selectors as cs
 import rapidfuzz
 
 from enzyextract.hungarian.hungarian_matching import is_wildtype
-from enzyextract.hungarian.hungarian_matching import convert_to_true_value, parse_value_and_unit
+from enzyextract.hungarian.hungarian_matching import pl_parse_value_and_unit
 from enzyextract.hungarian import pl_hungarian_match
 from enzyextract.thesaurus.mutant_patterns import mutant_pattern, mutant_v3_pattern
 
@@ -353,10 +353,7 @@ def parse_col(col: str, suffix='') -> pl.Expr:
     """
     convert kcat (string) to float
     """
-    def to_true(x):
-        value, unit, _ = parse_value_and_unit(x + suffix)
-        return convert_to_true_value(value, unit)
-    return pl.col(col).map_elements(to_true, return_dtype=pl.Float64)
+    return pl_parse_value_and_unit(pl.col(col) + suffix).struct.field('true_value').alias(col)
 
 
 def _remove_bad_es_calc_kcat_value_and_clean_mutants(df: pl.DataFrame):
@@ -0,0 +1,130 @@
+# content-addressed store of rendered glyph crops,
+# so that re-scoring a corpus with a new model is pure inference (no pdf rendering)
+import glob
+import os
+from typing import Optional
+
+import numpy as np
+import polars as pl
+
+from enzyextract.pre.reocr.reocr_schema import reocr_df_schema, reocr_df_schema_overrides
+
+# columns of reocr_df_schema that describe the candidate itself (ie. not the prediction)
+_meta_cols = [x for x in reocr_df_schema if x not in ('real_char', 'confidence')]
+
+crop_index_schema = {
+    **{k: reocr_df_schema_overrides[k] for k in _meta_cols},
+    'pdf_hash': pl.Utf8,
+    'dpi': pl.Int64,
+    'rect_x0': pl.Float64,
+    'rect_y0': pl.Float64,
+    'rect_x1': pl.Float64,
+    'rect_y1': pl.Float64,
+    'segment': pl.Int64,
+    'slot': pl.Int64,
+}
+
+
+def crop_key(pdf_hash: str, pageno: int, rect, dpi: int) -> tuple:
+    """Key a crop by (pdf hash, page, clip rect, dpi). The rect is rounded so that float noise does not matter."""
+    return (pdf_hash, int(pageno), *(round(float(x), 3) for x in rect), int(dpi))
+
+
+class CropStore:
+    """
+    Append-only store of fixed-size uint8 tiles, one segment at a time:
+    - store_dir/tiles_{k}.npy: (n, *tile shape) array, opened memory-mapped
+    - store_dir/index_{k}.parquet: one row per tile, with the reocr columns and the crop key
+
+    Tiles are crops at the classifier's input geometry (see m_mu_reocr.crop_to_tile, 147 KB each at 224x224x3),
+    so a segment of 1024 tiles is about 150 MB while pending.
+    """
+    def __init__(self, store_dir: str, segment_size: int = 1024):
+        self.store_dir = store_dir
+        self.segment_size = segment_size
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.segments = sorted(
+            int(os.path.basename(x)[len('index_'):-len('.parquet')])
+            for x in glob.glob(f'{store_dir}/index_*.parquet')
+        )
+        if self.segments:
+            self.index = pl.concat([
+                pl.read_parquet(f'{store_dir}/index_{k}.parquet') for k in self.segments
+            ], how='diagonal_relaxed')
+        else:
+            self.index = pl.DataFrame(schema=crop_index_schema)
+        self._lookup = {
+            crop_key(pdf_hash, pageno, (x0, y0, x1, y1), dpi): (segment, slot)
+            for pdf_hash, pageno, x0, y0, x1, y1, dpi, segment, slot in self.index.select(
+                'pdf_hash', 'pageno', 'rect_x0', 'rect_y0', 'rect_x1', 'rect_y1', 'dpi', 'segment', 'slot'
+            ).iter_rows()
+        }
+        self._tiles = {} # segment -> memmap
+        self._pending_tiles = []
+        self._pending_rows = []
+
+    def __len__(self):
+        # pending keys are already reserved in _lookup
+        return len(self._lookup)
+
+    def __contains__(self, key: tuple):
+        return key in self._lookup
+
+    def _segment(self, k: int) -> np.ndarray:
+        if k not in self._tiles:
+            self._tiles[k] = np.load(f'{self.store_dir}/tiles_{k}.npy', mmap_mode='r')
+        return self._tiles[k]
+
+    def get(self, key: tuple) -> Optional[np.ndarray]:
+        found = self._lookup.get(key)
+        if found is None:
+            return None
+        segment, slot = found
+        return np.asarray(self._segment(segment)[slot])
+
+    def add(self, key: tuple, tile: np.ndarray, meta: dict):
+        """
+        meta: values for the reocr columns (pdfname, pageno, ctr, orig_char, orig_after, angle, letter_*, x0..y1).
+        """
+        if key in self._lookup:
+            return
+        pdf_hash, pageno, x0, y0, x1, y1, dpi = key
+        self._pending_tiles.append(np.asarray(tile, dtype=np.uint8))
+        self._pending_rows.append({
+            **{k: meta.get(k) for k in _meta_cols},
+            'pdf_hash': pdf_hash,
+            'dpi': dpi,
+            'rect_x0': x0, 'rect_y0': y0, 'rect_x1': x1, 'rect_y1': y1,
+        })
+        # reserve the key, so that duplicates within a segment are not added
+        self._lookup[key] = None
+        if len(self._pending_tiles) >= self.segment_size:
+            self.flush()
+
+    def flush(self):
+        """Write pending tiles as a new segment."""
+        if not self._pending_tiles:
+            return
+        k = self.segments[-1] + 1 if self.segments else 0
+        tiles = np.stack(self._pending_tiles)
+        rows = pl.DataFrame(self._pending_rows, schema_overrides=crop_index_schema, strict=False).with_columns(
+            pl.lit(k, dtype=pl.Int64).alias('segment'),
+            pl.int_range(0, len(tiles), dtype=pl.Int64).alias('slot'),
+        ).select(list(crop_index_schema))
+        # tiles first, so that an index never points to a missing segment
+        np.save(f'{self.store_dir}/tiles_{k}.npy', tiles)
+        rows.write_parquet(f'{self.store_dir}/index_{k}.parquet')
+
+        self.segments.append(k)
+        self.index = pl.concat([self.index, rows], how='diagonal_relaxed')
+        for row in rows.select('pdf_hash', 'pageno', 'rect_x0', 'rect_y0', 'rect_x1', 'rect_y1', 'dpi', 'slot').iter_rows():
+            pdf_hash, pageno, x0, y0, x1, y1, dpi, slot = row
+            self._lookup[crop_key(pdf_hash, pageno, (x0, y0, x1, y1), dpi)] = (k, slot)
+        self._pending_tiles = []
+        self._pending_rows = []
+
+    def iter_segments(self):
+        """Yield (index rows, memory-mapped tiles) for each written segment."""
+        for k in self.segments:
+            yield self.index.filter(pl.col('segment') == k).sort('slot'), self._segment(k)
@@ -4,14 +4,20 @@ import os
 from tqdm import tqdm
 from enzyextract.utils.pmid_management import pmids_from_cache
 from enzyextract.pre.reocr.reocr_schema import reocr_df_schema, reocr_df_schema_overrides
+from enzyextract.pre.reocr.crop_store import CropStore, crop_key
+from enzyextract.pre.reocr.text_cache import file_hash
 
 
 import PIL
 from PIL import Image as PILImage
 
 
+import multiprocessing
+import numpy as np
 import os
+import queue
 import random
+import time
 import torch
 import torchvision
 import torchvision.transforms as transforms
@@ -104,6 +110,23 @@ val_transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
+# the CropStore keeps each crop at the classifier's input geometry: val_transform's resize + center crop.
+# tile_transform is the rest of val_transform, so a stored tile scores exactly like a freshly rendered crop.
+TILE_SIZE = 224
+_geometric_transform = transforms.Compose(val_transform.transforms[:2])
+
+def _tile_to_PIL(tile: np.ndarray) -> PILImage:
+    return Image.fromarray(tile)
+
+tile_transform = transforms.Compose([
+    _tile_to_PIL,
+    *val_transform.transforms[2:],
+])
+
+def crop_to_tile(img: PILImage) -> np.ndarray:
+    """Resize and center crop, returning a (TILE_SIZE, TILE_SIZE, 3) uint8 array."""
+    return np.asarray(_geometric_transform(img.convert('RGB')), dtype=np.uint8)
+
 def train_resnet(write_dest):
 
 
@@ -252,6 +275,43 @@ def classify_image(model, image_path, device='cpu') -> tuple[str, float]:
             return "other", mu_score
         
 
+_labels = ["m", "mu", "other"]
+
+def classify_images(model, images: list, device='cpu', batch_size=64) -> list[tuple[str, float]]:
+    """
+    Batched classify_image. Return [(cls, mu_score), ...] in the same order as images.
+
+    Crops are resized to fixed-size tensors by val_transform, so they can be stacked
+    and run through the model batch_size at a time. Images may also be tiles (see crop_to_tile).
+    """
+    model.eval()
+    results = [None] * len(images)
+    valid = []
+    for i, img in enumerate(images):
+        if isinstance(img, str):
+            img = Image.open(img).convert('RGB')
+        if isinstance(img, np.ndarray):
+            valid.append((i, img))
+            continue
+        if img.size[0] == 0 or img.size[1] == 0:
+            print(f"Warning: Image at index {i} has zero width or height. Skipping.")
+            results[i] = ("m", 1.0)
+            continue
+        valid.append((i, img))
+
+    with torch.inference_mode():
+        for start in range(0, len(valid), batch_size):
+            chunk = valid[start:start + batch_size]
+            inputs = torch.stack([
+                tile_transform(img) if isinstance(img, np.ndarray) else val_transform(img) for _, img in chunk
+            ]).to(device)
+            probabilities = torch.nn.functional.softmax(model(inputs), dim=1).cpu()
+            best_labels = torch.argmax(probabilities, dim=1).tolist()
+            mu_scores = probabilities[:, 1].tolist()
+            for (i, _), best_label, mu_score in zip(chunk, best_labels, mu_scores):
+                results[i] = (_labels[best_label], mu_score)
+    return results
+
 ## START reocr_micromolar
 
 def pixmap_to_PIL(pixmap: pymupdf.Pixmap) -> PILImage:
@@ -416,7 +476,152 @@ def obtain_true_mu_dataset(root, all_pdfs, write_dest):
 
 
 
-def dump_images_too(root, all_pdfs, path_to_dest, target="mM", allow_lowercase=True, save_imgs=True, model_path=None, **kwargs):
+def _iter_candidate_crops(root, pdfname, target="mM", allow_lowercase=True, crop_store: CropStore = None, with_keys=False, 
+                          candidate_filter=None, **kwargs):
+    """
+    Open a pdf and yield (meta, img, key) for every candidate, where
+    meta = (pdfname, pageno, ctr, builder, after, angle, m_bbox, big_bbox).
+    Yields nothing if the pdf cannot be opened.
+
+    crop_store: if the crop was already rendered, img is the stored tile (skipping the render)
+    with_keys: compute the crop_key even without a crop_store, otherwise key is None
+    candidate_filter: callable(builder, after) -> bool, to only crop some candidates
+    """
+    try:
+        if not pdfname.endswith(".pdf"):
+            pdfname = pdfname + ".pdf"
+        doc = pymupdf.open(f'{root}/{pdfname}')
+    except Exception as e:
+        # print(f"Error opening {pdfname}: {e}")
+        return
+    pdf_hash = None
+    if crop_store is not None or with_keys:
+        pdf_hash = file_hash(f'{root}/{pdfname}')
+    for pageno, ctr, builder, m_rect, rect, angle, after in yield_all_millimolar(doc, target=target, allow_lowercase=allow_lowercase, **kwargs): # mean, more, much
+        if candidate_filter is not None and not candidate_filter(builder, after):
+            continue
+        
+        dpi = 288
+
+        # CHANGE: now obtain the full rect
+        margin = 2
+        wider_rect = pymupdf.Rect(rect.x0 - margin, rect.y0 - margin, rect.x1 + margin, rect.y1 + margin)
+
+        # store the rect of entire mM (rect)
+        big_bbox = (rect.x0, rect.y0, rect.x1, rect.y1)
+        m_bbox = (m_rect.x0, m_rect.y0, m_rect.x1, m_rect.y1)
+        meta = (pdfname, pageno, ctr, builder, after, angle, m_bbox, big_bbox)
+
+        key = None
+        if pdf_hash is not None:
+            key = crop_key(pdf_hash, pageno, wider_rect, dpi)
+            tile = crop_store.get(key) if crop_store is not None else None
+            if tile is not None:
+                yield meta, tile, key
+                continue
+
+        page = doc[pageno]
+        pixmap = page.get_pixmap(dpi=dpi, clip=wider_rect)
+        
+        img = pixmap_to_PIL(pixmap)
+        
+        # skip empty images
+        if img.size[0] == 0 or img.size[1] == 0:
+            continue
+        img = img.rotate(angle, expand=True)
+        yield meta, img, key
+    doc.close()
+
+
+def _store_crop(crop_store: CropStore, key, meta, img):
+    """Add a classified crop to the crop_store, as a fixed-size tile."""
+    if key is None or key in crop_store:
+        return
+    pdfname, pageno, ctr, builder, after, angle, m_bbox, big_bbox = meta
+    tile = img if isinstance(img, np.ndarray) else crop_to_tile(img)
+    crop_store.add(key, tile, dict(zip(
+        ['pdfname', 'pageno', 'ctr', 'orig_char', 'orig_after', 'angle', 
+         'letter_x0', 'letter_y0', 'letter_x1', 'letter_y1', 'x0', 'y0', 'x1', 'y1'],
+        [pdfname, pageno, ctr, builder, after, angle, *m_bbox, *big_bbox]
+    )))
+
+
+def _render_worker(root, task_queue, crop_queue, target, allow_lowercase, with_keys, kwargs):
+    """
+    Producer for the pipelined scan: renders crops for each pdf from task_queue into crop_queue.
+    Sends (pdfname, None) after each pdf, and None once the task_queue is exhausted.
+    """
+    while True:
+        pdfname = task_queue.get()
+        if pdfname is None:
+            break
+        for meta, img, key in _iter_candidate_crops(root, pdfname, target=target, allow_lowercase=allow_lowercase, 
+                                                    with_keys=with_keys, **kwargs):
+            crop_queue.put((meta, img, key)) # blocks when the consumer falls behind
+        crop_queue.put((pdfname, None))
+    crop_queue.put(None)
+
+
+def _iter_pipelined_crops(root, all_pdfs, target, allow_lowercase, render_workers, queue_size, kwargs, with_keys=False):
+    """
+    Render crops in render_workers processes, yielding (meta, img, key) in the consumer as they arrive.
+    The bounded crop queue provides backpressure, so rendering never runs far ahead of inference.
+    kwargs (ie. terminating_condition) must be picklable.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    task_queue = ctx.Queue()
+    crop_queue = ctx.Queue(maxsize=queue_size)
+    for pdfname in all_pdfs:
+        task_queue.put(pdfname)
+    for _ in range(render_workers):
+        task_queue.put(None)
+
+    workers = [
+        ctx.Process(target=_render_worker, args=(root, task_queue, crop_queue, target, allow_lowercase, with_keys, kwargs), daemon=True)
+        for _ in range(render_workers)
+    ]
+    for w in workers:
+        w.start()
+    
+    progress = tqdm(total=len(all_pdfs))
+    remaining = render_workers
+    try:
+        while remaining:
+            try:
+                item = crop_queue.get(timeout=30)
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    raise RuntimeError("All render workers exited unexpectedly")
+                continue
+            if item is None:
+                remaining -= 1
+            elif len(item) == 2:
+                # (pdfname, None): a pdf is done
+                progress.update(1)
+            else:
+                yield item
+    finally:
+        progress.close()
+        for w in workers:
+            w.join(timeout=5)
+            if w.is_alive():
+                w.terminate()
+
+
+def dump_images_too(root, all_pdfs, path_to_dest, target="mM", allow_lowercase=True, save_imgs=True, model_path=None, 
+                    batch_size=64, num_threads=None, render_workers=0, queue_size=1024, crop_store: str = None, 
+                    rows_dest: str = None, **kwargs):
+    """
+    Crop every mM candidate and classify it with the resnet, batch_size crops at a time.
+    num_threads: torch cpu threads, if set.
+    render_workers: if > 0, pdf parsing and rendering run in that many processes, while this process 
+        only classifies (producer/consumer). queue_size bounds the number of crops in flight.
+        Rows then come in the order that pdfs finish rendering, rather than in all_pdfs order.
+    crop_store: directory of a CropStore. Every crop is kept there, and crops already in it are not re-rendered
+        (serial mode only). See rescore_crop_store to re-score the store without any pdfs.
+    rows_dest: directory to stream the rows to, one parquet file per classified batch (part_{k}.parquet),
+        so that they are not held in memory. A LazyFrame over those files is returned instead.
+    """
 
 
     if save_imgs:
@@ -427,115 +632,100 @@ def dump_images_too(root, all_pdfs, path_to_dest, target="mM", allow_lowercase=T
         os.makedirs(m_dir, exist_ok=True)
         os.makedirs(mu_dir, exist_ok=True)
         os.makedirs(other_dir, exist_ok=True)
+    if rows_dest is not None:
+        os.makedirs(rows_dest, exist_ok=True)
     
-    data = []
-    # sneaky: search for "mean" and capture these m to build a true dataset
-    # dkip_to = 1680
-    for i, pdfname in tqdm(enumerate(all_pdfs), total=len(all_pdfs)):
-        # if i < dkip_to:
-        #     continue
-        try:
-            if not pdfname.endswith(".pdf"):
-                pdfname = pdfname + ".pdf"
-            doc = pymupdf.open(f'{root}/{pdfname}')
-        except Exception as e:
-            # print(f"Error opening {pdfname}: {e}")
-            continue
-        for pageno, ctr, builder, m_rect, rect, angle, after in yield_all_millimolar(doc, target=target, allow_lowercase=allow_lowercase, **kwargs): # mean, more, much
-            
-            page = doc[pageno]
-            dpi = 288
+    data = [] # rows of the batch being classified
+    parts = [] # one frame (or with rows_dest, one parquet file) per classified batch
+
+    store = CropStore(crop_store) if crop_store is not None else None
+
+    def on_result(meta_key, img, real_char, prob):
+        meta, key = meta_key
+        pdfname, pageno, ctr, builder, after, angle, m_bbox, big_bbox = meta
+        # if real_char != 'm': # only save the micros
+        data.append((pdfname, pageno, ctr, builder, after, real_char, prob, angle, *m_bbox, *big_bbox))
+        if store is not None:
+            _store_crop(store, key, meta, img)
+        
+        if not save_imgs:
+            return
+        if isinstance(img, np.ndarray):
+            img = Image.fromarray(img)
+
+        if real_char == 'm':
+            img.save(f'{m_dir}/{pdfname}_{pageno}_{ctr}.png')
+        elif real_char == 'mu':
+            img.save(f'{mu_dir}/{pdfname}_{pageno}_{ctr}.png')
+        else:
+            img.save(f'{other_dir}/{pdfname}_{pageno}_{ctr}.png')
 
-            # CHANGE: now obtain the full rect
-            margin = 2
-            wider_rect = pymupdf.Rect(rect.x0 - margin, rect.y0 - margin, rect.x1 + margin, rect.y1 + margin)
-            pixmap = page.get_pixmap(dpi=dpi, clip=wider_rect)
-            
-            img = pixmap_to_PIL(pixmap)
-            
-            # skip empty images
-            if img.size[0] == 0 or img.size[1] == 0:
-                continue
-            img = img.rotate(angle, expand=True)
-            
-            # OCR the image
-            # real_char = svm_reocr_milli(img)
-            real_char, prob = resnet_reocr_milli(img, mu_score=True, model_path=model_path)
-            
-            # store the rect of entire mM (rect)
-            big_bbox = (rect.x0, rect.y0, rect.x1, rect.y1)
-            m_bbox = (m_rect.x0, m_rect.y0, m_rect.x1, m_rect.y1)
-            
-            # if real_char != 'm': # only save the micros
-            data.append((pdfname, pageno, ctr, builder, after, real_char, prob, angle, *m_bbox, *big_bbox))
-            
-            if not save_imgs:
-                continue
-    
-            if real_char == 'm':
-                img.save(f'{m_dir}/{pdfname}_{pageno}_{ctr}.png')
-            elif real_char == 'mu':
-                img.save(f'{mu_dir}/{pdfname}_{pageno}_{ctr}.png')
-            else:
-                img.save(f'{other_dir}/{pdfname}_{pageno}_{ctr}.png')
-        doc.close()
+    def on_flush():
+        part = pl.DataFrame(data, orient='row', schema=reocr_df_schema, schema_overrides=reocr_df_schema_overrides)
+        data.clear()
+        if rows_dest is None:
+            parts.append(part)
+        else:
+            fpath = f'{rows_dest}/part_{len(parts)}.parquet'
+            part.write_parquet(fpath)
+            parts.append(fpath)
+    batcher = _CropBatcher(on_result, model_path=model_path, batch_size=batch_size, num_threads=num_threads, 
+                           on_flush=on_flush)
+
+    if render_workers > 0:
+        for meta, img, key in _iter_pipelined_crops(root, all_pdfs, target, allow_lowercase, render_workers, queue_size, kwargs,
+                                                    with_keys=store is not None):
+            batcher.add((meta, key), img)
+    else:
+        # sneaky: search for "mean" and capture these m to build a true dataset
+        for pdfname in tqdm(all_pdfs, total=len(all_pdfs)):
+            for meta, img, key in _iter_candidate_crops(root, pdfname, target=target, allow_lowercase=allow_lowercase, 
+                                                        crop_store=store, **kwargs):
+                # OCR the image (in batches)
+                batcher.add((meta, key), img)
+    batcher.flush()
+    batcher.report()
+    if store is not None:
+        store.flush()
     
-    df = pl.DataFrame(
-        data, 
-        orient='row',
-        schema=reocr_df_schema,
-        schema_overrides=reocr_df_schema_overrides
-    )
-    return df
+    if not parts:
+        df = pl.DataFrame(schema={k: reocr_df_schema_overrides[k] for k in reocr_df_schema})
+        return df.lazy() if rows_dest is not None else df
+    if rows_dest is not None:
+        return pl.scan_parquet(parts)
+    return pl.concat(parts)
+
 
+def _is_special_candidate(builder, after):
+    # only look at special
+    return (builder[0] != 'm' and builder[0] != 'M') or after == 'o' or after == 'O' or after == '2'
 
-def special_dump(root, all_pdfs, path_to_dest, target="mM", allow_lowercase=True, save_imgs=True, model_path=None, **kwargs):
+def special_dump(root, all_pdfs, path_to_dest, target="mM", allow_lowercase=True, save_imgs=True, model_path=None, 
+                 batch_size=64, num_threads=None, crop_store: str = None, **kwargs):
     """
     Special dump to save time.
     """
 
     data = []
+    store = CropStore(crop_store) if crop_store is not None else None
+
+    def on_result(meta_key, img, real_char, prob):
+        meta, key = meta_key
+        pdfname, pageno, ctr, builder, after, angle, m_bbox, big_bbox = meta
+        data.append((pdfname, pageno, ctr, builder, after, real_char, prob, angle, *m_bbox, *big_bbox))
+        if store is not None:
+            _store_crop(store, key, meta, img)
+    batcher = _CropBatcher(on_result, model_path=model_path, batch_size=batch_size, num_threads=num_threads)
     # sneaky: search for "mean" and capture these m to build a true dataset
-    # dkip_to = 1680
-    for i, pdfname in tqdm(enumerate(all_pdfs), total=len(all_pdfs)):
-        # if i < dkip_to:
-        #     continue
-        if not pdfname.endswith(".pdf"):
-            pdfname = pdfname + ".pdf"
-        try:
-            doc = pymupdf.open(f'{root}/{pdfname}')
-        except Exception as e:
-            # print(f"Error opening {pdfname}: {e}")
-            continue
-        for pageno, ctr, builder, m_rect, rect, angle, after in yield_all_millimolar(doc, target=target, allow_lowercase=allow_lowercase, **kwargs): # mean, more, much
-            if not ((builder[0] != 'm' and builder[0] != 'M') or after == 'o' or after == 'O' or after == '2'):
-                # only look at special
-                continue
-            page = doc[pageno]
-            dpi = 288
-
-            # CHANGE: now obtain the full rect
-            margin = 2
-            wider_rect = pymupdf.Rect(rect.x0 - margin, rect.y0 - margin, rect.x1 + margin, rect.y1 + margin)
-            pixmap = page.get_pixmap(dpi=dpi, clip=wider_rect)
-            
-            img = pixmap_to_PIL(pixmap)
-            
-            # skip empty images
-            if img.size[0] == 0 or img.size[1] == 0:
-                continue
-            img = img.rotate(angle, expand=True)
-            
-            # OCR the image
-            # real_char = svm_reocr_milli(img)
-            real_char, prob = resnet_reocr_milli(img, mu_score=True, model_path=model_path)
-            
-            # store the rect of entire mM (rect)
-            big_bbox = (rect.x0, rect.y0, rect.x1, rect.y1)
-            m_bbox = (m_rect.x0, m_rect.y0, m_rect.x1, m_rect.y1)
-            
-            data.append((pdfname, pageno, ctr, builder, after, real_char, prob, angle, *m_bbox, *big_bbox))
-        doc.close()
+    for pdfname in tqdm(all_pdfs, total=len(all_pdfs)):
+        for meta, img, key in _iter_candidate_crops(root, pdfname, target=target, allow_lowercase=allow_lowercase, 
+                                                    crop_store=store, candidate_filter=_is_special_candidate, **kwargs):
+            # OCR the image (in batches)
+            batcher.add((meta, key), img)
+    batcher.flush()
+    batcher.report()
+    if store is not None:
+        store.flush()
     
     df = pl.DataFrame(data, 
                       orient='row',
@@ -543,32 +733,168 @@ def special_dump(root, all_pdfs, path_to_dest, target="mM", allow_lowercase=True
     return df
 
 resnet = None
-def resnet_reocr_milli(img: PILImage, mu_score=True, model_path=None) -> str:
+def load_resnet_checkpoint(model_path: str, device=None) -> torch.nn.Module:
+    """Build the 3-class resnet18 and load a .pth state dict into it."""
+    # no need to fetch the imagenet weights, since the state dict replaces all of them
+    model = resnet18(weights=None)
+    num_ftrs = model.fc.in_features
+    model.fc = torch.nn.Linear(num_ftrs, 3)
+    model.load_state_dict(torch.load(model_path, weights_only=True, map_location='cpu'))
+    model = model.to(device or torch_device)
+    model.eval()
+    return model
+
+def get_resnet(model_path=None):
+    """
+    Lazily load the micro classifier, once per process.
+
+    The backend is chosen by the file extension of model_path:
+    - .pth: state dict for the torchvision resnet18
+    - .pt: frozen TorchScript module, as written by export_torchscript (faster startup and cpu inference)
+    """
     if model_path is None:
         model_path = 'zpreprocessing/reocr/resnet18-remicro-iter3.pth'
     global resnet, torch_device
     if resnet is None:
-
-        model = resnet18(weights=ResNet18_Weights.DEFAULT)
-        num_ftrs = model.fc.in_features
-        model.fc = torch.nn.Linear(num_ftrs, 3)
-        model.load_state_dict(torch.load(model_path, weights_only=True))
-        model = model.to(torch_device)
-        model.eval()
+        if model_path.endswith('.pt'):
+            model = torch.jit.load(model_path, map_location=torch_device)
+            model.eval()
+            if torch_device == 'cpu':
+                model = torch.jit.optimize_for_inference(model)
+        else:
+            model = load_resnet_checkpoint(model_path)
         resnet = model
-    out, prob = classify_image(resnet, img, device=torch_device)
-    if mu_score:
-        return out, prob
+    return resnet
+
+def export_torchscript(model_path: str, write_dest: str, holdout: list | str = None, atol=1e-4):
+    """
+    Export the .pth micro classifier as a frozen, cpu-optimized TorchScript module (.pt),
+    which get_resnet (and so resnet_reocr_milli and the batched path) can load instead.
+
+    holdout: crops (PIL images, or a folder of .png/.jpg) to check parity against the original model.
+    Raises if any prediction differs, or any confidence differs by more than atol.
+    """
+    model = load_resnet_checkpoint(model_path, device='cpu')
+    example = torch.zeros(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    # freezing inlines the weights and folds batchnorm into the convolutions.
+    # (optimize_for_inference is applied at load time instead, since its mkldnn ops do not serialize)
+    frozen = torch.jit.freeze(traced)
+    frozen.save(write_dest)
+    print("Wrote TorchScript model to", write_dest)
+
+    if holdout is not None:
+        check_export_parity(model, torch.jit.load(write_dest, map_location='cpu'), holdout, atol=atol)
+    return write_dest
+
+def check_export_parity(model, exported, holdout: list | str, atol=1e-4, batch_size=64):
+    """Compare predictions and mu confidences of the original and exported models on a set of crops."""
+    if isinstance(holdout, str):
+        holdout = [os.path.join(holdout, x) for x in sorted(os.listdir(holdout)) 
+                   if x.endswith(('.png', '.jpg', '.jpeg'))]
+    expected = classify_images(model, holdout, device='cpu', batch_size=batch_size)
+    actual = classify_images(exported, holdout, device='cpu', batch_size=batch_size)
+    mismatched = sum(1 for (a, _), (b, _) in zip(expected, actual) if a != b)
+    max_diff = max((abs(a - b) for (_, a), (_, b) in zip(expected, actual)), default=0.0)
+    print(f"Parity on {len(holdout)} crops: {mismatched} label mismatches, max confidence diff {max_diff:.2e}")
+    if mismatched or max_diff > atol:
+        raise ValueError(f"Exported model does not match: {mismatched} label mismatches, max confidence diff {max_diff:.2e}")
+    return mismatched, max_diff
+
+def _strict_mu(out, prob):
     if out == 'mu' and prob > 0.996: # very strict requirements for mu
         return 'mu', prob
     return 'm', 1-prob
-    
-    
+
+def resnet_reocr_milli(img: PILImage, mu_score=True, model_path=None) -> str:
+    out, prob = classify_image(get_resnet(model_path), img, device=torch_device)
+    if mu_score:
+        return out, prob
+    return _strict_mu(out, prob)
+
+def resnet_reocr_milli_batch(imgs: list[PILImage], mu_score=True, model_path=None, batch_size=64) -> list[tuple[str, float]]:
+    """Batched resnet_reocr_milli."""
+    results = classify_images(get_resnet(model_path), imgs, device=torch_device, batch_size=batch_size)
+    if mu_score:
+        return results
+    return [_strict_mu(out, prob) for out, prob in results]
+
+
+class _CropBatcher:
+    """
+    Accumulates candidate crops (across pages and pdfs) and classifies them batch_size at a time.
+    Each flushed crop is handed to on_result(meta, img, real_char, prob), in submission order,
+    and then on_flush() is called once for the batch.
+    """
+    def __init__(self, on_result, model_path=None, batch_size=64, num_threads=None, on_flush=None):
+        self.on_result = on_result
+        self.on_flush = on_flush
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.pending = []
+        self.n_images = 0
+        self.seconds = 0.0
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+    def add(self, meta, img):
+        self.pending.append((meta, img))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        results = resnet_reocr_milli_batch([img for _, img in self.pending], mu_score=True, 
+                                           model_path=self.model_path, batch_size=self.batch_size)
+        self.seconds += time.perf_counter() - start
+        self.n_images += len(self.pending)
+        for (meta, img), (real_char, prob) in zip(self.pending, results):
+            self.on_result(meta, img, real_char, prob)
+        self.pending = []
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def report(self):
+        if self.n_images:
+            rate = self.n_images / self.seconds if self.seconds else float('inf')
+            print(f"Classified {self.n_images} crops in {self.seconds:.1f}s ({rate:.1f} images/sec)")
+
+
+def rescore_crop_store(store_dir: str, model_path=None, batch_size=64, num_threads=None) -> pl.DataFrame:
+    """
+    Re-classify every crop in a CropStore (filled by dump_images_too(..., crop_store=store_dir)).
+    No pdf is opened, so this is pure inference: use it to compare or swap in a new model.
+    Returns a dataframe in reocr_df_schema.
+    """
+    store = CropStore(store_dir)
+    model = get_resnet(model_path)
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    dfs = []
+    for rows, tiles in tqdm(store.iter_segments(), total=len(store.segments)):
+        results = classify_images(model, [tiles[i] for i in range(len(tiles))], device=torch_device, batch_size=batch_size)
+        dfs.append(rows.with_columns(
+            pl.Series('real_char', [x[0] for x in results], dtype=pl.Utf8),
+            pl.Series('confidence', [x[1] for x in results], dtype=pl.Float64),
+        ).select(list(reocr_df_schema)))
+    if not dfs:
+        return pl.DataFrame(schema={k: reocr_df_schema_overrides[k] for k in reocr_df_schema})
+    return pl.concat(dfs).cast(reocr_df_schema_overrides)
+
+
 def reocr_all_mM(root, all_pdfs, allow_lowercase=True):
     return dump_images_too(root, all_pdfs, None, allow_lowercase=allow_lowercase, save_imgs=False)
             
           
-def script_scan_mM(pdf_root=None, write_dir=None, save_imgs=False, model_path=None):
+def mM_terminating_condition(ch):
+    """Also allow mM2 and mMo (ie. mmol). Module-level so that it can be pickled to render workers."""
+    return not ch or ch == '2' or ch == 'o' or not ch.isalnum() #  or ch in terminating_chars
+
+def script_scan_mM(pdf_root=None, write_dir=None, save_imgs=False, model_path=None, batch_size=64, num_threads=None, render_workers=0,
+                   crop_store=None):
     seen_fpath = f'{write_dir}/mM_seen.txt'
 
     root = pdf_root # 
@@ -590,7 +916,7 @@ def script_scan_mM(pdf_root=None, write_dir=None, save_imgs=False, model_path=No
     
     initial_chars = 'm\u0000\u0001\u0002\u0003\u0004\u0005\u0006\u0007\u0008\u0011\u0012\u0014\u0015\u0016\u0017\u0018\u0019\u001a\u001b\u001c\u001d\u001e\u001f'
     # initial_chars = None
-    terminating_condition = lambda ch: not ch or ch == '2' or ch == 'o' or not ch.isalnum() #  or ch in terminating_chars
+    terminating_condition = mM_terminating_condition
     # terminating_condition=None
     
     save_imgs=False
@@ -603,7 +929,8 @@ def script_scan_mM(pdf_root=None, write_dir=None, save_imgs=False, model_path=No
     #             allow_lowercase=True, save_imgs=False, terminating_condition=terminating_condition)
     df = dump_images_too(root, all_pdfs, write_dir, target='mM', initial_chars=initial_chars,
                          allow_lowercase=True, save_imgs=save_imgs, terminating_condition=terminating_condition,
-                         model_path=model_path) # ch == '2'
+                         model_path=model_path, batch_size=batch_size, num_threads=num_threads, 
+                         render_workers=render_workers, crop_store=crop_store) # ch == '2'
     
     # additional terminating conditions: [\u0001]m[\b2o]
     
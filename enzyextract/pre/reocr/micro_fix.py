@@ -1,6 +1,7 @@
 # fix pymupdf document by applying redactions. targeting mM -> microM for certain detected
 import re
 from typing import Generator
+import numpy as np
 import pandas as pd
 import polars as pl
 import pymupdf
@@ -12,6 +13,8 @@ widest_mM_re = re.compile(r'\bmm(?=$|[\Wo2])', re.IGNORECASE)
 true_widest_mM_re = re.compile(r'\b[m\u0000\u0001\u0002\u0003\u0004\u0005\u0006\u0007\u0008\u0011\u0012\u0014\u0015\u0016\u0017\u0018\u0019\u001a\u001b\u001c\u001d\u001e\u001f]m(?=$|[\W])', re.IGNORECASE)
 ascii_control_re = re.compile(r'[\x00-\x08\x11\x12\x14-\x1F\x7F-\x9F]') # \x7F-\x9F
 ends_with_ascii_control_re = re.compile(r'[\x00-\x08\x11\x12\x14-\x1F\x7F-\x9F]$') # \x7F-\x9F
+# anything that pymupdf would not consider a word delimiter (JM_is_word_delimiter)
+_not_word_delimiter_re = re.compile(r'[^\x00-\x20\xa0\x7f-\x9f\u202a-\u202e]')
 
 
 def _iob(bbox1: tuple[float, float, float, float], bbox2: tuple[float, float, float, float]):
@@ -99,89 +102,132 @@ def mM_corrected_text(doc: pymupdf.Document, pdfname: str, micro_df: pd.DataFram
     # page.apply_redactions(images=pymupdf.PDF_REDACT_IMAGE_NONE)  # don't touch images
 
 
-def determine_replacement(gen: Generator[tuple, None, None], subset: pl.DataFrame, allow_lowercase=True, _re: re.Pattern=None) -> Generator[tuple, None, None]:
+_bbox_cols = ['x0', 'y0', 'x1', 'y1']
+
+def correction_bboxes(subset: pl.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Collect the mu and m correction bboxes of a (pdf, page) subset into (n, 4) float arrays,
+    so that overlap checks can be done all at once.
+    """
+    return {
+        'mu': subset.filter(pl.col('real_char') == 'mu').select(_bbox_cols).to_numpy().astype(np.float64).reshape(-1, 4),
+        'm': subset.filter(pl.col('real_char') == 'm').select(_bbox_cols).to_numpy().astype(np.float64).reshape(-1, 4),
+    }
+
+def _iob_matrix(bboxes1: np.ndarray, bboxes2: np.ndarray) -> np.ndarray:
+    """
+    Vectorized _iob. For bboxes1 of shape (n, 4) and bboxes2 of shape (k, 4), 
+    returns the (k, n) matrix of intersection area over bbox1 area.
+    """
+    b1 = bboxes1[None, :, :]
+    b2 = bboxes2[:, None, :]
+    inter_w = np.minimum(b1[..., 2], b2[..., 2]) - np.maximum(b1[..., 0], b2[..., 0])
+    inter_h = np.minimum(b1[..., 3], b2[..., 3]) - np.maximum(b1[..., 1], b2[..., 1])
+    # empty rects (ie. no overlap) have 0 area, as in pymupdf
+    intersection = np.where((inter_w > 0) & (inter_h > 0), inter_w * inter_h, 0.0)
+    w1 = bboxes1[:, 2] - bboxes1[:, 0]
+    h1 = bboxes1[:, 3] - bboxes1[:, 1]
+    area1 = np.where((w1 > 0) & (h1 > 0), w1 * h1, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(area1 > 0, intersection / area1, 0.0)
+
+def _any_overlap(corrections: np.ndarray, word_bboxes: np.ndarray, threshold=0.5) -> np.ndarray:
+    """For each word bbox, whether any correction bbox has _iob > threshold."""
+    if len(corrections) == 0 or len(word_bboxes) == 0:
+        return np.zeros(len(word_bboxes), dtype=bool)
+    return (_iob_matrix(corrections, word_bboxes) > threshold).any(axis=1)
+
+CorrectionIndex = dict[tuple[str, int], dict[str, np.ndarray]]
+
+_empty_bboxes = np.zeros((0, 4), dtype=np.float64)
+
+def build_correction_index(micro_df: pl.DataFrame) -> CorrectionIndex:
+    """
+    Group a correction df once into {(pdfname, pageno): {'mu': bboxes, 'm': bboxes}}, 
+    so that looking up a page no longer rescans the whole df.
+    """
+    index = {}
+    if micro_df.is_empty():
+        return index
+    keys = ['pdfname', 'pageno', 'real_char']
+    df = micro_df.filter(
+        pl.col('real_char').is_in(['mu', 'm'])
+    ).select(keys + _bbox_cols).sort(keys, maintain_order=True)
+    # one contiguous array; each group is a slice (view) of it
+    all_bboxes = df.select(_bbox_cols).to_numpy().astype(np.float64)
+    groups = df.with_row_index('_start').group_by(keys, maintain_order=True).agg(
+        pl.col('_start').first(),
+        pl.len().alias('_len'),
+    )
+    for pdfname, pageno, real_char, start, length in groups.iter_rows():
+        entry = index.setdefault((pdfname, pageno), {'mu': _empty_bboxes, 'm': _empty_bboxes})
+        entry[real_char] = all_bboxes[start:start + length]
+    return index
+
+def determine_replacement(gen: Generator[tuple, None, None], subset: pl.DataFrame | dict[str, np.ndarray], allow_lowercase=True, _re: re.Pattern=None) -> Generator[tuple, None, None]:
     """
     Turns a generator of 8-tuples (*bbox, word, *paragraphno) into a generator of 9-tuples, 
     with the last element being the replacement or the original word.
+
+    subset: the corrections for this page, either as a DataFrame or as the output of correction_bboxes.
     """
     if _re is None:
         _re = _re_mM_i if allow_lowercase else _re_mM
 
-    # micro_subset = subset[subset['real_char'] == 'mu']
-    # mM_subset = subset[subset['real_char'] == 'm']
-    micro_subset = subset.filter(pl.col('real_char') == 'mu')
-    mM_subset = subset.filter(pl.col('real_char') == 'm')
-    for x0, y0, x1, y1, word, blockno, lineno, wordno in gen:
-        if _re.search(word):
-            for bbox in micro_subset.select(['x0', 'y0', 'x1', 'y1']).iter_rows():
-                # bbox = (row['x0'], row['y0'], row['x1'], row['y1'])
-                # bbox = (row['letter_x0'], row['letter_y0'], row['letter_x1'], row['letter_y1'])
-                if _iob(bbox, (x0, y0, x1, y1)) > 0.5:
-                    yield x0, y0, x1, y1, word, blockno, lineno, wordno, _re.sub('µM', word) # print("Swapped")
-                    break
-            else:
-                # TODO: warning: yielding is very tricky
-                for bbox in mM_subset.select(['x0', 'y0', 'x1', 'y1']).iter_rows():
-                    # bbox = (row['letter_x0'], row['letter_y0'], row['letter_x1'], row['letter_y1'])
-                    if _iob(bbox, (x0, y0, x1, y1)) > 0.5:
-                        yield x0, y0, x1, y1, word, blockno, lineno, wordno, _re.sub('mM', word) # print("Swapped")
-                        break
-                else:
-                    # TODO: warning: yielding is very tricky
-                    yield x0, y0, x1, y1, word, blockno, lineno, wordno, None
-                # yield x0, y0, x1, y1, word, blockno, lineno, wordno, None
-        else:
-            yield x0, y0, x1, y1, word, blockno, lineno, wordno, None
+    if isinstance(subset, pl.DataFrame):
+        subset = correction_bboxes(subset)
+    micro_bboxes = subset['mu']
+    mM_bboxes = subset['m']
 
-import polars as pl
-def duplex_mM_corrected_text(doc: pymupdf.Document, pdfname: str, micro_df: pl.DataFrame, allow_lowercase=True, _re=None) -> list[str]:
+    words = list(gen)
+    # only words matching the regex need an overlap check
+    candidates = [i for i, tup in enumerate(words) if _re.search(tup[4])]
+    replacements = [None] * len(words)
+    if candidates:
+        word_bboxes = np.array([words[i][:4] for i in candidates], dtype=np.float64)
+        is_micro = _any_overlap(micro_bboxes, word_bboxes)
+        is_mM = _any_overlap(mM_bboxes, word_bboxes)
+        for i, micro, mM in zip(candidates, is_micro, is_mM):
+            if micro:
+                replacements[i] = _re.sub('µM', words[i][4])
+            elif mM:
+                replacements[i] = _re.sub('mM', words[i][4])
+
+    for tup, replacement in zip(words, replacements):
+        yield *tup, replacement
+
+def duplex_mM_corrected_text(doc: pymupdf.Document, pdfname: str, micro_df: pl.DataFrame | CorrectionIndex, allow_lowercase=True, _re=None, _debug=False) -> list[str]:
     """
     Correct text, with help of both get_text('text') (necessary for the weird unicode control characters) and get_text('words') (necessary for the bbox).
+
+    micro_df: the correction df, or preferably a CorrectionIndex from build_correction_index.
+    _debug: warn when the text between two words is not a word delimiter.
     """
-    # pmid_subset = micro_df[micro_df['pdfname'] == pdfname] # type: pymupdf.Page
-    pmid_subset = micro_df.filter(pl.col('pdfname') == pdfname)
+    if isinstance(micro_df, pl.DataFrame):
+        micro_df = build_correction_index(micro_df.filter(pl.col('pdfname') == pdfname))
     result = []
     for pageno, page in enumerate(doc):
-        # subset = pmid_subset[(pmid_subset['pageno'] == pageno)]
-        subset = pmid_subset.filter(pl.col('pageno') == pageno)
+        subset = micro_df.get((pdfname, pageno))
         orig_text = page.get_text('text')
-        # if subset[subset['real_char'] == 'mu'].empty:
-        if subset.filter(pl.col('real_char') == 'mu').is_empty():
+        if subset is None or len(subset['mu']) == 0:
             result.append(orig_text)
         else:
-            new_text = ""
+            pieces = [] # joined once at the end
             scrolling_cursor = 0 # keep track of where we are in the original text
             for x0, y0, x1, y1, word, blockno, lineno, wordno, replacement in determine_replacement(
                 page.get_text('words', flags=pymupdf.TEXTFLAGS_WORDS), subset, allow_lowercase=allow_lowercase,
                 _re=_re):
 
                 up_to = orig_text.index(word, scrolling_cursor)
-                # up_to = orig_text.find(word)
-                # whitespace = orig_text[:up_to]
-                whitespace = orig_text[scrolling_cursor:up_to]
-
-                # these are things it could by, according to pymupdf (JM_is_word_delimiter)
-                if whitespace:
-                    for w in whitespace:
-                        ch = ord(w)
-                        if not (0
-                            or ch <= 32
-                            or ch == 160
-                            or 0x007f <= ch <= 0x009f
-                            or 0x202a <= ch <= 0x202e
-                            or 0x008A == ch
-                        ):
-                            print(f"Whitespace is not whitespace: >{whitespace}<")
-                if replacement is None:
-                    # no replacement. simply fill in from the original text
-                    new_text += whitespace + word
-                    # orig_text = orig_text[up_to + len(word):]
-                    scrolling_cursor = up_to + len(word)
-                else:
-                    new_text += whitespace + replacement
-                    # orig_text = orig_text[up_to + len(word):]
-                    scrolling_cursor = up_to + len(word)
-            result.append(new_text)
+                if up_to > scrolling_cursor:
+                    # whitespace between words
+                    pieces.append(orig_text[scrolling_cursor:up_to])
+                    if _debug and _not_word_delimiter_re.search(orig_text, scrolling_cursor, up_to):
+                        print(f"Whitespace is not whitespace: >{orig_text[scrolling_cursor:up_to]}<")
+                # no replacement: simply fill in from the original text
+                pieces.append(word if replacement is None else replacement)
+                scrolling_cursor = up_to + len(word)
+            result.append(''.join(pieces))
     return result
 
 def script0():
@@ -263,6 +309,48 @@ def script3():
     assert 'µM' not in fixed[2]
     assert 'µM' in fixed[5]
 
+def benchmark_correction_lookup(n_pdfs=2000, n_pages=10, rows_per_page=20, sample_pdfs=200):
+    """
+    Compare the per-pdf cost of looking up page corrections with polars filters 
+    versus with a CorrectionIndex, on a synthetic correction df.
+    """
+    import time
+    n = n_pdfs * n_pages * rows_per_page
+    rng = np.random.default_rng(0)
+    micro_df = pl.DataFrame({
+        'pdfname': np.repeat([str(i) for i in range(n_pdfs)], n_pages * rows_per_page),
+        'pageno': np.tile(np.repeat(np.arange(n_pages), rows_per_page), n_pdfs),
+        'real_char': rng.choice(['mu', 'm'], n),
+        'x0': rng.uniform(0, 500, n),
+        'y0': rng.uniform(0, 700, n),
+    }).with_columns(
+        (pl.col('x0') + 10).alias('x1'),
+        (pl.col('y0') + 10).alias('y1'),
+    )
+    pdfnames = [str(i) for i in range(0, n_pdfs, max(1, n_pdfs // sample_pdfs))]
+
+    start = time.perf_counter()
+    for pdfname in pdfnames:
+        pmid_subset = micro_df.filter(pl.col('pdfname') == pdfname)
+        for pageno in range(n_pages):
+            subset = pmid_subset.filter(pl.col('pageno') == pageno)
+            correction_bboxes(subset)
+    filter_per_pdf = (time.perf_counter() - start) / len(pdfnames)
+
+    start = time.perf_counter()
+    index = build_correction_index(micro_df)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for pdfname in pdfnames:
+        for pageno in range(n_pages):
+            index.get((pdfname, pageno))
+    index_per_pdf = (time.perf_counter() - start) / len(pdfnames)
+
+    print(f"{n} correction rows, {n_pdfs} pdfs x {n_pages} pages")
+    print(f"polars filters:   {filter_per_pdf * 1e3:.3f} ms / pdf")
+    print(f"CorrectionIndex:  {index_per_pdf * 1e3:.4f} ms / pdf (+ {build_time:.2f} s to build once)")
+    return filter_per_pdf, index_per_pdf, build_time
+
 if __name__ == '__main__':
     script3()
     
@@ -0,0 +1,135 @@
+# persistent cache of micro-corrected page text, so that rebuilding a batch
+# (ie. with a new prompt or model) does not need to re-open every pdf with pymupdf
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+import polars as pl
+
+from enzyextract.pre.reocr.micro_fix import CorrectionIndex, build_correction_index
+
+# bump this whenever duplex_mM_corrected_text changes its output,
+# so that stale entries are never served
+CORRECTION_VERSION = 1
+
+
+def file_hash(fpath: str, chunk_size: int = 1 << 20) -> str:
+    """sha256 of the file contents"""
+    h = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def correction_fingerprint(micro_subset: pl.DataFrame | CorrectionIndex, _re: Optional[re.Pattern] = None, allow_lowercase=True) -> str:
+    """
+    Fingerprint of everything (besides the pdf itself) that affects the corrected text:
+    the micro correction bboxes for this pdf, the regex, and the CORRECTION_VERSION.
+    """
+    if isinstance(micro_subset, pl.DataFrame):
+        micro_subset = build_correction_index(micro_subset)
+    h = hashlib.sha256()
+    h.update(f"v{CORRECTION_VERSION}|{allow_lowercase}|".encode())
+    if _re is not None:
+        h.update(f"{_re.pattern}|{_re.flags}|".encode())
+    for key in sorted(micro_subset, key=lambda x: x[1]):
+        h.update(f"{key[1]}|".encode())
+        for real_char in ['mu', 'm']:
+            bboxes = micro_subset[key][real_char]
+            # row order does not affect the correction
+            bboxes = bboxes[np.lexsort(bboxes.T[::-1])]
+            h.update(f"{real_char}{len(bboxes)}|".encode())
+            h.update(bboxes.tobytes())
+    return h.hexdigest()
+
+
+class PageTextCache:
+    """
+    sqlite-backed store of corrected page text, keyed by (pdf_hash, fingerprint).
+
+    Typically lives at {enzy_root}/cache/page_text.sqlite.
+    Safe to open from several worker processes at once.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_text ("
+            " pdf_hash TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " pdfname TEXT,"
+            " pages TEXT NOT NULL,"
+            " created REAL,"
+            " PRIMARY KEY (pdf_hash, fingerprint))"
+        )
+        self.conn.commit()
+
+    def get(self, pdf_hash: str, fingerprint: str) -> Optional[list[str]]:
+        row = self.conn.execute(
+            "SELECT pages FROM page_text WHERE pdf_hash = ? AND fingerprint = ?",
+            (pdf_hash, fingerprint)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, pdf_hash: str, fingerprint: str, pages: list[str], pdfname: str = None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO page_text (pdf_hash, fingerprint, pdfname, pages, created) VALUES (?, ?, ?, ?, ?)",
+            (pdf_hash, fingerprint, pdfname, json.dumps(pages), time.time())
+        )
+        self.conn.commit()
+
+    def invalidate(self, pdfnames: Optional[list[str]] = None) -> int:
+        """
+        Remove cached entries. If pdfnames is None, clears everything.
+        Returns the number of entries removed.
+        """
+        if pdfnames is None:
+            cur = self.conn.execute("DELETE FROM page_text")
+        else:
+            cur = self.conn.executemany(
+                "DELETE FROM page_text WHERE pdfname = ?",
+                [(x,) for x in pdfnames]
+            )
+        self.conn.commit()
+        return cur.rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+def invalidate_text_cache(db_path: str, pdfnames: Optional[list[str]] = None) -> int:
+    """
+    Invalidate the page text cache at db_path, either entirely or only for specific pdfnames (ie. pmids).
+
+    Command line: python -m enzyextract.pre.reocr.text_cache path/to/page_text.sqlite [pmid ...]
+    """
+    if not os.path.exists(db_path):
+        print("No cache found at", db_path)
+        return 0
+    cache = PageTextCache(db_path)
+    removed = cache.invalidate(pdfnames or None)
+    cache.close()
+    print(f"Removed {removed} cached entries from {db_path}")
+    return removed
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python -m enzyextract.pre.reocr.text_cache path/to/page_text.sqlite [pmid ...]")
+        sys.exit(1)
+    invalidate_text_cache(sys.argv[1], sys.argv[2:])
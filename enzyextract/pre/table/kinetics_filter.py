@@ -0,0 +1,99 @@
+import re
+
+# Regular expressions for kinetic term detection, by family
+kinetics_families = {
+    'kcat': r'\bk[\s_\-\'−–]*cat',
+    'km': r'\bk[\s_-]*m\b',
+    'turnover': r'turnover\s*(rate|frequency|number|value)',
+    'catalytic': r'catalytic\s*(efficiency|eﬀiciency|rate|constant|number)',  # |efﬁciency
+    'k_commas': r'\bk\s?,,+',
+    'k0': r'\bk ?0(?!\.)\b', # '\bk\s?0\b', but k0.5 and k\n0\n ends up being roped in
+    'enzyme_turnover': r'enzyme\s*turnover',
+    'per_molar_time': r'[mμ]M[\^\s]*[-−–]1[\^\s]*(s|min)',
+    # 'kinetic_parameter': r'kinetic.parameter',
+    'kinetic': r'kinetic', # v1.0
+    'mm': r'\bmm\b', # v1.0
+    'michaelis': r'Michaelis',
+    # 'steady_state_rate_constant': r'steady.state.rate.constant',
+    'steady_state': r'steady.state' # v1.1
+}
+
+kinetics_re_s = kcat_re_s = [re.compile(x, re.IGNORECASE) for x in kinetics_families.values()]
+
+# a literal that every match of the family contains (after casefold).
+# checking `literal in text` is far cheaper than running the regex, and most pages fail it for most families.
+# no literal contains 'i': re.IGNORECASE also matches ı and İ to i, but casefold does not.
+# (a single alternation of all families is slower than this with python's re: it loses the per-pattern optimizations)
+kinetics_literals = {
+    'kcat': 'cat',
+    'km': 'k',
+    'turnover': 'turnover',
+    'catalytic': 'atalyt',
+    'k_commas': ',,',
+    'k0': '0',
+    'enzyme_turnover': 'turnover',
+    'per_molar_time': 'm',
+    'kinetic': 'net',
+    'mm': 'mm',
+    'michaelis': 'chael',
+    'steady_state': 'steady',
+}
+
+_gated_families = [(name, kinetics_literals[name], pattern) for name, pattern in zip(kinetics_families, kinetics_re_s)]
+
+def kinetics_hits(text: str, first_only=False) -> set[str]:
+    """
+    Which families of kinetics_families hit in text. 
+    The text is casefolded once, and each family's regex only runs if its literal is present.
+    first_only: stop at the first family that hits.
+    """
+    folded = text.casefold()
+    hits = set()
+    for name, literal, pattern in _gated_families:
+        if literal in folded and pattern.search(text):
+            hits.add(name)
+            if first_only:
+                break
+    return hits
+
+def has_kinetics(text: str) -> bool:
+    """Same as any(re.search(x, text) for x in kinetics_re_s), but faster."""
+    return bool(kinetics_hits(text, first_only=True))
+
+def benchmark_kinetics_matcher(n_texts=2000, hit_rate=0.1, text_len=3000):
+    """
+    Compare re.search over every pattern of kinetics_re_s against has_kinetics,
+    on synthetic page-sized texts where only hit_rate of them contain a kinetic term.
+    """
+    import random
+    import time
+    rng = random.Random(0)
+    words = ['the', 'enzyme', 'protein', 'assay', 'buffer', 'was', 'measured', 'at', 'pH', '7.5', 'and', 'Table',
+             'mutant', 'activity', 'of', 'substrate', 'concentration', 'in', 'nM', 'units', 'Figure', 'with', 'a',
+             'kinase', 'kDa', 'week', 'k-fold', '10', '0.5', 'mg', 'min']
+    terms = ['kcat', 'Km', 'turnover number', 'catalytic efficiency', 'Michaelis-Menten', 'mM-1 s-1', 'steady-state']
+    texts = []
+    for _ in range(n_texts):
+        text = []
+        while sum(len(x) + 1 for x in text) < text_len:
+            text.append(rng.choice(words))
+        if rng.random() < hit_rate:
+            text.insert(rng.randrange(len(text)), rng.choice(terms))
+        texts.append(' '.join(text))
+
+    start = time.perf_counter()
+    old = [any(re.search(x, text) for x in kinetics_re_s) for text in texts]
+    separate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = [has_kinetics(text) for text in texts]
+    combined = time.perf_counter() - start
+    assert old == new
+
+    print(f"{n_texts} texts of ~{text_len} chars, {sum(old)} with kinetic terms")
+    print(f"separate patterns: {separate / n_texts * 1e6:.1f} us / text")
+    print(f"has_kinetics:      {combined / n_texts * 1e6:.1f} us / text")
+    return separate, combined
+
+if __name__ == '__main__':
+    benchmark_kinetics_matcher()
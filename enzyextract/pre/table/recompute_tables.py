@@ -163,7 +163,7 @@ def main():
     from enzyextract.pre.table.reocr_for_gmft import load_correction_df
 
     # _all_possible_pdfs = list(os.listdir(root))
-    correction_df = load_correction_df(micros_path, all_pdfnames)
+    correction_df = load_correction_df(micros_path, all_pdfnames, as_index=True)
 
     if not os.path.exists(save_dir):
         print(f"Making directory {save_dir}")
@@ -3,12 +3,12 @@
 import os
 import types
 from typing import Generator
-from enzyextract.pre.reocr.micro_fix import true_widest_mM_re, ends_with_ascii_control_re
+from enzyextract.pre.reocr.micro_fix import true_widest_mM_re, ends_with_ascii_control_re, correction_bboxes, _any_overlap, _empty_bboxes, CorrectionIndex, build_correction_index
 from enzyextract.pre.reocr.reocr_schema import reocr_df_schema, reocr_df_schema_overrides
 from gmft_pymupdf import PyMuPDFPage, PyMuPDFDocument
 from gmft.pdf_bindings.common import BasePage
-from gmft.algorithm.structure import _iob
 
+import numpy as np
 import pandas as pd
 import polars as pl
 import re
@@ -16,9 +16,17 @@ import re
 import pymupdf
 
 # correction_df = pd.read_csv("C:/conjunct/vandy/yang/reocr/results/micros_resnet_v1.csv")
-def load_correction_df(micros_path: str, all_pdfs_for_sanity: list[str], check_mM: bool = False):
+def load_correction_df(micros_path: str, all_pdfs_for_sanity: list[str], check_mM: bool = False, as_index: bool = False):
+    """
+    Load the micro corrections, keeping only confident mu.
+
+    as_index: instead return a CorrectionIndex {(pdfname, pageno): {'mu': bboxes, 'm': bboxes}},
+    which is much cheaper to query per page than filtering the df.
+    """
     if micros_path is None:
         # no correction needed
+        if as_index:
+            return {}
         return pl.DataFrame(
             schema=reocr_df_schema,
             schema_overrides=reocr_df_schema_overrides,
@@ -46,6 +54,8 @@ def load_correction_df(micros_path: str, all_pdfs_for_sanity: list[str], check_m
 
     if not all_pdfs_for_sanity:
         # no sanity check needed
+        if as_index:
+            return build_correction_index(correction_df)
         return correction_df
     # sanity check
     list_of_pdfs_has_suffix = any([x.endswith(".pdf") for x in all_pdfs_for_sanity])
@@ -70,11 +80,13 @@ def load_correction_df(micros_path: str, all_pdfs_for_sanity: list[str], check_m
         if check_mM:
             assert commonality, "No common pdfs found between all_pdfs and correction_df"
     print(f"Common pdfs: {len(commonality)} / {len(all_pdfs_for_sanity)}")
+    if as_index:
+        return build_correction_index(correction_df)
     return correction_df
 
 
 
-def duplex_correction(orig_text: str, gen: Generator[tuple, None, None], micro_subset: pl.DataFrame) -> list[tuple]:
+def duplex_correction(orig_text: str, gen: Generator[tuple, None, None], micro_subset: pl.DataFrame | dict[str, np.ndarray]) -> list[tuple]:
     """
     Turns a generator of 8-tuples (*bbox, word, *paragraphno) into a list of 8-tuples, 
     with the micro correction.
@@ -85,12 +97,23 @@ def duplex_correction(orig_text: str, gen: Generator[tuple, None, None], micro_s
     words = list(gen)
     # micro_subset = subset[subset['real_char'] == 'mu']
 
-    if micro_subset.is_empty():
+    if isinstance(micro_subset, pl.DataFrame):
+        micro_subset = correction_bboxes(micro_subset)
+    micro_bboxes = micro_subset['mu']
+    if len(micro_bboxes) == 0:
         return words
 
     # there is at least 1 correction to be made
     _re = true_widest_mM_re
 
+    # check every regex-matching word against every correction bbox at once
+    candidates = [i for i, tup in enumerate(words) if _re.search(tup[4])]
+    is_micro = [False] * len(words)
+    if candidates:
+        word_bboxes = np.array([words[i][:4] for i in candidates], dtype=np.float64)
+        for i, overlaps in zip(candidates, _any_overlap(micro_bboxes, word_bboxes)):
+            is_micro[i] = overlaps
+
     scrolling_cursor = 0
     result = []
     for i, tup in enumerate(words):
@@ -107,16 +130,11 @@ def duplex_correction(orig_text: str, gen: Generator[tuple, None, None], micro_s
 
 
         repl = word
-        if _re.search(word):
-            for bbox in micro_subset.select(['x0', 'y0', 'x1', 'y1']).iter_rows():
-            # for bbox in micro_subset.select(['letter_x0', 'letter_y0', 'letter_x1', 'letter_y1']).iter_rows():
-                # bbox = (row['x0'], row['y0'], row['x1'], row['y1'])
-                if _iob(bbox, (x0, y0, x1, y1)) > 0.5:
-                    # replace
-                    repl = _re.sub('µM', word)
-                    # fix µMo to µmo
-                    repl = repl.replace("µMo", "µmo")
-                    break
+        if is_micro[i]:
+            # replace
+            repl = _re.sub('µM', word)
+            # fix µMo to µmo
+            repl = repl.replace("µMo", "µmo")
         if whitespace:
             # repl = repl if repl is not None else word
             if ends_with_ascii_control_re.search(whitespace) and (repl.startswith('m') or repl.startswith('M')):
@@ -143,16 +161,28 @@ def duplex_correction(orig_text: str, gen: Generator[tuple, None, None], micro_s
 class PyMuPDFDocument_REOCR(PyMuPDFDocument):
     
     _re_mM = re.compile(r"\bmM\b", re.IGNORECASE)
-    def __init__(self, filename: str, correction_df: pl.DataFrame):
+    def __init__(self, filename: str, correction_df: pl.DataFrame | CorrectionIndex):
         super().__init__(filename)
         self.filename = filename
         # just to be safe
         basename = os.path.basename(self.filename)
         if basename.endswith(".pdf"):
             basename = basename[:-4]
-        self.correction_df = correction_df.filter(
-            pl.col("pdfname").str.replace('\.pdf$', '') == basename
-        )
+        self.basename = basename
+        if isinstance(correction_df, pl.DataFrame):
+            correction_df = build_correction_index(correction_df.filter(
+                pl.col("pdfname").str.replace('\.pdf$', '') == basename
+            ))
+        self.correction_index = correction_df
+
+    def _page_corrections(self, page_number: int) -> dict[str, np.ndarray]:
+        # the index may or may not have the .pdf suffix
+        found = self.correction_index.get((self.basename, page_number))
+        if found is None:
+            found = self.correction_index.get((self.basename + '.pdf', page_number))
+        if found is None:
+            return {'mu': _empty_bboxes, 'm': _empty_bboxes}
+        return found
 
     
     def _correct_page(self, page: PyMuPDFPage):
@@ -162,10 +192,7 @@ class PyMuPDFDocument_REOCR(PyMuPDFDocument):
         #     & (self.correction_df['pageno'] == page.number)
         #     & (self.correction_df['real_char'] == 'mu')
         # ]
-        micro_subset = self.correction_df.filter(
-            (pl.col('pageno') == page.page_number)
-            & (pl.col('real_char') == 'mu')
-        ) # .to_pandas()
+        micro_subset = self._page_corrections(page.page_number)
         words = duplex_correction(page.page.get_text('text'), page.get_positions_and_text_mu(), micro_subset)
         # Define the method to yield from `self.words`
         def get_positions_and_text_mu(self):
@@ -1,7 +1,10 @@
+import glob
 import json
+import multiprocessing
 import os
 import re
 import importlib
+import pymupdf
 from tqdm import tqdm
 
 import gmft
@@ -16,6 +19,7 @@ from gmft_pymupdf import PyMuPDFDocument
 from gmft.table_detection import CroppedTable, TableDetector, TableDetectorConfig
 from gmft.pdf_bindings import PyPDFium2Document
 from gmft.auto import AutoFormatConfig, AutoTableFormatter
+from enzyextract.pre.table.kinetics_filter import has_kinetics, kinetics_re_s, kcat_re_s
 from enzyextract.pre.table.reocr_for_gmft import load_correction_df, PyMuPDFDocument_REOCR
 from gmft.table_function import TATRFormattedTable
 from pypdfium2 import PdfiumError
@@ -25,23 +29,6 @@ for module in [gmft, gmft.common, gmft.table_detection, gmft.table_visualization
                gmft.table_function_algorithm, gmft.table_function, gmft.pdf_bindings]:
     importlib.reload(module)
 
-# Regular expressions for kinetic term detection
-kinetics_re_s = kcat_re_s = [re.compile(x, re.IGNORECASE) for x in \
-    [r'\bk[\s_\-\'−–]*cat', r'\bk[\s_-]*m\b',
-    r'turnover\s*(rate|frequency|number|value)', 
-    r'catalytic\s*(efficiency|eﬀiciency|rate|constant|number)',  # |efﬁciency
-    r'\bk\s?,,+', 
-    r'\bk ?0(?!\.)\b', # '\bk\s?0\b', but k0.5 and k\n0\n ends up being roped in
-    r'enzyme\s*turnover',
-    r'[mμ]M[\^\s]*[-−–]1[\^\s]*(s|min)',
-    # r'kinetic.parameter',
-    r'kinetic', # v1.0
-    r'\bmm\b', # v1.0
-    r'Michaelis',
-    # r'steady.state.rate.constant',
-    r'steady.state' # v1.1
-]]
-
 def setup_directories(save_dir):
     """
     Structure:
@@ -52,6 +39,8 @@ def setup_directories(save_dir):
         - markdown/
         - info/
         - seen.txt
+        - seen/ (per-shard progress of a parallel run, see merge_seen_shards)
+            - seen_<shard>.txt
 
     """
     if not os.path.exists(save_dir):
@@ -61,13 +50,40 @@ def setup_directories(save_dir):
     os.makedirs(f"{save_dir}/markdown", exist_ok=True)
     os.makedirs(f"{save_dir}/info", exist_ok=True)
 
-def ingest_pdf(pdf_path, correction_df, detector):
+def kinetics_candidate_pages(pdf_path, neighbours: int = 1) -> tuple[list[int], int]:
+    """
+    Cheap page-level pre-filter: the pages whose raw text matches any of kinetics_re_s, 
+    plus up to neighbours pages on either side (tables and their captions can be split across pages).
+    Returns (sorted candidate page numbers, total number of pages).
+    If the pdf cannot be read, returns (None, 0), and ingest_pdf decides what to do with it.
+    """
+    try:
+        with pymupdf.open(pdf_path) as doc:
+            n_pages = len(doc)
+            hits = [
+                pageno for pageno, page in enumerate(doc)
+                if has_kinetics(page.get_text())
+            ]
+    except Exception:
+        return None, 0
+    candidates = set()
+    for pageno in hits:
+        candidates.update(range(max(0, pageno - neighbours), min(n_pages, pageno + neighbours + 1)))
+    return sorted(candidates), n_pages
+
+def ingest_pdf(pdf_path, correction_df, detector, pages: list[int] = None):
+    """
+    pages: if given, only run the detector on these page numbers.
+    """
     try:
         doc = PyMuPDFDocument_REOCR(pdf_path, correction_df=correction_df)
     except Exception:
         return [], None
     
-    tables = [table for page in doc for table in detector.extract(page)]
+    if pages is None:
+        tables = [table for page in doc for table in detector.extract(page)]
+    else:
+        tables = [table for pageno in pages for table in detector.extract(doc[pageno])]
     return tables, doc
 
 def create_md(table: TATRFormattedTable, config):
@@ -75,63 +91,224 @@ def create_md(table: TATRFormattedTable, config):
     captions = table.captions()
     return f"""{captions[0]}\n\n{tbl_content}\n\n{captions[1]}"""
 
-def process_pdfs(pdf_root, write_dir, micros_path):
+def shard_pdfs(all_pdfs: list[str], n_shards: int, shard_idx: int) -> list[str]:
+    """
+    Deterministic slice of the pdf list for shard shard_idx (of n_shards).
+    Computed on the full sorted list (before removing seen pdfs), so that a pdf always lands in the same shard.
+    """
+    return sorted(all_pdfs)[shard_idx::n_shards]
+
+def seen_shard_path(write_dir, shard_idx: int = None):
+    """seen.txt for a serial run, or seen/seen_{shard_idx}.txt for a sharded run."""
+    if shard_idx is None:
+        return f"{write_dir}/seen.txt"
+    return f"{write_dir}/seen/seen_{shard_idx}.txt"
+
+def read_seen(write_dir) -> set[str]:
+    """Union of seen.txt and every seen-shard, so that any mix of serial and sharded runs resumes correctly."""
+    seen = set()
+    for fpath in [seen_shard_path(write_dir)] + sorted(glob.glob(f"{write_dir}/seen/seen_*.txt")):
+        if os.path.exists(fpath):
+            with open(fpath, "r") as f:
+                seen.update(x for x in f.read().splitlines() if x)
+    return seen
+
+def merge_seen_shards(write_dir) -> int:
+    """
+    Fold every seen-shard into seen.txt, then remove the shards.
+    Returns the number of pdfs added to seen.txt.
+    """
+    seen_path = seen_shard_path(write_dir)
+    shard_paths = sorted(glob.glob(f"{write_dir}/seen/seen_*.txt"))
+    if not shard_paths:
+        return 0
+    already = set()
+    if os.path.exists(seen_path):
+        with open(seen_path, "r") as f:
+            already = set(f.read().splitlines())
+    added = sorted(read_seen(write_dir) - already)
+    with open(seen_path, "a") as f:
+        for filename in added:
+            f.write(f"{filename}\n")
+    for fpath in shard_paths:
+        os.remove(fpath)
+    return len(added)
+
+def process_pdf(filename, pdf_root, correction_df, detector, formatter, write_dir, 
+                prefilter=False, neighbours=1, stats: dict = None) -> bool:
+    """
+    Detect, filter and format the tables of a single pdf.
+    Returns whether the pdf should be marked as seen.
+
+    prefilter: only run the detector on kinetics_candidate_pages (with that many neighbours). 
+        Note that table indices in the output names then count only the detected tables on candidate pages.
+    stats: if given, accumulates 'pages' and 'skipped_pages'.
+    """
+    md_path = f"{write_dir}/markdown"
+    info_path = f"{write_dir}/info"
+    fp_path = f"{write_dir}/false_positives"
+
+    pdfname = filename[:-4]
+    aok = False
+    doc = None
+    try:
+        pages = None
+        if prefilter:
+            pages, n_pages = kinetics_candidate_pages(f"{pdf_root}/{filename}", neighbours=neighbours)
+            if stats is not None and pages is not None:
+                stats['pages'] = stats.get('pages', 0) + n_pages
+                stats['skipped_pages'] = stats.get('skipped_pages', 0) + n_pages - len(pages)
+        tables, doc = ingest_pdf(f"{pdf_root}/{filename}", correction_df, detector, pages=pages)
+        for i, table in enumerate(tables):
+            text = table.text() + '\n'.join(table.captions())
+            if not has_kinetics(text):
+                continue
+            
+            rotated = table.label == 1
+            out_name = f"{pdfname}_{i}{'.rotated' if rotated else ''}"
+            
+            try:
+                ft = formatter.extract(table)
+                with open(f"{md_path}/{out_name}.md", "w", encoding='utf-8') as f:
+                    f.write(create_md(ft, formatter.config))
+                with open(f"{info_path}/{out_name}.info", "w") as f:
+                    json.dump(ft.to_dict(), f)
+            except ValueError:
+                table.image(dpi=36).save(f"{fp_path}/{out_name}.jpg")
+                with open(f"{fp_path}/{out_name}.info", "w") as f:
+                    json.dump(table.to_dict(), f)
+        aok = True
+
+    except PdfiumError:
+        print(f"Error processing {filename}")
+        aok = True # pdfium is not our fault
+    except Exception as e:
+        raise e
+    finally:
+        if doc is not None:
+            doc.close()
+    return aok
+
+def process_shard(pdf_root, write_dir, micros_path, shard_idx: int = None, n_shards: int = 1, torch_threads: int = None,
+                  prefilter=False, neighbours=1) -> dict:
+    """
+    Process one deterministic slice of the pdfs in pdf_root, with its own detector and formatter.
+    Progress goes to seen/seen_{shard_idx}.txt (or seen.txt when shard_idx is None),
+    so shards can run as separate processes or jobs, and be resumed independently.
+    Returns stats: {'pdfs', 'pages', 'skipped_pages'}.
+    """
+    if torch_threads is not None:
+        import torch
+        torch.set_num_threads(torch_threads)
     setup_directories(write_dir)
-    
+
     all_pdfs = sorted([f for f in os.listdir(pdf_root) if f.endswith(".pdf")])
-    correction_df = load_correction_df(micros_path, all_pdfs)
+    if shard_idx is not None:
+        all_pdfs = shard_pdfs(all_pdfs, n_shards, shard_idx)
+    seen = read_seen(write_dir)
+    all_pdfs = [f for f in all_pdfs if f not in seen]
+    stats = {'pdfs': len(all_pdfs), 'pages': 0, 'skipped_pages': 0}
+    if not all_pdfs:
+        return stats
+
+    correction_df = load_correction_df(micros_path, all_pdfs, as_index=True)
     
     detector = TableDetector()
     formatter = AutoTableFormatter(config=AutoFormatConfig())
     
-    md_path = f"{write_dir}/markdown"
-    info_path = f"{write_dir}/info"
-    fp_path = f"{write_dir}/false_positives"
-    seen_path = f"{write_dir}/seen.txt"
-
-    if os.path.exists(seen_path):
-        with open(seen_path, "r") as f:
-            seen = set(f.read().splitlines())
-        all_pdfs = [f for f in all_pdfs if f not in seen]
+    seen_path = seen_shard_path(write_dir, shard_idx)
+    os.makedirs(os.path.dirname(seen_path), exist_ok=True)
 
-    assert len(all_pdfs) > 0, "No PDFs to process. Check the directory."
-    for filename in tqdm(all_pdfs):
-        
-        pdfname = filename[:-4]
-        aok = False
-        try:
-            tables, doc = ingest_pdf(f"{pdf_root}/{filename}", correction_df, detector)
-            for i, table in enumerate(tables):
-                text = table.text() + '\n'.join(table.captions())
-                if not any(re.search(x, text) for x in kinetics_re_s):
-                    continue
-                
-                rotated = table.label == 1
-                out_name = f"{pdfname}_{i}{'.rotated' if rotated else ''}"
-                
-                try:
-                    ft = formatter.extract(table)
-                    with open(f"{md_path}/{out_name}.md", "w", encoding='utf-8') as f:
-                        f.write(create_md(ft, formatter.config))
-                    with open(f"{info_path}/{out_name}.info", "w") as f:
-                        json.dump(ft.to_dict(), f)
-                except ValueError:
-                    table.image(dpi=36).save(f"{fp_path}/{out_name}.jpg")
-                    with open(f"{fp_path}/{out_name}.info", "w") as f:
-                        json.dump(table.to_dict(), f)
-            aok = True
-
-        except PdfiumError:
-            print(f"Error processing {filename}")
-            aok = True # pdfium is not our fault
-        except Exception as e:
-            raise e
-        finally:
-            if doc is not None:
-                doc.close()
+    for filename in tqdm(all_pdfs, desc=None if shard_idx is None else f"shard {shard_idx}", 
+                         position=0 if shard_idx is None else shard_idx):
+        aok = process_pdf(filename, pdf_root, correction_df, detector, formatter, write_dir, 
+                          prefilter=prefilter, neighbours=neighbours, stats=stats)
         if aok:
             with open(seen_path, "a") as f:
                 f.write(f"{filename}\n")
-        
+    return stats
+
+def _process_shard_star(args):
+    return process_shard(*args)
+
+def _report_prefilter(stats: dict):
+    if stats['pages']:
+        print(f"Pre-filter skipped {stats['skipped_pages']} of {stats['pages']} pages "
+              f"({stats['skipped_pages'] / stats['pages']:.1%})")
 
+def process_pdfs(pdf_root, write_dir, micros_path, workers: int = 1, n_shards: int = None, torch_threads: int = None,
+                 prefilter=False, neighbours=1):
+    """
+    Scan every pdf in pdf_root for kinetics tables.
+
+    workers: if > 1, pdfs are split into n_shards (default: workers) deterministic shards, 
+        processed by a pool of workers that each hold their own TableDetector and AutoTableFormatter.
+        Progress is written to per-shard seen files, which are merged into seen.txt at the end.
+        If the run crashes, just run again: already seen pdfs (in seen.txt or any shard) are skipped.
+    torch_threads: torch threads per worker. Defaults to cpu_count // workers, to avoid oversubscription.
+    prefilter: only send pages whose text matches kinetics_re_s (plus neighbours pages on either side)
+        to the table detector. See prefilter_recall to measure what this loses against a full run.
+    """
+    setup_directories(write_dir)
+    
+    all_pdfs = sorted([f for f in os.listdir(pdf_root) if f.endswith(".pdf")])
+    seen = read_seen(write_dir)
+    all_pdfs = [f for f in all_pdfs if f not in seen]
+
+    assert len(all_pdfs) > 0, "No PDFs to process. Check the directory."
+
+    if workers <= 1:
+        stats = process_shard(pdf_root, write_dir, micros_path, torch_threads=torch_threads, 
+                              prefilter=prefilter, neighbours=neighbours)
+        _report_prefilter(stats)
+        return
+
+    n_shards = n_shards or workers
+    if torch_threads is None:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    jobs = [(pdf_root, write_dir, micros_path, k, n_shards, torch_threads, prefilter, neighbours) for k in range(n_shards)]
+    total = {'pdfs': 0, 'pages': 0, 'skipped_pages': 0}
+    # spawn: torch and polars thread pools do not survive a fork
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for stats in pool.imap_unordered(_process_shard_star, jobs):
+            for k in total:
+                total[k] += stats[k]
+    merged = merge_seen_shards(write_dir)
+    print(f"Merged {merged} pdfs from seen shards into seen.txt")
+    _report_prefilter(total)
+
+def prefilter_recall(pdf_root, full_write_dir, neighbours=1) -> dict:
+    """
+    Measure the recall impact of the page pre-filter against a full (prefilter=False) run in full_write_dir:
+    the fraction of kinetics tables kept by the full run that sit on a page the pre-filter would have kept.
+    Only the cheap text pass is run, no table detection.
+    Returns {'tables', 'recalled', 'recall', 'pages', 'skipped_pages', 'missed': [table names]}.
+    """
+    table_pages = {} # filename -> [(out_name, page_no)]
+    for fpath in sorted(glob.glob(f"{full_write_dir}/info/*.info")):
+        with open(fpath, "r") as f:
+            info = json.load(f)
+        out_name = os.path.basename(fpath)[:-len('.info')]
+        filename = os.path.basename(info['filename'])
+        table_pages.setdefault(filename, []).append((out_name, info['page_no']))
 
+    result = {'tables': 0, 'recalled': 0, 'pages': 0, 'skipped_pages': 0, 'missed': []}
+    for filename, tables in tqdm(table_pages.items()):
+        if not os.path.exists(f"{pdf_root}/{filename}"):
+            continue
+        pages, n_pages = kinetics_candidate_pages(f"{pdf_root}/{filename}", neighbours=neighbours)
+        if pages is None:
+            continue
+        pages = set(pages)
+        result['pages'] += n_pages
+        result['skipped_pages'] += n_pages - len(pages)
+        for out_name, page_no in tables:
+            result['tables'] += 1
+            if page_no in pages:
+                result['recalled'] += 1
+            else:
+                result['missed'].append(out_name)
+    result['recall'] = result['recalled'] / result['tables'] if result['tables'] else 1.0
+    print(f"Pre-filter recall: {result['recalled']}/{result['tables']} ({result['recall']:.2%}) tables, "
+          f"skipping {result['skipped_pages']}/{result['pages']} pages of those pdfs")
+    return result
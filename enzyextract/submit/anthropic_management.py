@@ -8,6 +8,7 @@ from anthropic.types.messages.batch_create_params import Request
 
 from enzyextract.submit.batch_utils import image_to_base64
 from enzyextract.submit.base import LLMCommonBatch, SubmitPreference, do_presubmit
+from enzyextract.submit.batch_download import anthropic_results_count
 
 _client = None
 def get_client():
@@ -126,7 +127,8 @@ def retrieve_anthropic_batch(batch_id: str):
         status=status,
         output_file_id=message_batch.results_url,
         error_file_id=None,
-        endpoint='anthropic_custom'
+        endpoint='anthropic_custom',
+        output_count=anthropic_results_count(message_batch.request_counts.to_dict()) if status == 'completed' else None,
     )
 
 class ResponseLike:
@@ -135,12 +137,14 @@ class ResponseLike:
         self.content = content
 
 
-def retrieve_anthropic_results(batch_id: str, file_id: str, to_json_response: bool = False):
+def retrieve_anthropic_results(batch_id: str, file_id: str, to_json_response: bool = False, stream: bool = False):
     """Retrieve anthropic batch results. Assumes that they are ready.
     
     Args:
         batch_id (str): The ID of the batch to retrieve.
         to_json_response (bool): If True, access through return_value.content
+        stream (bool): If True, the body is not read up front: iterate over return_value.iter_content(chunk_size)
+            (to_json_response is implied).
     """
     client = get_client()
 
@@ -163,12 +167,12 @@ def retrieve_anthropic_results(batch_id: str, file_id: str, to_json_response: bo
         "anthropic-version": "2023-06-01"
     }
 
-    response = requests.get(file_id, headers=headers)
+    response = requests.get(file_id, headers=headers, stream=stream)
 
     if response.status_code != 200:
         raise ValueError(f"Failed to retrieve results: {response.status_code}, {response.text}")
 
-    if to_json_response:
+    if to_json_response or stream:
         return response
     else:
         return response.json()
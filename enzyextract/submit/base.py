@@ -113,6 +113,10 @@ class LLMCommonBatch:
     ] = None
     output_file_id: Optional[str] = None
     error_file_id: Optional[str] = None
+    output_count: Optional[int] = None
+    """Number of lines expected in the output file (None: unknown)"""
+    error_count: Optional[int] = None
+    """Number of lines expected in the error file (None: unknown)"""
     
 
 class ReusePreference(Enum):
@@ -1,8 +1,9 @@
 import base64
 import hashlib
-import json
 import polars as pl
 
+from enzyextract.utils import fast_json
+
 outputs_schema = {
     "custom_id": pl.Utf8,
     "content": pl.Utf8,
@@ -13,11 +14,11 @@ outputs_schema = {
 
 def stream_jsonl(fpath: str):
     """stream a jsonl file"""
-    with open(fpath, 'r', encoding='utf-8') as f:
+    with open(fpath, 'rb') as f:
         for line in f:
             try:
-                obj = json.loads(line)
-            except json.JSONDecodeError as e:
+                obj = fast_json.loads(line)
+            except fast_json.JSONDecodeError as e:
                 print(f"Error decoding JSON: {e}")
                 continue
             yield obj
@@ -0,0 +1,354 @@
+"""
+Concurrent download of finished batches. See step2_download.download.
+
+Batches are polled and downloaded in parallel (bounded by max_concurrency), files are streamed
+to disk chunk by chunk, and the llm_log is updated once at the end.
+
+Files are written to {dest}.part, and only renamed to dest once their line count matches the
+batch's request counts, so a file at dest is always complete.
+
+The openai and anthropic clients honour the same base url environment variables as the litellm and anthropic sdk
+paths they replace. Proxies (HTTP_PROXY, HTTPS_PROXY, NO_PROXY) are honoured by requests, as by httpx.
+"""
+import asyncio
+import os
+import sys
+from typing import Callable, Iterator, Optional
+
+import polars as pl
+import requests
+
+from enzyextract.pipeline.llm_log import read_log, update_log_records
+from enzyextract.submit.base import LLMCommonBatch
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20 # 1 MiB
+
+
+class IncompleteDownloadError(ValueError):
+    """The downloaded file has fewer (or more) lines than the batch has requests."""
+
+
+def _finish_download(part_path: str, dest: str, n_lines: int, expected_lines: Optional[int]):
+    """Check the line count of a finished .part file, then move it into place."""
+    if expected_lines is not None and n_lines != expected_lines:
+        os.remove(part_path)
+        raise IncompleteDownloadError(f"Expected {expected_lines} lines for {dest}, but received {n_lines}")
+    os.replace(part_path, dest)
+
+
+def _count_lines(chunks: Iterator[bytes], f=None) -> int:
+    """Count the lines in a stream of chunks (a last line without trailing newline counts), writing them to f if given."""
+    n_lines = 0
+    last = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if f is not None:
+            f.write(chunk)
+        n_lines += chunk.count(b'\n')
+        last = chunk
+    if last and not last.endswith(b'\n'):
+        n_lines += 1
+    return n_lines
+
+
+def count_lines(fpath: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> int:
+    """Count the lines of a file, without reading it all at once."""
+    with open(fpath, 'rb') as f:
+        return _count_lines(iter(lambda: f.read(chunk_size), b''))
+
+
+def write_chunks(chunks: Iterator[bytes], dest: str, expected_lines: int = None) -> int:
+    """
+    Stream chunks to dest.part, then rename to dest if the number of lines is expected_lines (None: do not check).
+    Returns the number of lines.
+    """
+    part_path = dest + '.part'
+    try:
+        with open(part_path, 'wb') as f:
+            n_lines = _count_lines(chunks, f)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    _finish_download(part_path, dest, n_lines, expected_lines)
+    return n_lines
+
+
+def anthropic_results_count(request_counts: dict) -> int:
+    """Every request of an ended anthropic batch has exactly one line in the results, whether it succeeded or not."""
+    return sum(request_counts.get(x, 0) for x in ['succeeded', 'errored', 'canceled', 'expired'])
+
+
+def expected_line_counts(batch) -> tuple[Optional[int], Optional[int]]:
+    """
+    (output lines, error lines) expected from a completed batch, or None where unknown.
+    Understands LLMCommonBatch and openai-style batches (with request_counts.completed and .failed)
+    """
+    output_count = getattr(batch, 'output_count', None)
+    error_count = getattr(batch, 'error_count', None)
+    if output_count is None and error_count is None:
+        request_counts = getattr(batch, 'request_counts', None)
+        if isinstance(request_counts, dict):
+            output_count, error_count = request_counts.get('completed'), request_counts.get('failed')
+        elif request_counts is not None:
+            output_count, error_count = getattr(request_counts, 'completed', None), getattr(request_counts, 'failed', None)
+    return output_count, error_count
+
+
+class BatchDownloadClient:
+    """
+    How to poll a batch and fetch its files, for one provider.
+    Subclasses implement retrieve_batch and iter_file; both are blocking, and run in worker threads.
+    """
+    def retrieve_batch(self, batch_id: str) -> LLMCommonBatch:
+        raise NotImplementedError
+
+    def iter_file(self, batch_id: str, file_id: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def download(self, batch_id: str, file_id: str, dest: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 expected_lines: int = None) -> int:
+        """Stream a file to dest (see write_chunks). Returns the number of lines."""
+        return write_chunks(self.iter_file(batch_id, file_id, chunk_size=chunk_size), dest, expected_lines)
+
+
+class OpenAIDownloadClient(BatchDownloadClient):
+    """openai (or any openai-compatible server, via base_url, or OPENAI_BASE_URL / OPENAI_API_BASE like litellm)."""
+    def __init__(self, base_url: str = None, api_key: str = None, timeout: float = 60):
+        self.base_url = (base_url or os.environ.get('OPENAI_BASE_URL') or os.environ.get('OPENAI_API_BASE') 
+                         or 'https://api.openai.com/v1').rstrip('/')
+        self.api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        self.timeout = timeout
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def retrieve_batch(self, batch_id: str) -> LLMCommonBatch:
+        response = requests.get(f"{self.base_url}/batches/{batch_id}", headers=self._headers(), timeout=self.timeout)
+        response.raise_for_status()
+        obj = response.json()
+        request_counts = obj.get('request_counts') or {}
+        return LLMCommonBatch(
+            _underlying=obj,
+            status=obj['status'],
+            output_file_id=obj.get('output_file_id'),
+            error_file_id=obj.get('error_file_id'),
+            endpoint=obj.get('endpoint'),
+            output_count=request_counts.get('completed'),
+            error_count=request_counts.get('failed'),
+        )
+
+    def iter_file(self, batch_id: str, file_id: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        with requests.get(f"{self.base_url}/files/{file_id}/content", headers=self._headers(),
+                          stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size=chunk_size)
+
+
+def _anthropic_base_url(base_url: str) -> str:
+    """
+    The api root, as the anthropic sdk takes it in ANTHROPIC_BASE_URL (ie. https://api.anthropic.com).
+    Also accepts the root with /v1 or /v1/messages, as litellm takes it in ANTHROPIC_API_BASE.
+    """
+    base_url = base_url.rstrip('/')
+    for suffix in ('/v1/messages', '/v1'):
+        if base_url.endswith(suffix):
+            return base_url[:-len(suffix)]
+    return base_url
+
+
+class AnthropicDownloadClient(BatchDownloadClient):
+    """
+    anthropic message batches. The output "file" is the batch's results_url.
+    base_url: the api root, or ANTHROPIC_BASE_URL / ANTHROPIC_API_BASE (see _anthropic_base_url)
+    """
+    def __init__(self, base_url: str = None, api_key: str = None, timeout: float = 60):
+        self.base_url = _anthropic_base_url(base_url or os.environ.get('ANTHROPIC_BASE_URL') 
+                                            or os.environ.get('ANTHROPIC_API_BASE') or 'https://api.anthropic.com')
+        self.api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
+        self.timeout = timeout
+
+    def _headers(self):
+        return {"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}
+
+    def retrieve_batch(self, batch_id: str) -> LLMCommonBatch:
+        response = requests.get(f"{self.base_url}/v1/messages/batches/{batch_id}", headers=self._headers(), timeout=self.timeout)
+        response.raise_for_status()
+        obj = response.json()
+        # same mapping as retrieve_anthropic_batch
+        status = obj['processing_status']
+        if status == 'canceling':
+            status = 'cancelling'
+        elif status == 'ended':
+            status = 'completed'
+        return LLMCommonBatch(
+            _underlying=obj,
+            status=status,
+            output_file_id=obj.get('results_url'),
+            error_file_id=None,
+            endpoint='anthropic_custom',
+            output_count=anthropic_results_count(obj.get('request_counts') or {}) if status == 'completed' else None,
+        )
+
+    def iter_file(self, batch_id: str, file_id: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        with requests.get(file_id, headers=self._headers(), stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise ValueError(f"Failed to retrieve results: {response.status_code}, {response.text}")
+            yield from response.iter_content(chunk_size=chunk_size)
+
+
+class CallbackDownloadClient(BatchDownloadClient):
+    """
+    Wraps blocking functions, ie. litellm's (see step2_download), for the remaining providers.
+    retrieve_batch(batch_id) should return an object with status, output_file_id and error_file_id.
+    retrieve_file(batch_id, file_id) should return an object with either
+    iter_content(chunk_size) (requests), iter_bytes(chunk_size) (httpx, ie. litellm) or .content.
+    download_gcs(gs_url, dest): for gs:// outputs (vertex_ai).
+    """
+    def __init__(self, retrieve_batch: Callable, retrieve_file: Callable, download_gcs: Callable = None):
+        self._retrieve_batch = retrieve_batch
+        self._retrieve_file = retrieve_file
+        self._download_gcs = download_gcs
+
+    def retrieve_batch(self, batch_id: str) -> LLMCommonBatch:
+        return self._retrieve_batch(batch_id)
+
+    def iter_file(self, batch_id: str, file_id: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        file = self._retrieve_file(batch_id, file_id)
+        if hasattr(file, 'iter_content'):
+            yield from file.iter_content(chunk_size=chunk_size)
+        elif hasattr(file, 'iter_bytes'):
+            yield from file.iter_bytes(chunk_size=chunk_size)
+        else:
+            content = file.content
+            for i in range(0, len(content), chunk_size):
+                yield content[i:i + chunk_size]
+
+    def download(self, batch_id: str, file_id: str, dest: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 expected_lines: int = None) -> int:
+        if file_id.startswith("gs://"):
+            # rip, litellm does not support GCS
+            part_path = dest + '.part'
+            self._download_gcs(file_id + '/predictions.jsonl', part_path)
+            n_lines = count_lines(part_path, chunk_size=chunk_size)
+            _finish_download(part_path, dest, n_lines, expected_lines)
+            return n_lines
+        return super().download(batch_id, file_id, dest, chunk_size=chunk_size, expected_lines=expected_lines)
+
+
+def _litellm_configured_in_code() -> bool:
+    """Whether litellm's base url or http clients (ie. with a proxy) were set in code, which a REST client cannot see."""
+    litellm = sys.modules.get('litellm') # if it was never imported, it was never configured
+    if litellm is None:
+        return False
+    return any(getattr(litellm, x, None) is not None for x in ('api_base', 'client_session', 'aclient_session'))
+
+
+def default_download_client(llm_provider: str) -> Optional[BatchDownloadClient]:
+    """
+    REST client for openai and anthropic. None for other providers (ie. go through litellm),
+    and for openai when litellm was configured in code, so that its settings still apply.
+    """
+    if llm_provider == 'openai':
+        if _litellm_configured_in_code():
+            return None
+        return OpenAIDownloadClient()
+    elif llm_provider == 'anthropic':
+        return AnthropicDownloadClient()
+    return None
+
+
+def _download_one(client: BatchDownloadClient, row: dict, dest_folder: str, err_folder: str, chunk_size: int) -> Optional[dict]:
+    """Poll one batch, and download it if it is done. Returns the log update, or None if it is not ready."""
+    namespace, version, shard, batch_id = row['namespace'], row['version'], row['shard'], row['batch_uuid']
+    fname = f"{namespace}_{version}.{shard}.jsonl" if shard is not None else f"{namespace}_{version}.jsonl"
+    write_dest = f"{dest_folder}/{fname}"
+    update = {
+        'namespace': namespace,
+        'version': version,
+        'shard': shard,
+        'completion_fpath': write_dest,
+        'status': 'downloaded',
+    }
+    # check if the file already exists
+    if os.path.exists(write_dest):
+        print(f"File {write_dest} already exists, skipping download.")
+        return update
+
+    retrieved_batch = client.retrieve_batch(batch_id)
+    if retrieved_batch.status != 'completed':
+        return None
+
+    output_count, error_count = expected_line_counts(retrieved_batch)
+
+    # the error file goes first: once write_dest exists, this batch is never looked at again
+    err_file_id = retrieved_batch.error_file_id
+    if err_file_id:
+        # shards download concurrently, so each needs its own error file
+        err_dest = f"{err_folder}/{fname}"
+        client.download(batch_id, err_file_id, err_dest, chunk_size=chunk_size, expected_lines=error_count)
+        print(f"Downloaded error file {err_dest}")
+
+    output_file_id = retrieved_batch.output_file_id
+    if output_file_id is None:
+        print(f"Batch {batch_id} has no output file (possibly it all errored).")
+        update['completion_fpath'] = None
+    else:
+        client.download(batch_id, output_file_id, write_dest, chunk_size=chunk_size, expected_lines=output_count)
+        print(f"Downloaded {write_dest}")
+    return update
+
+
+async def download_async(
+    log_location: str,
+    dest_folder: str,
+    err_folder: str,
+    *,
+    max_concurrency: int = 8,
+    clients: dict[str, BatchDownloadClient] = None,
+    make_client: Callable[[str], Optional[BatchDownloadClient]] = default_download_client,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+) -> list[dict]:
+    """
+    Poll every submitted batch in the log, max_concurrency at a time, and download those that are complete.
+    The log is written once, at the end.
+
+    clients: llm_provider -> client. Providers missing from it get make_client(llm_provider).
+    Returns the log updates.
+    """
+    os.makedirs(dest_folder, exist_ok=True)
+    os.makedirs(err_folder, exist_ok=True)
+
+    log = read_log(log_location)
+    to_download = log.filter(
+        pl.col('status') == 'submitted'
+    ).select('namespace', 'version', 'shard', 'batch_uuid', 'llm_provider')
+
+    clients = dict(clients or {})
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(row: dict):
+        llm_provider = row['llm_provider']
+        if llm_provider not in clients:
+            clients[llm_provider] = make_client(llm_provider)
+        client = clients[llm_provider]
+        if client is None:
+            print(f"No download client for {llm_provider}, skipping batch {row['batch_uuid']}")
+            return None
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(_download_one, client, row, dest_folder, err_folder, chunk_size)
+            except Exception as e:
+                # one bad batch should not lose the others
+                print(f"Error downloading batch {row['batch_uuid']}: {e}")
+                return None
+
+    results = await asyncio.gather(*(run(row) for row in to_download.iter_rows(named=True)))
+    updates = [x for x in results if x is not None]
+
+    if not updates:
+        print("No new files to download.")
+        return updates
+    update_log_records(log_location, updates)
+    return updates
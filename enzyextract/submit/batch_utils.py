@@ -5,6 +5,10 @@ Formerly located in enzyextract.utils.construct_batch
 
 
 import json
+import os
+from dataclasses import dataclass
+
+from enzyextract.utils import fast_json
 
 import PIL
 from PIL import Image
@@ -87,35 +91,209 @@ def versioned_namespace_from_usual_cid(cid: str) -> tuple[str, int]:
     
 
 def write_to_jsonl(batch, filename):
-    with open(filename, 'w') as f:
+    with open(filename, 'wb') as f:
         for item in batch:
-            f.write(json.dumps(item) + '\n')
+            f.write(fast_json.dumpb(item) + b'\n')
+
+# OpenAI rejects batch input files over 200 MB. leave some headroom.
+MAX_BATCH_FILE_BYTES = 190 * 1000 * 1000
+
+@dataclass
+class BatchLimits:
+    """Per-file and per-request limits of a provider's batch API."""
+    max_bytes: int # per batch file
+    max_requests: int # per batch file
+    max_request_tokens: int # per request (input), ie. the context window
+
+# with some headroom under the documented limits
+provider_batch_limits = {
+    'openai': BatchLimits(max_bytes=MAX_BATCH_FILE_BYTES, max_requests=50_000, max_request_tokens=128_000),
+    'anthropic': BatchLimits(max_bytes=245 * 1000 * 1000, max_requests=100_000, max_request_tokens=200_000),
+}
 
-def chunked_write_to_jsonl(batch, filepath, chunk_size=1000):
+def get_batch_limits(llm_provider: str) -> BatchLimits:
+    """Limits for llm_provider, defaulting to openai's (the strictest)."""
+    return provider_batch_limits.get(llm_provider, provider_batch_limits['openai'])
+
+# openai: 85 base tokens, plus 170 per 512px tile for high detail.
+# a high detail image is scaled to fit 2048x768 at most, which is 8 tiles.
+_low_detail_image_tokens = 85
+_max_image_tokens = 85 + 170 * 8
+
+def estimate_request_tokens(req: dict) -> int:
+    """
+    Cheap upper-ish estimate of the input tokens of a batch request (see to_openai_batch_request):
+    ~4 characters per token for text, and the worst case for images.
+    """
+    n_chars = 0
+    n_tokens = 0
+    body = req.get('body', {})
+    for msg in body.get('messages', []):
+        content = msg.get('content')
+        if isinstance(content, str):
+            n_chars += len(content)
+            continue
+        for part in content or []:
+            if part.get('type') == 'image_url':
+                detail = part['image_url'].get('detail', 'auto')
+                n_tokens += _low_detail_image_tokens if detail == 'low' else _max_image_tokens
+            else:
+                n_chars += len(part.get('text', ''))
+    if 'response_format' in body:
+        n_chars += len(fast_json.dumps(body['response_format']))
+    return n_tokens + -(-n_chars // 4)
+
+def _shard_path(filepath, i):
+    if filepath.endswith('.jsonl'):
+        return f'{filepath[:-6]}.{i}.jsonl'
+    return f'{filepath}.{i}.jsonl'
+
+class JsonlShardWriter:
+    """
+    Streaming sink for batch requests: each request is serialized as soon as it is written,
+    and the output rolls over to a new shard after max_requests requests or max_bytes bytes,
+    so memory stays flat no matter how many requests there are.
+
+    Shards are named like chunked_write_to_jsonl: filepath itself if there is only one shard,
+    otherwise {filepath without .jsonl}.{i}.jsonl, where i is the index of the shard's first request.
+    Each shard is written to a .part file, then renamed into place when complete.
+
+    skip_existing: if a shard's destination already exists, keep it and discard the new shard.
+    limits: a provider's BatchLimits (see get_batch_limits). max_bytes and max_requests are capped to it,
+        and requests estimated over limits.max_request_tokens are flagged in the manifest (see print_shard_plan).
+
+    Shards are packed greedily in order, which gives the fewest shards that keep the requests' order.
+
+    Usage:
+        with JsonlShardWriter(filepath) as sink:
+            for req in requests:
+                sink.write(req)
+        write_dests = [x['path'] for x in sink.manifest]
+    """
+    def __init__(self, filepath, max_requests=1000, max_bytes=MAX_BATCH_FILE_BYTES, skip_existing=False, 
+                 limits: BatchLimits = None):
+        if limits is not None:
+            max_requests = min(max_requests, limits.max_requests) if max_requests else limits.max_requests
+            max_bytes = min(max_bytes, limits.max_bytes) if max_bytes else limits.max_bytes
+        self.filepath = filepath
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.skip_existing = skip_existing
+        self.limits = limits
+        # [{'path', 'first_index', 'n_requests', 'n_bytes', 'max_tokens', 'oversize', 'reused'}]
+        self.manifest = []
+        self.n_written = 0
+        self._file = None
+        self._first_index = 0
+        self._n_requests = 0
+        self._n_bytes = 0
+        self._max_tokens = 0
+        self._oversize = []
+        self._closed = False
+
+    def _part_path(self):
+        return f'{_shard_path(self.filepath, self._first_index)}.part'
+
+    def write(self, item: dict):
+        line = fast_json.dumpb(item) + b'\n'
+        if self.max_bytes is not None and len(line) > self.max_bytes:
+            raise ValueError(f"Request {item.get('custom_id')} alone is {len(line)} bytes, over the {self.max_bytes} byte limit")
+        if self._file is not None and (
+            self._n_requests >= self.max_requests 
+            or (self.max_bytes is not None and self._n_bytes + len(line) > self.max_bytes)
+        ):
+            self._finish_shard(is_last=False)
+        if self._file is None:
+            self._first_index = self.n_written
+            self._n_requests = 0
+            self._n_bytes = 0
+            self._max_tokens = 0
+            self._oversize = []
+            self._file = open(self._part_path(), 'wb')
+        self._file.write(line)
+        self._n_requests += 1
+        self._n_bytes += len(line)
+        if self.limits is not None:
+            tokens = estimate_request_tokens(item)
+            self._max_tokens = max(self._max_tokens, tokens)
+            if tokens > self.limits.max_request_tokens:
+                self._oversize.append(item.get('custom_id'))
+        self.n_written += 1
+
+    def _finish_shard(self, is_last: bool):
+        self._file.close()
+        part_path = self._part_path()
+        # a lone shard keeps the plain filepath
+        if is_last and not self.manifest:
+            dest = self.filepath
+        else:
+            dest = _shard_path(self.filepath, self._first_index)
+        reused = self.skip_existing and os.path.exists(dest)
+        if reused:
+            os.remove(part_path)
+        else:
+            os.replace(part_path, dest)
+        self.manifest.append({
+            'path': dest,
+            'first_index': self._first_index,
+            'n_requests': self._n_requests,
+            'n_bytes': self._n_bytes,
+            'max_tokens': self._max_tokens if self.limits is not None else None,
+            'oversize': self._oversize,
+            'reused': reused,
+        })
+        self._file = None
+
+    def close(self) -> list[dict]:
+        """Finish the last shard and return the manifest."""
+        if not self._closed:
+            if self._file is not None:
+                self._finish_shard(is_last=True)
+            self._closed = True
+        return self.manifest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._file is not None:
+            # do not leave a half-written shard behind
+            self._file.close()
+            os.remove(self._part_path())
+            self._file = None
+        self.close()
+
+def print_shard_plan(manifest: list[dict], limits: BatchLimits = None):
+    """Report the size of each shard (against the provider limits), to review before uploading anything."""
+    for shard in manifest:
+        line = f"{shard['path']}: {shard['n_requests']} requests, {shard['n_bytes'] / 1e6:.1f} MB"
+        if limits is not None:
+            line += f" ({shard['n_bytes'] / limits.max_bytes:.0%} of limit)"
+        if shard.get('max_tokens') is not None:
+            line += f", largest request ~{shard['max_tokens']} tokens"
+        if shard['reused']:
+            line += " [existing file kept]"
+        print(line)
+        if shard.get('oversize'):
+            print(f"  WARNING: {len(shard['oversize'])} requests likely exceed {limits.max_request_tokens} tokens: "
+                  f"{shard['oversize'][:5]}{'...' if len(shard['oversize']) > 5 else ''}")
+
+def chunked_write_to_jsonl(batch, filepath, chunk_size=1000, max_bytes=MAX_BATCH_FILE_BYTES, llm_provider: str = None):
     """
     Need to enforce chunk size, since OpenAI has data size limit
 
     filepath: complete path to a file, INCLUDING {dest_folder}/{namespace}.jsonl
+    batch: any iterable of requests. A generator keeps memory flat (see JsonlShardWriter).
+    llm_provider: if given, also respect (and report against) that provider's BatchLimits
     Returns list of filenames written to, so they can be opened and submitted in sequence
     """
-    # chunk_size = 1000
-    have_multiple = len(batch) > chunk_size # need to enforce chunk size, since OpenAI has data size limit
-
-    write_dests = []
-    for i in range(0, len(batch), chunk_size):
-        chunk = batch[i:i+chunk_size]
-        if have_multiple:
-            if filepath.endswith('.jsonl'):
-                will_write_to = f'{filepath[:-6]}.{i}.jsonl'
-            else:
-                will_write_to = f'{filepath}.{i}.jsonl'
-            # will_write_to = f'{dest_folder}/{namespace}_{version}.{i}.jsonl'
-        else:
-            will_write_to = filepath
-        write_to_jsonl(chunk, will_write_to)
-        write_dests.append(will_write_to)
-    return write_dests
-
+    limits = get_batch_limits(llm_provider) if llm_provider is not None else None
+    with JsonlShardWriter(filepath, max_requests=chunk_size, max_bytes=max_bytes, limits=limits) as sink:
+        for item in batch:
+            sink.write(item)
+    if limits is not None:
+        print_shard_plan(sink.manifest, limits)
+    return [x['path'] for x in sink.manifest]
 
 
 import json
@@ -168,9 +346,9 @@ def decode_custom_id(output_filepath):
             # output
             prefix = len('''{"id": "batch_req_cOTEwOobeyeib0QWIhpo7PWQ", "custom_id": "''') # "custom_id": 
             return line[prefix:line.index('"', prefix)]
-        elif line.startswith('{"custom_id": "'):
-            # input
-            prefix = len('{"custom_id": "')
+        elif line.startswith('{"custom_id":'):
+            # input (written with or without spaces, depending on the json backend)
+            prefix = line.index('"', len('{"custom_id":')) + 1
             return line[prefix:line.index('"', prefix)]
 
 def preview_batches_in_folder(src_folder, output_folder, undownloaded_only=True, printme=True):
@@ -208,9 +386,9 @@ def preview_batches_in_folder(src_folder, output_folder, undownloaded_only=True,
 def get_batch_output(filename, allow_unfinished=True) -> list[tuple[str, str, str]]:
     # return list of (custom_id, content, finish_reason)
     result = []
-    with open(filename, 'r', encoding='utf-8') as f:
+    with open(filename, 'rb') as f:
         for line in f:
-            obj = json.loads(line)
+            obj = fast_json.loads(line)
             finish_reason = obj['response']['body']['choices'][0]['finish_reason']
             if not allow_unfinished and finish_reason == 'length':
                 continue # skip too long
@@ -221,9 +399,9 @@ def get_batch_output(filename, allow_unfinished=True) -> list[tuple[str, str, st
 def get_batch_input(filename) -> list[tuple[str, list[str]]]:
     # return list of (custom_id, docs)
     result = []
-    with open(filename, 'r') as f:
+    with open(filename, 'rb') as f:
         for line in f:
-            obj = json.loads(line)
+            obj = fast_json.loads(line)
             docs = [msg['content'] for msg in obj['body']['messages'][1:]]
             result.append((obj['custom_id'], docs))
     return result
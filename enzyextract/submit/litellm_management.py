@@ -6,11 +6,13 @@ from dotenv import load_dotenv
 def process_env(filepath):
     load_dotenv(filepath)
 
-async def submit_litellm_batch_file(filepath, pending_file=None, custom_llm_provider='openai'):
+async def submit_litellm_batch_file(filepath, pending_file=None, custom_llm_provider='openai', metadata: dict = None):
     """
     Submit a batch file using LiteLLM.
     https://docs.litellm.ai/docs/batches
 
+    metadata: extra metadata for the batch (ie. batch_hash), alongside the filepath.
+
     Returns a tuple: (
         file_uuid: str,
         batch_uuid: str,
@@ -36,7 +38,8 @@ async def submit_litellm_batch_file(filepath, pending_file=None, custom_llm_prov
         completion_window="24h",
         custom_llm_provider=custom_llm_provider,
         metadata={
-            "filepath": filepath
+            "filepath": filepath,
+            **(metadata or {}),
         }
     )
     
@@ -0,0 +1,184 @@
+"""
+Concurrent batch submission. See step1_main and stream_submit_batch.
+
+Shards are uploaded and created as batches concurrently, under a per-provider limit on concurrency
+and on submissions per minute. Failed submissions are retried with exponential backoff and full jitter.
+
+Each shard is identified by the hash of its contents (batch_hash in the llm_log): a shard that the log
+already records as submitted (or downloaded) is not submitted again, so re-running after a partial failure
+only submits what is missing.
+"""
+import asyncio
+import base64
+import hashlib
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import polars as pl
+
+
+@dataclass
+class SubmitRateLimit:
+    """How hard we may hit one provider's batch api"""
+    max_concurrency: int = 4
+    """Submissions (upload + create) in flight at once"""
+    per_minute: float = 30
+    """Submissions started per minute"""
+
+# conservative: the providers' own limits are much higher, but also shared with everything else on the key
+provider_submit_limits = {
+    'openai': SubmitRateLimit(max_concurrency=8, per_minute=60),
+    'anthropic': SubmitRateLimit(max_concurrency=8, per_minute=60),
+    'vertex_ai': SubmitRateLimit(max_concurrency=4, per_minute=30),
+}
+
+def get_submit_limit(llm_provider: str) -> SubmitRateLimit:
+    return provider_submit_limits.get(llm_provider, SubmitRateLimit())
+
+
+class AsyncRateLimiter:
+    """Spaces acquisitions evenly, at most per_minute of them per minute."""
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute if per_minute else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+async def retry_with_jitter(
+    fn: Callable[[], Awaitable],
+    *,
+    attempts: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    description: str = '',
+):
+    """
+    Await fn(), retrying on any exception up to attempts times in total.
+    Sleeps uniform(0, min(max_delay, base_delay * 2^attempt)) between attempts ("full jitter"),
+    so that many shards failing at once do not retry in lockstep.
+    """
+    for attempt in range(attempts):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Attempt {attempt + 1}/{attempts} failed for {description}: {e}. Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def shard_hash(fpath: str, chunk_size: int = 1 << 20) -> str:
+    """Hash of a shard's contents, encoded like llm_log's prompt_hash."""
+    h = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return base64.b64encode(h.digest()).decode()
+
+
+def already_submitted(
+    log: pl.DataFrame,
+    batch_hash: str,
+    *,
+    namespace: str = None,
+    version: str = None,
+    shard: Optional[int] = None,
+) -> bool:
+    """
+    Whether the log already has this shard as submitted or downloaded:
+    either by batch_hash, or (for records from before batch_hash) by namespace, version and shard.
+    """
+    if log is None or log.height == 0:
+        return False
+    done = log.filter(pl.col('status').is_in(['submitted', 'downloaded']))
+    if 'batch_hash' in done.columns and done.filter(pl.col('batch_hash') == batch_hash).height > 0:
+        return True
+    if namespace is None:
+        return False
+    same = done.filter(
+        (pl.col('namespace') == namespace)
+        & (pl.col('version') == str(version))
+        & (pl.col('shard').is_null() if shard is None else pl.col('shard') == shard)
+    )
+    if 'batch_hash' in same.columns:
+        same = same.filter(pl.col('batch_hash').is_null()) # a different hash means the shard was rewritten
+    return same.height > 0
+
+
+@dataclass
+class ShardSubmission:
+    batch_fpath: str
+    shard: Optional[int] = None
+    batch_hash: Optional[str] = None
+
+    status: str = 'local' # local | submitted
+    file_uuid: Optional[str] = None
+    batch_uuid: Optional[str] = None
+    error: Optional[Exception] = None
+
+
+async def submit_shards_async(
+    submissions: list[ShardSubmission],
+    *,
+    llm_provider: str,
+    submit_fn: Callable[..., Awaitable[tuple[str, str]]] = None,
+    limit: SubmitRateLimit = None,
+    attempts: int = 5,
+    base_delay: float = 1.0,
+    on_result: Callable[[ShardSubmission], None] = None,
+) -> list[ShardSubmission]:
+    """
+    Submit every shard concurrently.
+    submit_fn(batch_fpath, custom_llm_provider=, metadata=) -> (file_uuid, batch_uuid); defaults to submit_litellm_batch_file.
+    on_result(submission) is called as each shard finishes (submitted or not), ie. to record it in the llm_log right away.
+    A shard that fails every attempt is left with status 'local' and its error.
+    """
+    if submit_fn is None:
+        from enzyextract.submit.litellm_management import submit_litellm_batch_file
+        submit_fn = submit_litellm_batch_file
+    limit = limit or get_submit_limit(llm_provider)
+    semaphore = asyncio.Semaphore(limit.max_concurrency)
+    rate_limiter = AsyncRateLimiter(limit.per_minute)
+
+    async def run(sub: ShardSubmission):
+        if sub.batch_hash is None:
+            sub.batch_hash = await asyncio.to_thread(shard_hash, sub.batch_fpath)
+
+        async def attempt():
+            await rate_limiter.acquire()
+            return await submit_fn(
+                sub.batch_fpath,
+                custom_llm_provider=llm_provider,
+                metadata={'batch_hash': sub.batch_hash},
+            )
+        async with semaphore:
+            try:
+                sub.file_uuid, sub.batch_uuid = await retry_with_jitter(
+                    attempt, attempts=attempts, base_delay=base_delay, description=sub.batch_fpath
+                )
+                sub.status = 'submitted'
+            except Exception as e:
+                print("Error submitting batch", sub.batch_fpath)
+                print(e)
+                sub.error = e
+        if on_result is not None:
+            on_result(sub)
+        return sub
+
+    return list(await asyncio.gather(*(run(sub) for sub in submissions)))
+
+
+def submit_shards(submissions: list[ShardSubmission], **kwargs) -> list[ShardSubmission]:
+    """Blocking version of submit_shards_async."""
+    return asyncio.run(submit_shards_async(submissions, **kwargs))
@@ -1,13 +1,14 @@
-import asyncio
 import os
+import queue
+import threading
 from typing import Generator, Literal, Optional, Tuple
 import random
 from tqdm import tqdm
 
 from enzyextract.pipeline.llm_log import read_log, update_log
 from enzyextract.submit.base import SubmitPreference, do_presubmit
-from enzyextract.submit.batch_utils import to_openai_batch_request, write_to_jsonl
-from enzyextract.submit.litellm_management import submit_litellm_batch_file
+from enzyextract.submit.batch_utils import JsonlShardWriter, get_batch_limits, print_shard_plan, to_openai_batch_request
+from enzyextract.submit.submit_coordinator import ShardSubmission, already_submitted, shard_hash, submit_shards
 from enzyextract.submit.openai_management import process_env
 from enzyextract.submit.openai_schema import to_openai_batch_request_with_schema
 from enzyextract.utils.namespace_management import validate_namespace
@@ -68,16 +69,23 @@ def stream_submit_batch(
     *,
     need_to_submit: list[str], # list of file paths to submit
     llm_provider: str,
-) -> Generator[Tuple[Literal['submitted', 'local'], str, str, str], None, None]:
+    previous_log: pl.DataFrame = None,
+) -> Generator[Tuple[Literal['submitted', 'local'], str, str, str, str], None, None]:
     """
-    Should yield status, file_uuid, batchname, batch_fpath, corresp_fpath
+    Should yield status, file_uuid, batchname, batch_fpath, batch_hash
+
+    Consent is asked for each shard first, then the consented shards are submitted concurrently
+    (see submit_coordinator), and yielded as each finishes.
+    Shards that previous_log already has as submitted (by batch_hash) are skipped.
+    If submitting fails as a whole (rather than shard by shard), the error is raised here.
     """
     print("Time to submit!")
-    for i, batch_fpath in enumerate(need_to_submit):
-
-        # special case with 1 shard
-        if len(need_to_submit) == 1:
-            i = None
+    to_submit = []
+    for batch_fpath in need_to_submit:
+        batch_hash = shard_hash(batch_fpath)
+        if already_submitted(previous_log, batch_hash):
+            print("Already submitted, skipping", batch_fpath)
+            continue
         
         # read to make sure
         inp = do_presubmit(
@@ -93,26 +101,34 @@ def stream_submit_batch(
             print("Saved untracked copy at", batch_fpath)
             continue
         elif inp == SubmitPreference.YES:
-            try:
-            
-                file_uuid, batchname = asyncio.run(submit_litellm_batch_file(batch_fpath, custom_llm_provider=llm_provider))
-                # if i is None:
-                
-                # else:
-                    # corresp_fpath = f'{corresp_folder}/{namespace}_{version}.{i}.parquet'
-                
-                yield 'submitted', file_uuid, batchname, batch_fpath
-            except Exception as e:
-                print("Error submitting batch", batch_fpath)
-                print(e)
-                yield 'local', None, None, batch_fpath
+            to_submit.append(ShardSubmission(batch_fpath, batch_hash=batch_hash))
         elif inp == SubmitPreference.LOCAL:
             print("Tracked local copy at", batch_fpath)
-            yield 'local', None, None, batch_fpath
+            yield 'local', None, None, batch_fpath, batch_hash
         else:
             print("Unknown consent", inp, "exiting.")
             return
 
+    if not to_submit:
+        return
+    # run the submissions in a background thread, handing back each result as it finishes
+    done = queue.Queue()
+    def run():
+        try:
+            submit_shards(to_submit, llm_provider=llm_provider, on_result=done.put)
+        except BaseException as e:
+            # otherwise the loop below waits forever
+            done.put(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for _ in to_submit:
+        sub = done.get()
+        if isinstance(sub, BaseException):
+            thread.join()
+            raise sub
+        yield sub.status, sub.file_uuid, sub.batch_uuid, sub.batch_fpath, sub.batch_hash
+    thread.join()
+
 def script_classify_images(
     *, 
     namespace: str, # ids
@@ -152,13 +168,15 @@ def script_classify_images(
 
 
 
-    batch = []
     correspondences = []
     corresp_fpath = f'{corresp_folder}/{namespace}_{version}.parquet'
 
     print("Namespace: ", namespace)
 
     will_write_to = f'{batch_folder}/{namespace}_{version}.jsonl'
+    # base64 images are large: shard by bytes as well as by count, and stream to disk (NOTE: overwrites)
+    limits = get_batch_limits(llm_provider)
+    sink = JsonlShardWriter(will_write_to, max_requests=1000, limits=limits)
 
     # TODO: default: we should use code overwrite vs reuse semantics, because sometimes we want different ones
     # if os.path.exists(will_write_to):
@@ -215,32 +233,25 @@ def script_classify_images(
         else:
             req = to_openai_batch_request(custom_id, prompt, docs, 
                                     model_name=model_name)
-        batch.append(req)
+        sink.write(req)
         correspondences.append({"custom_id": custom_id, "index": j, "filepath": fpath})
+    sink.close()
 
     print("Using model", model_name)
     corr_df = pl.DataFrame(correspondences)
     corr_df.write_parquet(corresp_fpath) # NOTE: overwrites
         
-    # write in chunks
+    need_to_submit = [x['path'] for x in sink.manifest]
+    print_shard_plan(sink.manifest, limits)
 
-    chunk_size = 1000
-    have_multiple = len(batch) > chunk_size # need to enforce chunk size, since OpenAI has data size limit
-    need_to_submit = []
-    for i in range(0, len(batch), chunk_size):
-        chunk = batch[i:i+chunk_size]
 
-
-        if have_multiple:
-            will_write_to = f'{batch_folder}/{namespace}_{version}.{i}.jsonl'
-        write_to_jsonl(chunk, will_write_to) # NOTE: overwrites
-        need_to_submit.append(will_write_to)
-
-
-    for status, file_uuid, batchname, batch_fpath in stream_submit_batch(
+    for status, file_uuid, batchname, batch_fpath, batch_hash in stream_submit_batch(
         need_to_submit=need_to_submit,
-        llm_provider=llm_provider
+        llm_provider=llm_provider,
+        previous_log=previous_log,
     ):
+        # same shard numbering as stream_submit_batch
+        i = need_to_submit.index(batch_fpath) if len(need_to_submit) > 1 else None
 
         # update log
         update_log(
@@ -259,7 +270,8 @@ def script_classify_images(
             batch_uuid=batchname,
             batch_fpath=batch_fpath,
             corresp_fpath=corresp_fpath,
-            replace_existing_record=update_if_exists
+            replace_existing_record=update_if_exists,
+            batch_hash=batch_hash,
         )
 
 
@@ -0,0 +1,136 @@
+"""
+JSON backend for the batch (jsonl) read and write paths, which handle files of hundreds of MB.
+
+Uses orjson or msgspec when installed, falling back to the stdlib json module.
+Force a backend with set_json_backend('json'), or the ENZYEXTRACT_JSON_BACKEND environment variable.
+
+Note that orjson and msgspec write compact json ({"a":1}) without ascii escapes,
+so files differ byte-wise (but not in content) from those written with the stdlib.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+available_json_backends = ['json'] + (['orjson'] if orjson is not None else []) + (['msgspec'] if msgspec is not None else [])
+
+# catch this when decoding with any backend
+JSONDecodeError = (json.JSONDecodeError, msgspec.DecodeError) if msgspec is not None else json.JSONDecodeError
+
+json_backend = None
+_loads = None
+_dumpb = None
+
+def _stdlib_dumpb(obj) -> bytes:
+    return json.dumps(obj).encode('utf-8')
+
+def set_json_backend(name: str = None) -> str:
+    """
+    Select the backend by name ('orjson', 'msgspec' or 'json').
+    None picks the fastest installed one. Returns the name of the backend in use.
+    """
+    global json_backend, _loads, _dumpb
+    if name is None:
+        name = 'orjson' if orjson is not None else 'msgspec' if msgspec is not None else 'json'
+    if name not in available_json_backends:
+        raise ValueError(f"JSON backend {name} is not installed (available: {available_json_backends})")
+
+    if name == 'orjson':
+        _loads = orjson.loads
+        _dumpb = lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    elif name == 'msgspec':
+        _loads = msgspec.json.decode
+        _dumpb = msgspec.json.encode
+    else:
+        _loads = json.loads
+        _dumpb = _stdlib_dumpb
+    json_backend = name
+    return name
+
+set_json_backend(os.environ.get('ENZYEXTRACT_JSON_BACKEND') or None)
+
+def loads(data: str | bytes):
+    """Decode a json document (str or utf-8 bytes)."""
+    return _loads(data)
+
+def dumpb(obj) -> bytes:
+    """Encode obj as utf-8 json bytes."""
+    return _dumpb(obj)
+
+def dumps(obj) -> str:
+    """Encode obj as a json str."""
+    return _dumpb(obj).decode('utf-8')
+
+
+def _synthetic_completion(i: int) -> dict:
+    content = (
+        "Thoughts and comments:\n- The Km values are given in mM, and the kcat values are given in min^-1.\n\n"
+        "Final answer:\n```yaml\ndata:\n" + ''.join(
+            f"    - descriptor: \"mutant {i}-{j}, 25 °C\"\n      kcat: \"{i % 997 + j} min^-1\"\n      Km: \"{j / 10} mM\"\n"
+            for j in range(8)
+        ) + "context:\n    enzymes: \"GPI-PLC\"\n```"
+    )
+    return {
+        "id": f"batch_req_{i:024d}", "custom_id": f"ns_v1_{10000000 + i}",
+        "response": {"status_code": 200, "request_id": f"{i:032x}", "body": {
+            "id": f"chatcmpl-{i}", "object": "chat.completion", "created": 1721685435, "model": "gpt-4o-2024-05-13",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "logprobs": None, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 771 + i % 500, "completion_tokens": 356, "total_tokens": 1127 + i % 500},
+            "system_fingerprint": "fp_18cc0f1fa0"}},
+        "error": None,
+    }
+
+def benchmark_json_backends(n_lines=100_000, fpath=None):
+    """
+    Encode and decode a synthetic openai completion file of n_lines lines with every installed backend.
+    fpath: where to write the file (default: a temporary file, removed afterwards)
+    """
+    import tempfile
+    import time
+    objs = [_synthetic_completion(i) for i in range(n_lines)]
+    cleanup = fpath is None
+    if fpath is None:
+        fd, fpath = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+
+    previous = json_backend
+    results = {}
+    try:
+        for name in available_json_backends:
+            set_json_backend(name)
+            start = time.perf_counter()
+            with open(fpath, 'wb') as f:
+                for obj in objs:
+                    f.write(dumpb(obj) + b'\n')
+            encode = time.perf_counter() - start
+
+            # streamed, like stream_jsonl
+            start = time.perf_counter()
+            with open(fpath, 'rb') as f:
+                contents = [loads(line)['response']['body']['choices'][0]['message']['content'] for line in f]
+            decode = time.perf_counter() - start
+            assert len(contents) == n_lines and loads(dumpb(objs[-1])) == objs[-1]
+            results[name] = (encode, decode, os.path.getsize(fpath))
+    finally:
+        set_json_backend(previous)
+        if cleanup:
+            os.remove(fpath)
+
+    base_encode, base_decode, _ = results['json']
+    print(f"{n_lines} completion lines")
+    for name, (encode, decode, size) in results.items():
+        print(f"{name:>8}: encode {encode:.2f}s ({base_encode / encode:.1f}x), "
+              f"decode {decode:.2f}s ({base_decode / decode:.1f}x), {size / 1e6:.0f} MB")
+    return results
+
+if __name__ == '__main__':
+    benchmark_json_backends()
@@ -1,5 +1,6 @@
 import os
 
+from enzyextract.utils import fast_json
 from enzyextract.utils.fresh_version import latest_version, next_available_version
 
 
@@ -21,32 +22,23 @@ def pmids_from_directory(filepath, recursive=False, filetype='.pdf') -> set[str]
     
 
 def pmids_from_batch(path_to_jsonl) -> set[str]:
-    # supports both input and output batches
-    
-    id_prefix  = '{"id": "batch_req_cOTEwOobeyeib0QWIhpo7PWQ"'
-    cid_prefix = ', "custom_id": "'
+    # supports both input and output batches,
+    # written by any json backend (ie. compact '{"custom_id":"' with orjson)
     
     result = set()
-    with open(path_to_jsonl, 'r') as f:
-        # pmid_from_usual_custom_id: int(uuid.split('_', 2)[2])
-        lines = f.readlines()
-    if not lines:
-        return set()
-    if lines[0].startswith('{"custom_id": "'):
-        # mode = 'input'
-        start = len('{"custom_id": "')
-    elif lines[0].startswith('{"id": "batch_req_'):
-        # mode = 'output'
-        start = len('{"id": "batch_req_cOTEwOobeyeib0QWIhpo7PWQ", "custom_id": "')
-    else:
-        raise ValueError("Not a valid batch file: " + path_to_jsonl)
-    
-    for line in lines:
-        custom_id = line[start:line.index('"', start)]
-        assert custom_id.count('_') >= 2, f"Actually, custom_id is {custom_id}"
-        namespace, version, pmid = custom_id.split('_', 2)
-        assert pmid.isdigit(), f"Actually, pmid is {pmid}"
-        result.add(pmid)
+    with open(path_to_jsonl, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = fast_json.loads(line)
+            if not isinstance(obj, dict) or 'custom_id' not in obj:
+                raise ValueError("Not a valid batch file: " + path_to_jsonl)
+            # pmid_from_usual_custom_id: int(uuid.split('_', 2)[2])
+            custom_id = obj['custom_id']
+            assert custom_id.count('_') >= 2, f"Actually, custom_id is {custom_id}"
+            namespace, version, pmid = custom_id.split('_', 2)
+            assert pmid.isdigit(), f"Actually, pmid is {pmid}"
+            result.add(pmid)
     return result
 
 def cache_pmids_to_disk(pmids, namespace, version=None, parent_dir='C:/conjunct/vandy/yang/corpora/manifest/auto'):
@@ -511,8 +511,13 @@ def explode_context(obj: dict, debugpmid=None, yaml_version: int=YamlVersions.OR
     return obj
 
 
-def yaml_to_df(content: str | dict, auto_context=False, version: int=YamlVersions.ONESHOT, debugpmid=None, verbose=True) -> tuple[pd.DataFrame, dict]:
+def yaml_to_rows(content: str | dict, auto_context=False, version: int=YamlVersions.ONESHOT, debugpmid=None) -> tuple[list[dict] | None, dict]:
+    """
+    Like yaml_to_df, but returns the plain row dicts instead of building a (small) pandas frame.
+    Lets callers collect rows across many papers and build a single frame at the end.
 
+    Returns (None, {}) if the yaml is invalid.
+    """
     if isinstance(content, str):
         obj = parse_yaml(content, debugpmid=debugpmid)
         obj['data'] = obj.get('data') or []
@@ -520,7 +525,7 @@ def yaml_to_df(content: str | dict, auto_context=False, version: int=YamlVersion
         obj['context'] = obj.get('context') or {}
         valid = valid and validate_context(obj['context'], debugpmid=debugpmid, version=version)
         if not valid:
-            return pd.DataFrame(), {}
+            return None, {}
         explode_context(obj, debugpmid=debugpmid, yaml_version=version)
     else:
         obj = content
@@ -533,6 +538,14 @@ def yaml_to_df(content: str | dict, auto_context=False, version: int=YamlVersion
 
     if auto_context:
         data = do_auto_context(data, context)
+    return data, context
+
+
+def yaml_to_df(content: str | dict, auto_context=False, version: int=YamlVersions.ONESHOT, debugpmid=None, verbose=True) -> tuple[pd.DataFrame, dict]:
+
+    data, context = yaml_to_rows(content, auto_context=auto_context, version=version, debugpmid=debugpmid)
+    if data is None:
+        return pd.DataFrame(), {}
     df = pd.DataFrame(data)
     df = fix_df_for_yaml(df)
     return df, context
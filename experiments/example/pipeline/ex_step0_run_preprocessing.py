@@ -16,5 +16,6 @@ if __name__ == '__main__':
     process_pdfs(
         pdf_root=pdf_root,
         write_dir=f"{root}/.enzy/pre/tables",
-        micros_path=f"{root}/.enzy/pre/mM/mM.parquet"
+        micros_path=f"{root}/.enzy/pre/mM/mM.parquet",
+        workers=1, # ie. os.cpu_count() // 2 on a big node
     ) 
\ No newline at end of file
@@ -24,4 +24,5 @@ if __name__ == '__main__':
         llm_provider=llm_provider,
         prompt=suggested_prompt,
         structured=structured,
+        text_cache=f'{enzy_root}/cache/page_text.sqlite',
     )
\ No newline at end of file
@@ -0,0 +1,18 @@
+import random
+
+import polars as pl
+
+from enzyextract.hungarian.csv_fix import fix_kcat, fix_km, pl_fix_kcat, pl_fix_km
+
+
+def test_pl_fix_km_kcat_match_rowwise():
+    parts = ['1.5', ' ', 'mm', 'mM', 'nm', 'μM', 'µM', 'uM', 'UM', 'pm', 'Μ', 'M', 'mol/L', 'mmol/l', 'g/L', 'mg/ml',
+             ',', '10³', '×', 'x', 'X', '10⁻⁴', 's⁻¹', 's-1', 'sec-1', 'min−1', 'h–1', "s-'", 'ms-1', 'm-1', 'day-1',
+             'U', '/g', 'l/', 'L', '±', 'é', '(', ')', 'per', 'second']
+    rng = random.Random(0)
+    values = [None] + [''.join(rng.choice(parts) for _ in range(rng.randint(1, 6))) for _ in range(5000)]
+
+    df = pl.DataFrame({'km': values, 'kcat': values}, schema={'km': pl.Utf8, 'kcat': pl.Utf8})
+    df = pl_fix_kcat(pl_fix_km(df))
+    assert df['km'].to_list() == [fix_km(x) for x in values]
+    assert df['kcat'].to_list() == [fix_kcat(x) for x in values]
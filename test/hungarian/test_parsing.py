@@ -1,5 +1,11 @@
+import itertools
+
+import polars as pl
 import pytest
-from enzyextract.hungarian.hungarian_matching import parse_value_and_unit
+from enzyextract.hungarian.hungarian_matching import (
+    cached_parse_value_and_unit, convert_to_true_value, parse_cache_stats, parse_value_and_unit,
+    pl_parse_value_and_unit, pl_parse_values_and_units, value_similarity
+)
 
 
 def test_scinot():
@@ -57,4 +63,46 @@ def test_SE():
     assert value == 10
     assert unit == "mM"
 
-    # value, unit, _ = parse_value_and_unit("10 ± 1
\ No newline at end of file
+    # value, unit, _ = parse_value_and_unit("10 ± 1
+
+def test_pl_parse_value_and_unit_matches_scalar():
+    tokens = ['', '1', '2.50', '0.03', ' ', '.', '±0.2', ' -- 4', '10^', '-3', 'x', ' × 10', '-', 'e', 'E', 'e-',
+              's^-1', 'sec^-1', 'min^-1', 'm^-1', 'h^-1', 'ms^-1', 'mM', 'µM', 'μM', 'nM', 'M', 'mol L^-1',
+              '/s', '/sec', '/min', '/h', '/hr', ' per s', ' per h', 'abc', 'U/mg']
+    values = [''.join(parts) for parts in itertools.product(tokens, repeat=3)]
+    parsed = pl_parse_values_and_units(pl.Series(values + [None]))
+    assert parsed[-1] is None
+
+    for x, result in zip(values, parsed.to_list()):
+        value, unit, _ = parse_value_and_unit(x)
+        if value is None:
+            assert result['value'] is None and result['unit'] is None, x
+            continue
+        assert (result['value'], result['unit']) == (float(value), unit), x # values are stored as floats
+        assert result['true_value'] == convert_to_true_value(value, unit), x
+        assert result['mantissa'] * 10.0 ** result['exponent'] == pytest.approx(value), x
+
+
+def test_pl_parse_value_and_unit_fields():
+    parsed = pl.DataFrame({'kcat': ['4.20 x 10^-3 min^-1', '0.050 mM', '10^3 M', 'n.d.']}).select(
+        pl_parse_value_and_unit(pl.col('kcat'))
+    ).unnest('kcat')
+    assert parsed['mantissa'].to_list() == [4.2, 0.05, 1.0, None]
+    assert parsed['exponent'].to_list() == [-3, 0, 3, None]
+    assert parsed['sigfigs'].to_list() == [3, 2, None, None]
+    assert parsed['unit'].to_list() == ['min^-1', 'mM', 'M', None]
+    assert parsed['true_value'].to_list()[:3] == pytest.approx([4.2e-3 / 60, 0.05 * 1e-3, 1000.0])
+
+
+def test_parse_cache():
+    cached_parse_value_and_unit.cache_clear()
+    pairs = [("1.2 s^-1", "1.2 min^-1"), ("0.5 mM", "500 µM"), ("1.2 s^-1", "12 s^-1")] * 10
+    expected = [value_similarity(a, b, 'km') for a, b in pairs]
+    # five distinct strings
+    assert parse_cache_stats()['misses'] == 5
+    assert parse_cache_stats()['hits'] == 2 * len(pairs) - 5
+    assert parse_cache_stats()['hit_rate'] == pytest.approx(55 / 60)
+
+    for x in ["1.2 s^-1", "0.5 mM", "n.d."]:
+        assert cached_parse_value_and_unit(x) == parse_value_and_unit(x)
+    assert expected[1] == 1
@@ -0,0 +1,86 @@
+import random
+import threading
+
+import polars as pl
+
+from enzyextract.pipeline.llm_log import (
+    _enzy_prefix_rowwise, lookup_log, migrate_log, read_log, separate_prefix, update_log, update_log_records, write_log
+)
+
+
+def _add(log_location, shard, status='submitted', **kwargs):
+    update_log(
+        log_location=log_location, namespace='ns', version='v1', shard=shard, status=status,
+        model_name='gpt-4o', llm_provider='openai', prompt='prompt', structured=False,
+        file_uuid=f'file-{shard}', batch_uuid=f'batch-{shard}',
+        batch_fpath=f'/tmp/.enzy/batches/ns_v1.{shard}.jsonl', corresp_fpath='/tmp/.enzy/corresp/ns_v1.parquet',
+        **kwargs
+    )
+
+
+def test_sqlite_log_matches_tsv(tmp_path):
+    tsv = str(tmp_path / 'llm_log.tsv')
+    db = str(tmp_path / 'llm_log.sqlite')
+    for log_location in [tsv, db]:
+        _add(log_location, 0)
+        _add(log_location, None, status='local', batch_hash='abc')
+        _add(log_location, 1, status='local')
+        _add(log_location, 1, replace_existing_record=True)
+        update_log_records(log_location, [
+            {'namespace': 'ns', 'version': 'v1', 'shard': 0, 'status': 'downloaded', 'completion_fpath': '/tmp/c.jsonl'},
+            {'namespace': 'ns', 'version': 'v1', 'shard': None, 'status': 'downloaded', 'completion_fpath': None},
+        ])
+    assert read_log(db).equals(read_log(tsv))
+    assert read_log(db)['status'].to_list() == ['downloaded', 'downloaded', 'submitted']
+
+    for kwargs in [dict(batch_uuid='batch-1'), dict(namespace='ns', version='v1', shard=None), dict(namespace='ns')]:
+        assert lookup_log(db, **kwargs).equals(lookup_log(tsv, **kwargs)), kwargs
+    assert lookup_log(db, namespace='ns', version='v1', shard=0)['completion_fpath'].to_list() == ['/tmp/c.jsonl']
+
+
+def test_migrate_log(tmp_path):
+    tsv = str(tmp_path / 'llm_log.tsv')
+    log = pl.DataFrame({
+        'namespace': ['ns'], 'version': ['v1'], 'status': ['submitted'], 'structured': [True],
+        '_enzy_prefix': ['/old/.enzy/'], 'batch_fpath': ['batches/ns_v1.jsonl'],
+    })
+    log.write_csv(tsv, separator='\t')
+    db = str(tmp_path / 'llm_log.db')
+    migrate_log(tsv, db)
+    migrated = read_log(db)
+    assert migrated.equals(read_log(tsv))
+    assert migrated['batch_fpath'].to_list() == ['/old/.enzy/batches/ns_v1.jsonl']
+
+    write_log(migrated.clear(), db)
+    assert read_log(db).height == 0
+
+
+def test_sqlite_log_concurrent_writers(tmp_path):
+    db = str(tmp_path / 'llm_log.sqlite')
+    threads = [threading.Thread(target=_add, args=(db, i)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(read_log(db)['shard'].to_list()) == list(range(16))
+
+
+def test_separate_prefix_matches_commonprefix():
+    rng = random.Random(0)
+    roots = ['/a/.enzy/', '/a/.enzy/b/.enzy/', 'C:/é/.enzy/', '/a/', '', '/a/.enzy', '.enzy/']
+    tails = ['', 'batches/x.jsonl', 'batches/y.jsonl', 'corresp/x.parquet', '.enzy/x', 'b', 'c/.enzy/']
+    def path():
+        if rng.random() < 0.2:
+            return None
+        return rng.choice(roots) + rng.choice(tails)
+    rows = [{'batch_fpath': path(), 'corresp_fpath': path(), 'completion_fpath': path()} for _ in range(5000)]
+    rows.append({'batch_fpath': '/a/.enzy/', 'corresp_fpath': '/a/.enzy/', 'completion_fpath': None})
+    log = pl.DataFrame(rows, schema={x: pl.Utf8 for x in rows[0]})
+
+    result = separate_prefix(log)
+    expected = [_enzy_prefix_rowwise(**row) for row in rows]
+    assert result['_enzy_prefix'].to_list() == expected
+    assert result['batch_fpath'].to_list() == [
+        None if row['batch_fpath'] is None else row['batch_fpath'].removeprefix(prefix)
+        for row, prefix in zip(rows, expected)
+    ]
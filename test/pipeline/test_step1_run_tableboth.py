@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+pytest.importorskip("gmft")
+pytest.importorskip("litellm")
+
+from enzyextract.pipeline.step1_run_tableboth import _corrected_pages
+
+
+def _write_pdf(fpath, n_pages):
+    doc = pymupdf.open()
+    for i in range(n_pages):
+        doc.new_page().insert_text((72, 72), f"Km was {i} mM")
+    doc.save(fpath)
+    doc.close()
+
+
+def test_corrected_pages_skips_long_pdfs(tmp_path):
+    text_cache = str(tmp_path / 'page_text.sqlite')
+    _write_pdf(str(tmp_path / 'short.pdf'), 3)
+    _write_pdf(str(tmp_path / 'long.pdf'), 101)
+
+    pages, cache_hit = _corrected_pages(str(tmp_path / 'short.pdf'), 'short', {}, text_cache)
+    assert len(pages) == 3 and cache_hit is False
+    assert _corrected_pages(str(tmp_path / 'short.pdf'), 'short', {}, text_cache) == (pages, True)
+
+    # skipped before correcting, and never cached
+    assert _corrected_pages(str(tmp_path / 'long.pdf'), 'long', {}, text_cache) == (None, False)
+    assert _corrected_pages(str(tmp_path / 'long.pdf'), 'long', {}, None) == (None, None)
+    with sqlite3.connect(text_cache) as conn:
+        assert conn.execute("SELECT pdfname FROM page_text").fetchall() == [('short',)]
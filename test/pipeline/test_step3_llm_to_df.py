@@ -0,0 +1,94 @@
+import json
+
+import polars as pl
+import pytest
+
+pytest.importorskip("ryaml")
+
+from enzyextract.pipeline.step3_llm_to_df import generate_valid_parquet
+
+
+def _batch_line(i: int, content: str) -> dict:
+    return {
+        "custom_id": f"ns_v1_{i}",
+        "response": {"status_code": 200, "body": {
+            "choices": [{"message": {"content": content}, "finish_reason": "length" if i % 11 == 5 else "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10},
+        }},
+    }
+
+
+def _completion(i: int) -> dict:
+    content = "Final answer:\n```yaml\ndata:\n" + ''.join(
+        f"    - descriptor: \"mutant {j}; with NADH; Mg2+\"\n      kcat: \"{i + j} s^-1\"\n      Km: \"0.{j} mM\"\n"
+        for j in range(3)
+    ) + (
+        "context:\n    enzymes:\n        - fullname: \"GPI-PLC\"\n          mutants: \"wild-type; K12A\"\n"
+        "    substrates:\n        - fullname: \"GPI\"\n    temperatures: \"25 °C\"\n```"
+    )
+    if i % 7 == 3:
+        content = "no yaml here"
+    return _batch_line(i, content)
+
+
+def _json_completion(i: int) -> dict:
+    # structured output: context is not validated, so "other" survives
+    return _batch_line(i, json.dumps({
+        "data": [{"descriptor": f"mutant {j}; with NADH; Mg2+", "kcat": f"{i + j} s^-1", "km": f"0.{j} mM"}
+                 for j in range(3)],
+        "context": {"enzymes": ["GPI-PLC"], "substrates": ["GPI"], "pHs": [7.5], "other": ["Mg2+"]},
+    }))
+
+
+def test_generate_valid_parquet_workers(tmp_path):
+    fpath = tmp_path / 'ns_v1.jsonl'
+    n = 40
+    fpath.write_text(''.join(json.dumps(_completion(i)) + '\n' for i in range(n)))
+    corresp_df = pl.DataFrame({'custom_id': [f'ns_v1_{i}' for i in range(n)], 'pmid': [str(1000 + i) for i in range(n)]})
+
+    serial, serial_stats = generate_valid_parquet(
+        str(fpath), corresp_df=corresp_df, write_fpath=str(tmp_path / 'serial.csv'), chunksize=6)
+    parallel, parallel_stats = generate_valid_parquet(
+        str(fpath), corresp_df=corresp_df, write_fpath=str(tmp_path / 'parallel.csv'), workers=2, chunksize=6)
+
+    assert serial_stats == parallel_stats == {'total_ingested': 36, 'valid_pmids': 31}
+    assert serial.equals(parallel)
+    assert (serial.index == parallel.index).all()
+    assert len(serial) == 93
+
+
+def test_generate_valid_parquet_polars_engine(tmp_path):
+    fpath = tmp_path / 'ns_v1.jsonl'
+    n = 40
+    fpath.write_text(''.join(json.dumps(_completion(i)) + '\n' for i in range(n)))
+    corresp_df = pl.DataFrame({'custom_id': [f'ns_v1_{i}' for i in range(n)], 'pmid': [str(1000 + i) for i in range(n)]})
+
+    expected, expected_stats = generate_valid_parquet(
+        str(fpath), corresp_df=corresp_df, write_fpath=str(tmp_path / 'pandas.csv'))
+    result, stats = generate_valid_parquet(
+        str(fpath), corresp_df=corresp_df, write_fpath=str(tmp_path / 'polars.parquet'), engine='polars')
+
+    assert stats == expected_stats
+    assert result.columns == list(expected.columns)
+    assert result.to_dicts() == expected.to_dict('records')
+    # do_auto_context joins these into strings
+    assert result['cofactors'].unique().to_list() == ['with NADH']
+    assert pl.read_parquet(tmp_path / 'polars.parquet').equals(result)
+
+
+def test_generate_valid_parquet_polars_engine_json(tmp_path):
+    fpath = tmp_path / 'ns_v1.jsonl'
+    n = 12
+    fpath.write_text(''.join(json.dumps(_json_completion(i)) + '\n' for i in range(n)))
+    corresp_df = pl.DataFrame({'custom_id': [f'ns_v1_{i}' for i in range(n)], 'pmid': [str(1000 + i) for i in range(n)]})
+
+    expected, _ = generate_valid_parquet(
+        str(fpath), corresp_df=corresp_df, write_fpath=str(tmp_path / 'pandas.csv'), use_yaml=False)
+    result, _ = generate_valid_parquet(
+        str(fpath), corresp_df=corresp_df, write_fpath=str(tmp_path / 'polars.csv'), use_yaml=False, engine='polars')
+
+    assert result.to_dicts() == expected.to_dict('records')
+    assert result['cofactors'].unique().to_list() == ['with NADH']
+    assert result['other'].unique().to_list() == ['Mg2+']
+    assert result['pH'].unique().to_list() == ['7.5']
+    assert (tmp_path / 'polars.csv').read_text() == (tmp_path / 'pandas.csv').read_text()
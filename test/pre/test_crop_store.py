@@ -0,0 +1,46 @@
+import numpy as np
+
+from enzyextract.pre.reocr.crop_store import CropStore, crop_key
+
+
+def _meta(i):
+    return {'pdfname': f'{i}.pdf', 'pageno': 0, 'ctr': i, 'orig_char': 'm', 'orig_after': 'M', 'angle': 0.0,
+            'letter_x0': 1.0, 'letter_y0': 2.0, 'letter_x1': 3.0, 'letter_y1': 4.0,
+            'x0': 1.0, 'y0': 2.0, 'x1': 5.0, 'y1': 4.0}
+
+
+def test_crop_store_roundtrip(tmp_path):
+    rng = np.random.default_rng(0)
+    tiles = [(rng.random((8, 8)) * 255).astype(np.uint8) for _ in range(5)]
+    keys = [crop_key('abc', 0, (i, 0.1 + 1e-6, 10, 20), 288) for i in range(5)]
+
+    store = CropStore(str(tmp_path), segment_size=2)
+    for i, (key, tile) in enumerate(zip(keys, tiles)):
+        store.add(key, tile, _meta(i))
+    store.add(keys[0], tiles[1], _meta(0)) # duplicate is ignored
+    store.flush()
+    assert len(store) == 5
+
+    # reopen from disk
+    store = CropStore(str(tmp_path))
+    assert store.segments == [0, 1, 2]
+    assert crop_key('abc', 0, (3, 0.1, 10, 20), 288) in store
+    for key, tile in zip(keys, tiles):
+        assert np.array_equal(store.get(key), tile)
+    assert store.get(crop_key('abc', 1, (0, 0, 10, 20), 288)) is None
+
+    rows = [row for rows, _ in store.iter_segments() for row in rows['ctr']]
+    assert rows == [0, 1, 2, 3, 4]
+
+
+def test_crop_store_len(tmp_path):
+    tile = np.zeros((8, 8), dtype=np.uint8)
+    store = CropStore(str(tmp_path), segment_size=3)
+    for i in range(4):
+        store.add(crop_key('abc', 0, (i, 0, 10, 20), 288), tile, _meta(i))
+        assert len(store) == i + 1
+    store.add(crop_key('abc', 0, (3, 0, 10, 20), 288), tile, _meta(3))
+    assert len(store) == 4
+    store.flush()
+    assert len(store) == 4
+    assert len(CropStore(str(tmp_path))) == 4
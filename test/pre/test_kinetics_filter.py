@@ -0,0 +1,25 @@
+import re
+
+from enzyextract.pre.table.kinetics_filter import has_kinetics, kinetics_hits, kinetics_families, kinetics_re_s
+
+
+texts = [
+    "The kcat was 3 s-1", "K m = 3 mM", "k_cat/K_M", "turnover number", "catalytic eﬃciency", "CATALYTIC RATE",
+    "k,, values", "k0 = 2", "k0.5 = 2", "enzyme turnover", "μM-1 s-1", "µM−1 min−1", "mM^-1^ s", "Kinetic analysis",
+    "10 mm column", "Michaelis-Menten", "ſteady-ſtate", "steady state", "kDa protein", "nothing to see", "",
+    "Table 1. Buffer at pH 7.5 for 10 min", "KK m", "Km",
+    # re.IGNORECASE also matches dotless and dotted i to i
+    "kınetıc", "KİNETİC", "Mıchaelis", "catalytıc rate",
+]
+
+
+def test_has_kinetics_matches_separate_patterns():
+    for text in texts:
+        assert has_kinetics(text) == any(re.search(x, text) for x in kinetics_re_s), text
+
+
+def test_kinetics_hits_families():
+    for text in texts:
+        expected = {name for name, x in zip(kinetics_families, kinetics_re_s) if x.search(text)}
+        assert kinetics_hits(text) == expected, text
+    assert kinetics_hits("The kcat and Km (Michaelis)") == {'kcat', 'km', 'michaelis'}
@@ -0,0 +1,86 @@
+import numpy as np
+import polars as pl
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+from torchvision.models import resnet18
+from enzyextract.pre.reocr import m_mu_reocr
+from enzyextract.pre.reocr.m_mu_reocr import (
+    _iter_candidate_crops, _iter_pipelined_crops, classify_image, classify_images, dump_images_too, mM_terminating_condition
+)
+
+
+def _write_pdfs(pdf_root, n_pdfs=3):
+    pdf_root.mkdir()
+    for k in range(n_pdfs):
+        doc = pymupdf.open()
+        for pageno in range(2):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Km was {k} mM and {pageno} µM; 2 mmol of Mg", fontsize=9 + k)
+            page.insert_text((72, 100), "kcat 4 s-1 in 10 MM Tris, mM2 mMo", fontsize=12, color=(0.2, 0, 0.6))
+        doc.save(str(pdf_root / f"{1000 + k}.pdf"))
+        doc.close()
+    return [str(1000 + k) for k in range(n_pdfs)]
+
+
+def _model():
+    torch.manual_seed(0)
+    model = resnet18(weights=None)
+    model.fc = torch.nn.Linear(model.fc.in_features, 3)
+    return model.eval()
+
+
+def test_classify_images_matches_classify_image(tmp_path):
+    pdfnames = _write_pdfs(tmp_path / 'pdfs')
+    crops = [img for pdfname in pdfnames for _, img, _ in _iter_candidate_crops(
+        str(tmp_path / 'pdfs'), pdfname, terminating_condition=mM_terminating_condition)]
+    assert len(crops) >= 12
+
+    model = _model()
+    expected = [classify_image(model, img) for img in crops]
+    for batch_size in [1, 5, 64]:
+        result = classify_images(model, crops, batch_size=batch_size)
+        assert [label for label, _ in result] == [label for label, _ in expected]
+        assert max(abs(a - b) for (_, a), (_, b) in zip(result, expected)) < 1e-5
+
+
+def test_pipelined_crops_match_serial(tmp_path):
+    pdf_root = str(tmp_path / 'pdfs')
+    pdfnames = _write_pdfs(tmp_path / 'pdfs')
+    kwargs = dict(terminating_condition=mM_terminating_condition)
+
+    serial = [(meta, np.asarray(img)) for pdfname in pdfnames
+              for meta, img, _ in _iter_candidate_crops(pdf_root, pdfname, **kwargs)]
+    pipelined = [(meta, np.asarray(img)) for meta, img, _ in _iter_pipelined_crops(
+        pdf_root, pdfnames, 'mM', True, render_workers=2, queue_size=4, kwargs=kwargs)]
+    # pdfs are interleaved across workers, but each crop is the same
+    pipelined.sort(key=lambda x: [pdfnames.index(x[0][0][:-len('.pdf')]), *x[0][1:3]])
+    assert len(serial) == len(pipelined) >= 12
+    for (meta, img), (meta2, img2) in zip(serial, pipelined):
+        assert meta == meta2
+        assert np.array_equal(img, img2)
+
+
+def test_dump_images_too_pipelined_and_streamed(tmp_path, monkeypatch):
+    pdf_root = str(tmp_path / 'pdfs')
+    pdfnames = _write_pdfs(tmp_path / 'pdfs')
+    torch.save(_model().state_dict(), tmp_path / 'model.pth')
+    monkeypatch.setattr(m_mu_reocr, 'resnet', None)
+    kwargs = dict(model_path=str(tmp_path / 'model.pth'), save_imgs=False, batch_size=5,
+                  terminating_condition=mM_terminating_condition)
+
+    serial = dump_images_too(pdf_root, pdfnames, None, **kwargs)
+    pipelined = dump_images_too(pdf_root, pdfnames, None, render_workers=2, **kwargs)
+    assert serial.height >= 12
+    assert pipelined.sort('pdfname', 'pageno', 'ctr').equals(serial)
+
+    # one parquet file per classified batch
+    streamed = dump_images_too(pdf_root, pdfnames, None, rows_dest=str(tmp_path / 'rows'), **kwargs)
+    assert isinstance(streamed, pl.LazyFrame)
+    assert len(list((tmp_path / 'rows').iterdir())) == -(-serial.height // 5)
+    assert streamed.collect().equals(serial)
+
+    assert dump_images_too(pdf_root, [], None, rows_dest=str(tmp_path / 'none'), **kwargs).collect().equals(serial.clear())
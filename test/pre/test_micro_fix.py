@@ -0,0 +1,114 @@
+import random
+
+import numpy as np
+import polars as pl
+import pytest
+from enzyextract.pre.reocr.micro_fix import (
+    _iob, _iob_matrix, build_correction_index, determine_replacement, duplex_mM_corrected_text, true_widest_mM_re
+)
+
+
+def _random_bbox(rng: random.Random):
+    x0, y0 = rng.uniform(0, 50), rng.uniform(0, 50)
+    return (x0, y0, x0 + rng.uniform(-2, 20), y0 + rng.uniform(-2, 20))
+
+
+def test_iob_matrix_matches_iob():
+    rng = random.Random(0)
+    corrections = [_random_bbox(rng) for _ in range(40)]
+    words = [_random_bbox(rng) for _ in range(60)]
+    mat = _iob_matrix(np.array(corrections), np.array(words))
+    # pymupdf computes in single precision
+    for k, word in enumerate(words):
+        for n, corr in enumerate(corrections):
+            assert abs(mat[k, n] - _iob(corr, word)) < 1e-4
+
+
+def test_determine_replacement():
+    words = [
+        (10, 10, 30, 20, "mM", 0, 0, 0),
+        (40, 10, 60, 20, "mM", 0, 0, 1),
+        (70, 10, 90, 20, "mM", 0, 0, 2),
+        (10, 30, 30, 40, "Km", 0, 1, 0),
+    ]
+    subset = pl.DataFrame({
+        'real_char': ['mu', 'm', 'mu'],
+        'x0': [11.0, 41.0, 12.0],
+        'y0': [11.0, 11.0, 31.0],
+        'x1': [19.0, 49.0, 20.0],
+        'y1': [19.0, 19.0, 39.0],
+    })
+    result = list(determine_replacement(iter(words), subset, _re=true_widest_mM_re))
+    assert [x[:8] for x in result] == words
+    assert [x[8] for x in result] == ["µM", "mM", None, None]
+
+
+def test_build_correction_index():
+    micro_df = pl.DataFrame({
+        'pdfname': ['a', 'a', 'a', 'b'],
+        'pageno': [0, 0, 1, 0],
+        'real_char': ['mu', 'm', 'mu', 'M'],
+        'x0': [1.0, 2.0, 3.0, 4.0],
+        'y0': [1.0, 2.0, 3.0, 4.0],
+        'x1': [5.0, 6.0, 7.0, 8.0],
+        'y1': [5.0, 6.0, 7.0, 8.0],
+    })
+    index = build_correction_index(micro_df)
+    assert set(index) == {('a', 0), ('a', 1)}
+    assert index[('a', 0)]['mu'].tolist() == [[1.0, 1.0, 5.0, 5.0]]
+    assert index[('a', 0)]['m'].tolist() == [[2.0, 2.0, 6.0, 6.0]]
+    assert index[('a', 1)]['m'].shape == (0, 4)
+
+
+def _baseline_corrected_text(doc, pdfname, index, _re):
+    """duplex_mM_corrected_text before the single join: the page text grown word by word."""
+    pymupdf = pytest.importorskip("pymupdf")
+    result = []
+    for pageno, page in enumerate(doc):
+        subset = index.get((pdfname, pageno))
+        orig_text = page.get_text('text')
+        if subset is None or len(subset['mu']) == 0:
+            result.append(orig_text)
+            continue
+        new_text = ""
+        scrolling_cursor = 0
+        for x0, y0, x1, y1, word, blockno, lineno, wordno, replacement in determine_replacement(
+                page.get_text('words', flags=pymupdf.TEXTFLAGS_WORDS), subset, _re=_re):
+            up_to = orig_text.index(word, scrolling_cursor)
+            whitespace = orig_text[scrolling_cursor:up_to]
+            new_text += whitespace + (word if replacement is None else replacement)
+            scrolling_cursor = up_to + len(word)
+        result.append(new_text)
+    return result
+
+
+def test_duplex_mM_corrected_text_matches_baseline():
+    pymupdf = pytest.importorskip("pymupdf")
+    doc = pymupdf.open()
+    lines = [
+        "Km was 5 mM and 3 \x01M, kcat 2 µM",
+        "in 10 mM Tris with 2 mmol MgCl2; mM2 mMo",
+        "\x02M\x03 and MM at 25 °C, then  4 mM\tHEPES",
+    ]
+    for pageno in range(3):
+        page = doc.new_page()
+        for i, line in enumerate(lines[pageno:] + lines[:pageno]):
+            page.insert_text((72, 72 + 20 * i), line)
+
+    # alternate mu and m corrections over the first letter of every mM-like word (page 2 has none)
+    rows = []
+    for pageno in range(2):
+        words = [w for w in doc[pageno].get_text('words') if true_widest_mM_re.search(w[4])]
+        for k, (x0, y0, x1, y1, *_) in enumerate(words):
+            rows.append(('123', pageno, 'mu' if k % 3 != 1 else 'm', x0 + 0.5, y0 + 0.5, (x0 + x1) / 2, y1 - 0.5))
+    micro_df = pl.DataFrame(rows, orient='row', schema=['pdfname', 'pageno', 'real_char', 'x0', 'y0', 'x1', 'y1'])
+    index = build_correction_index(micro_df)
+
+    expected = _baseline_corrected_text(doc, '123', index, true_widest_mM_re)
+    result = duplex_mM_corrected_text(doc, '123', index, _re=true_widest_mM_re)
+    assert [x.encode('utf-8') for x in result] == [x.encode('utf-8') for x in expected]
+    assert result == duplex_mM_corrected_text(doc, '123', micro_df, _re=true_widest_mM_re)
+    # something was actually corrected, and the control characters between words survive
+    assert result[0] != doc[0].get_text('text') and 'µM' in result[0].replace('2 µM', '')
+    assert '\x01M' in result[0]
+    assert result[2] == doc[2].get_text('text')
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+from PIL import Image
+from torchvision.models import resnet18
+from enzyextract.pre.reocr.crop_store import CropStore, crop_key
+from enzyextract.pre.reocr.m_mu_reocr import (
+    check_export_parity, classify_images, crop_to_tile, export_torchscript, load_resnet_checkpoint
+)
+
+
+def test_torchscript_parity(tmp_path):
+    torch.manual_seed(0)
+    model = resnet18(weights=None)
+    model.fc = torch.nn.Linear(model.fc.in_features, 3)
+    torch.save(model.state_dict(), tmp_path / "model.pth")
+
+    rng = np.random.default_rng(0)
+    holdout = [Image.fromarray((rng.random((30, 20 + i, 3)) * 255).astype('uint8')) for i in range(12)]
+
+    dest = export_torchscript(str(tmp_path / "model.pth"), str(tmp_path / "model.pt"), holdout=holdout)
+    exported = torch.jit.load(dest)
+    mismatched, max_diff = check_export_parity(load_resnet_checkpoint(str(tmp_path / "model.pth"), device='cpu'), exported, holdout)
+    assert mismatched == 0
+    assert max_diff < 1e-4
+
+
+def test_stored_tile_parity(tmp_path):
+    torch.manual_seed(0)
+    model = resnet18(weights=None)
+    model.fc = torch.nn.Linear(model.fc.in_features, 3)
+
+    rng = np.random.default_rng(0)
+    crops = [Image.fromarray((rng.random((40 + 3 * i, 90 - 5 * i, 3)) * 255).astype('uint8')) for i in range(8)]
+    store = CropStore(str(tmp_path), segment_size=3)
+    keys = [crop_key('abc', 0, (i, 0, 10, 20), 288) for i in range(len(crops))]
+    for key, crop in zip(keys, crops):
+        store.add(key, crop_to_tile(crop), {'pageno': 0})
+    store.flush()
+    tiles = [CropStore(str(tmp_path)).get(key) for key in keys]
+
+    # a crop scored from the store must score exactly like the freshly rendered crop
+    assert classify_images(model, tiles, batch_size=3) == classify_images(model, crops, batch_size=3)
@@ -0,0 +1,24 @@
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+pytest.importorskip("gmft")
+
+from enzyextract.pre.table.scan_tables import kinetics_candidate_pages, process_pdf, setup_directories
+
+
+def test_process_pdf_unreadable_with_prefilter(tmp_path):
+    doc = pymupdf.open()
+    doc.new_page().insert_text((72, 72), "The kcat was 3 s-1")
+    data = doc.tobytes()
+    pdf_root = tmp_path / 'pdfs'
+    pdf_root.mkdir()
+    (pdf_root / 'truncated.pdf').write_bytes(data[:20])
+    write_dir = str(tmp_path / 'out')
+    setup_directories(write_dir)
+
+    assert kinetics_candidate_pages(str(pdf_root / 'truncated.pdf')) == (None, 0)
+    stats = {}
+    # unreadable pdfs are marked seen rather than killing the run
+    assert process_pdf('truncated.pdf', str(pdf_root), None, detector=None, formatter=None, write_dir=write_dir,
+                       prefilter=True, stats=stats)
+    assert stats == {}
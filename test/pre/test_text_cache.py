@@ -0,0 +1,67 @@
+import subprocess
+import sys
+
+import polars as pl
+
+from enzyextract.pre.reocr.micro_fix import true_widest_mM_re
+from enzyextract.pre.reocr.text_cache import PageTextCache, correction_fingerprint, file_hash
+
+
+def _micro(x0):
+    return pl.DataFrame({
+        'pdfname': ['123', '123'],
+        'pageno': [0, 1],
+        'real_char': ['mu', 'm'],
+        'x0': [x0, 41.0],
+        'y0': [11.0, 11.0],
+        'x1': [19.0, 49.0],
+        'y1': [19.0, 19.0],
+    })
+
+
+def test_text_cache_hit_and_misses(tmp_path):
+    pdf = tmp_path / '123.pdf'
+    pdf.write_bytes(b'%PDF-1.4 first version')
+    pdf_hash = file_hash(str(pdf))
+    fingerprint = correction_fingerprint(_micro(11.0), true_widest_mM_re)
+    # same corrections in another row order
+    assert correction_fingerprint(_micro(11.0).reverse(), true_widest_mM_re) == fingerprint
+
+    cache = PageTextCache(str(tmp_path / 'cache' / 'page_text.sqlite'))
+    assert cache.get(pdf_hash, fingerprint) is None
+    cache.put(pdf_hash, fingerprint, ['page 1 µM', 'page 2 mM'], pdfname='123')
+    assert cache.get(pdf_hash, fingerprint) == ['page 1 µM', 'page 2 mM']
+
+    # the pdf changes
+    pdf.write_bytes(b'%PDF-1.4 second version')
+    assert cache.get(file_hash(str(pdf)), fingerprint) is None
+
+    # the corrections change
+    moved = correction_fingerprint(_micro(12.0), true_widest_mM_re)
+    assert moved != fingerprint
+    assert cache.get(pdf_hash, moved) is None
+    assert correction_fingerprint(_micro(11.0), None) != fingerprint
+    cache.close()
+
+
+def test_text_cache_invalidate_cli(tmp_path):
+    db_path = str(tmp_path / 'page_text.sqlite')
+    cache = PageTextCache(db_path)
+    for pmid in ['1', '2', '3']:
+        cache.put(f'hash{pmid}', 'fp', [pmid], pdfname=pmid)
+    cache.close()
+
+    def cli(*args):
+        return subprocess.run([sys.executable, '-m', 'enzyextract.pre.reocr.text_cache', db_path, *args],
+                              capture_output=True, text=True, check=True).stdout
+
+    assert "Removed 2 cached entries" in cli('1', '3')
+    cache = PageTextCache(db_path)
+    assert cache.get('hash1', 'fp') is None
+    assert cache.get('hash2', 'fp') == ['2']
+    cache.close()
+
+    assert "Removed 1 cached entries" in cli()
+    cache = PageTextCache(db_path)
+    assert cache.get('hash2', 'fp') is None
+    cache.close()
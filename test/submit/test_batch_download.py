@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import polars as pl
+import pytest
+
+pytest.importorskip("requests")
+
+from enzyextract.pipeline.llm_log import llm_log_schema, read_log, write_log
+from enzyextract.submit.batch_download import (
+    AnthropicDownloadClient, IncompleteDownloadError, OpenAIDownloadClient, default_download_client, download_async, write_chunks
+)
+
+
+batches = {
+    'batch_a': {'status': 'completed', 'output_file_id': 'file_a', 'error_file_id': None,
+                'request_counts': {'total': 5000, 'completed': 5000, 'failed': 0}},
+    'batch_b': {'status': 'completed', 'output_file_id': 'file_b', 'error_file_id': 'file_b_err',
+                'request_counts': {'total': 2, 'completed': 1, 'failed': 1}},
+    'batch_c': {'status': 'in_progress', 'output_file_id': None, 'error_file_id': None},
+    # the server hands back fewer lines than the batch has requests
+    'batch_d': {'status': 'completed', 'output_file_id': 'file_a', 'error_file_id': None,
+                'request_counts': {'total': 6000, 'completed': 6000, 'failed': 0}},
+    # two shards of one namespace/version, both with errors
+    'batch_e': {'status': 'completed', 'output_file_id': 'file_b', 'error_file_id': 'file_e_err',
+                'request_counts': {'total': 2, 'completed': 1, 'failed': 1}},
+    'batch_f': {'status': 'completed', 'output_file_id': 'file_b', 'error_file_id': 'file_f_err',
+                'request_counts': {'total': 3, 'completed': 1, 'failed': 2}},
+}
+files = {
+    'file_a': b''.join(b'{"custom_id": "ns_1_%d"}\n' % i for i in range(5000)),
+    'file_b': b'{"custom_id": "ns_2_0"}\n',
+    'file_b_err': b'{"custom_id": "ns_2_1", "error": "oops"}\n',
+    'file_e_err': b'{"custom_id": "ns_6_0", "error": "oops"}\n',
+    'file_f_err': b''.join(b'{"custom_id": "ns_6_%d", "error": "oops"}\n' % i for i in range(1, 3)),
+}
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts[0] == 'batches' and parts[1] in batches:
+            body = json.dumps({'id': parts[1], 'endpoint': '/v1/chat/completions', **batches[parts[1]]}).encode()
+        elif parts[0] == 'files' and parts[1] in files:
+            body = files[parts[1]]
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_openai():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_download_async(tmp_path, fake_openai):
+    log_location = str(tmp_path / 'llm_log.tsv')
+    log = pl.DataFrame({
+        'namespace': ['ns', 'ns', 'ns', 'ns', 'ns'],
+        'version': ['1', '2', '3', '4', '5'],
+        'shard': [None, None, None, None, None],
+        'status': ['submitted', 'submitted', 'submitted', 'downloaded', 'submitted'],
+        'llm_provider': ['openai'] * 5,
+        'batch_uuid': ['batch_a', 'batch_b', 'batch_c', 'batch_a', 'batch_d'],
+    }, schema_overrides=llm_log_schema)
+    write_log(pl.concat([pl.DataFrame(schema=llm_log_schema), log], how='diagonal_relaxed'), log_location)
+
+    client = OpenAIDownloadClient(base_url=fake_openai, api_key='test')
+    updates = asyncio.run(download_async(
+        log_location, str(tmp_path / 'completions'), str(tmp_path / 'errors'),
+        max_concurrency=2, clients={'openai': client}, chunk_size=1024,
+    ))
+    assert sorted(x['version'] for x in updates) == ['1', '2']
+    assert (tmp_path / 'completions' / 'ns_1.jsonl').read_bytes() == files['file_a']
+    assert (tmp_path / 'completions' / 'ns_2.jsonl').read_bytes() == files['file_b']
+    assert (tmp_path / 'errors' / 'ns_2.jsonl').read_bytes() == files['file_b_err']
+    assert not (tmp_path / 'completions' / 'ns_3.jsonl').exists()
+    # the incomplete download is not kept, so the next run fetches it again
+    assert not (tmp_path / 'completions' / 'ns_5.jsonl').exists()
+    assert not (tmp_path / 'completions' / 'ns_5.jsonl.part').exists()
+
+    result = read_log(log_location).sort('version')
+    assert result['status'].to_list() == ['downloaded', 'downloaded', 'submitted', 'downloaded', 'submitted']
+    assert result['completion_fpath'][0] == str(tmp_path / 'completions' / 'ns_1.jsonl')
+
+
+def test_download_async_sharded_errors(tmp_path, fake_openai):
+    log_location = str(tmp_path / 'llm_log.tsv')
+    log = pl.DataFrame({
+        'namespace': ['ns', 'ns'],
+        'version': ['6', '6'],
+        'shard': [0, 1],
+        'status': ['submitted', 'submitted'],
+        'llm_provider': ['openai'] * 2,
+        'batch_uuid': ['batch_e', 'batch_f'],
+    }, schema_overrides=llm_log_schema)
+    write_log(pl.concat([pl.DataFrame(schema=llm_log_schema), log], how='diagonal_relaxed'), log_location)
+
+    client = OpenAIDownloadClient(base_url=fake_openai, api_key='test')
+    updates = asyncio.run(download_async(
+        log_location, str(tmp_path / 'completions'), str(tmp_path / 'errors'),
+        max_concurrency=2, clients={'openai': client}, chunk_size=16,
+    ))
+    assert sorted(x['shard'] for x in updates) == [0, 1]
+    assert (tmp_path / 'errors' / 'ns_6.0.jsonl').read_bytes() == files['file_e_err']
+    assert (tmp_path / 'errors' / 'ns_6.1.jsonl').read_bytes() == files['file_f_err']
+    assert read_log(log_location)['status'].to_list() == ['downloaded', 'downloaded']
+
+
+def test_write_chunks(tmp_path):
+    dest = str(tmp_path / 'out.jsonl')
+    assert write_chunks(iter([b'{"a": 1}\n{"a"', b': 2}\n', b'{"a": 3}']), dest, expected_lines=3) == 3
+    assert open(dest, 'rb').read() == b'{"a": 1}\n{"a": 2}\n{"a": 3}'
+
+    dest = str(tmp_path / 'short.jsonl')
+    with pytest.raises(IncompleteDownloadError):
+        write_chunks(iter([b'{"a": 1}\n']), dest, expected_lines=2)
+    assert not os.path.exists(dest) and not os.path.exists(dest + '.part')
+
+    def interrupted():
+        yield b'{"a": 1}\n'
+        raise ConnectionError
+    with pytest.raises(ConnectionError):
+        write_chunks(interrupted(), dest)
+    assert not os.path.exists(dest) and not os.path.exists(dest + '.part')
+
+
+def test_download_client_base_urls(monkeypatch, fake_openai):
+    for name in ['OPENAI_BASE_URL', 'OPENAI_API_BASE', 'ANTHROPIC_BASE_URL', 'ANTHROPIC_API_BASE']:
+        monkeypatch.delenv(name, raising=False)
+    assert OpenAIDownloadClient().base_url == 'https://api.openai.com/v1'
+    assert AnthropicDownloadClient().base_url == 'https://api.anthropic.com'
+
+    # the same environment as litellm (openai) and the anthropic sdk
+    monkeypatch.setenv('OPENAI_API_BASE', fake_openai + '/')
+    client = OpenAIDownloadClient(api_key='test')
+    assert client.base_url == fake_openai
+    assert client.retrieve_batch('batch_a').status == 'completed'
+    monkeypatch.setenv('OPENAI_BASE_URL', 'http://proxy.local/v1')
+    assert OpenAIDownloadClient().base_url == 'http://proxy.local/v1'
+
+    monkeypatch.setenv('ANTHROPIC_API_BASE', 'http://proxy.local/v1/messages')
+    assert AnthropicDownloadClient().base_url == 'http://proxy.local'
+    monkeypatch.setenv('ANTHROPIC_BASE_URL', 'http://other.local/')
+    assert AnthropicDownloadClient().base_url == 'http://other.local'
+
+    # litellm configured in code: keep going through litellm
+    fake_litellm = SimpleNamespace(api_base=None, client_session=None, aclient_session=None)
+    monkeypatch.setitem(sys.modules, 'litellm', fake_litellm)
+    assert isinstance(default_download_client('openai'), OpenAIDownloadClient)
+    fake_litellm.api_base = 'http://proxy.local/v1'
+    assert default_download_client('openai') is None
+    assert isinstance(default_download_client('anthropic'), AnthropicDownloadClient)
+    assert default_download_client('vertex_ai') is None
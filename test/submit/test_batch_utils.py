@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+
+from enzyextract.submit.batch_utils import JsonlShardWriter, chunked_write_to_jsonl
+
+
+def _read(fpath):
+    with open(fpath, 'r') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_single_shard_keeps_filepath(tmp_path):
+    dest = str(tmp_path / "ns_v1.jsonl")
+    batch = [{'custom_id': f'ns_v1_{i}'} for i in range(5)]
+    assert chunked_write_to_jsonl(batch, dest, chunk_size=10) == [dest]
+    assert _read(dest) == batch
+    assert os.listdir(tmp_path) == ["ns_v1.jsonl"]
+
+
+def test_rollover_on_count_and_bytes(tmp_path):
+    dest = str(tmp_path / "ns_v1.jsonl")
+    batch = [{'custom_id': f'ns_v1_{i}', 'body': 'x' * (100 if i == 3 else 10)} for i in range(7)]
+    with JsonlShardWriter(dest, max_requests=3, max_bytes=150) as sink:
+        for item in (x for x in batch):
+            sink.write(item)
+
+    paths = [x['path'] for x in sink.manifest]
+    assert paths == [str(tmp_path / f"ns_v1.{i}.jsonl") for i in (0, 3, 4)]
+    assert [x['n_requests'] for x in sink.manifest] == [3, 1, 3]
+    assert [row for fpath in paths for row in _read(fpath)] == batch
+    assert all(x['n_bytes'] == os.path.getsize(x['path']) for x in sink.manifest)
+    assert not [x for x in os.listdir(tmp_path) if x.endswith('.part')]
+
+
+def test_skip_existing(tmp_path):
+    dest = str(tmp_path / "ns_v1.jsonl")
+    chunked_write_to_jsonl([{'a': i} for i in range(4)], dest, chunk_size=2)
+    with JsonlShardWriter(dest, max_requests=2, skip_existing=True) as sink:
+        for i in range(4):
+            sink.write({'b': i})
+    assert [x['reused'] for x in sink.manifest] == [True, True]
+    assert _read(sink.manifest[0]['path']) == [{'a': 0}, {'a': 1}]
+
+
+def test_provider_limits_and_oversize(tmp_path):
+    from PIL import Image
+    from enzyextract.submit.batch_utils import BatchLimits, estimate_request_tokens, to_openai_batch_request
+
+    img = Image.new('RGB', (16, 16))
+    req = to_openai_batch_request('ns_v1_0', 'a' * 400, ['b' * 400, img], detail='low')
+    assert estimate_request_tokens(req) == 200 + 85
+
+    limits = BatchLimits(max_bytes=10_000, max_requests=2, max_request_tokens=150)
+    with JsonlShardWriter(str(tmp_path / "ns_v1.jsonl"), max_requests=1000, limits=limits) as sink:
+        sink.write(req)
+        sink.write(to_openai_batch_request('ns_v1_1', 'short', ['doc']))
+        sink.write(to_openai_batch_request('ns_v1_2', 'short', ['doc']))
+    assert sink.max_requests == 2
+    assert [x['n_requests'] for x in sink.manifest] == [2, 1]
+    assert sink.manifest[0]['oversize'] == ['ns_v1_0']
+    assert sink.manifest[1]['oversize'] == []
+
+
+def test_json_backends_roundtrip(tmp_path):
+    from enzyextract.utils import fast_json
+    from enzyextract.submit.batch_utils import decode_custom_id, get_batch_input, to_openai_batch_request, write_to_jsonl
+
+    batch = [to_openai_batch_request(f'ns_v1_{i}', 'system', [f'doc {i} µM °C']) for i in range(3)]
+    previous = fast_json.json_backend
+    try:
+        for name in fast_json.available_json_backends:
+            fast_json.set_json_backend(name)
+            dest = str(tmp_path / f"{name}.jsonl")
+            write_to_jsonl(batch, dest)
+            assert decode_custom_id(dest) == 'ns_v1_0'
+            assert get_batch_input(dest) == [(f'ns_v1_{i}', [f'doc {i} µM °C']) for i in range(3)]
+    finally:
+        fast_json.set_json_backend(previous)
+
+
+def test_pmids_from_batch_compact(tmp_path):
+    pytest.importorskip('orjson')
+    from enzyextract.utils import fast_json
+    from enzyextract.submit.batch_utils import to_openai_batch_request, write_to_jsonl
+    from enzyextract.utils.pmid_management import pmids_from_batch
+
+    batch = [to_openai_batch_request(f'ns_v1_{1000 + i}', 'system', ['doc']) for i in range(3)]
+    outputs = [{"id": f"batch_req_{i}", "custom_id": f"ns_v1_{1000 + i}", "response": None, "error": None}
+               for i in range(3)]
+    previous = fast_json.json_backend
+    try:
+        fast_json.set_json_backend('orjson')
+        write_to_jsonl(batch, str(tmp_path / "input.jsonl"))
+        write_to_jsonl(outputs, str(tmp_path / "output.jsonl"))
+    finally:
+        fast_json.set_json_backend(previous)
+    assert (tmp_path / "input.jsonl").read_text().startswith('{"custom_id":"')
+    assert pmids_from_batch(str(tmp_path / "input.jsonl")) == {'1000', '1001', '1002'}
+    assert pmids_from_batch(str(tmp_path / "output.jsonl")) == {'1000', '1001', '1002'}
+
+    (tmp_path / "other.jsonl").write_text('{"pmid": "1000"}\n')
+    with pytest.raises(ValueError, match="Not a valid batch file"):
+        pmids_from_batch(str(tmp_path / "other.jsonl"))
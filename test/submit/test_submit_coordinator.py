@@ -0,0 +1,85 @@
+import asyncio
+
+import polars as pl
+import pytest
+
+from enzyextract.pipeline.llm_log import llm_log_schema
+from enzyextract.submit.submit_coordinator import (
+    ShardSubmission, SubmitRateLimit, already_submitted, shard_hash, submit_shards
+)
+
+
+def test_submit_shards(tmp_path):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f'ns_v1.{i}.jsonl'
+        path.write_text(f'{{"custom_id": "ns_v1_{i}"}}\n')
+        paths.append(str(path))
+
+    in_flight = 0
+    max_in_flight = 0
+    calls = {}
+    async def fake_submit(fpath, custom_llm_provider, metadata):
+        nonlocal in_flight, max_in_flight
+        calls[fpath] = calls.get(fpath, 0) + 1
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if fpath == paths[1] and calls[fpath] < 3:
+            raise ConnectionError("flaky")
+        if fpath == paths[2]:
+            raise ValueError("always fails")
+        assert metadata['batch_hash'] == shard_hash(fpath)
+        return f'file-{fpath[-7]}', f'batch-{fpath[-7]}'
+
+    recorded = []
+    results = submit_shards(
+        [ShardSubmission(x, shard=i) for i, x in enumerate(paths)],
+        llm_provider='openai', submit_fn=fake_submit, on_result=recorded.append,
+        limit=SubmitRateLimit(max_concurrency=2, per_minute=60_000), attempts=3, base_delay=0.001,
+    )
+    assert max_in_flight == 2
+    assert calls[paths[1]] == 3 and calls[paths[2]] == 3
+    assert [x.status for x in results] == ['submitted', 'submitted', 'local', 'submitted', 'submitted', 'submitted']
+    assert results[0].batch_uuid == 'batch-0' and results[2].batch_uuid is None
+    assert isinstance(results[2].error, ValueError)
+    assert sorted(x.shard for x in recorded) == list(range(6))
+
+
+def test_already_submitted(tmp_path):
+    path = tmp_path / 'ns_v1.jsonl'
+    path.write_text('{"custom_id": "ns_v1_0"}\n')
+    batch_hash = shard_hash(str(path))
+    log = pl.DataFrame({
+        'namespace': ['ns', 'ns', 'old'],
+        'version': ['v1', 'v1', 'v1'],
+        'shard': [0, 1, None],
+        'status': ['submitted', 'local', 'downloaded'],
+        'batch_hash': [batch_hash, 'other', None],
+    }, schema_overrides=llm_log_schema)
+
+    assert already_submitted(log, batch_hash)
+    assert not already_submitted(log, 'other') # only tracked locally, so submit it
+    assert not already_submitted(log, 'new', namespace='ns', version='v1', shard=0) # rewritten since
+    # records from before batch_hash
+    assert already_submitted(log, 'new', namespace='old', version='v1', shard=None)
+    assert not already_submitted(log, 'new', namespace='old', version='v1', shard=3)
+    assert not already_submitted(None, batch_hash)
+
+
+def test_stream_submit_batch_raises(tmp_path, monkeypatch):
+    pytest.importorskip('openai')
+    from enzyextract.submit import submit_scripts
+    from enzyextract.submit.base import SubmitPreference
+
+    path = tmp_path / 'ns_v1.jsonl'
+    path.write_text('{"custom_id": "ns_v1_0"}\n')
+    def broken_submit(submissions, **kwargs):
+        raise RuntimeError("event loop died")
+    monkeypatch.setattr(submit_scripts, 'do_presubmit', lambda **kwargs: SubmitPreference.YES)
+    monkeypatch.setattr(submit_scripts, 'submit_shards', broken_submit)
+
+    # used to wait on the result queue forever
+    with pytest.raises(RuntimeError, match="event loop died"):
+        list(submit_scripts.stream_submit_batch(need_to_submit=[str(path)], llm_provider='openai'))